@@ -10,7 +10,7 @@ import logging
 import sqlalchemy as sa
 
 from config import Config
-from models import db, User, WorkPlan, WorkPlanTask, Company, Region, Location, Employee, Supplier, LeaveType, FinancialPeriod, Account, SystemSettings
+from models import db, User, WorkPlan, WorkPlanTask, Company, Region, Location, Employee, Supplier, LeaveType, FinancialPeriod, Account, SystemSettings, AccountBalance
 from blueprints import register_all_blueprints
 
 app = Flask(__name__)
@@ -217,6 +217,51 @@ def auto_migrate():
                 if 'already exists' not in str(e).lower():
                     print(f"  ! {table}.{column}: {e}")
 
+    def backfill(table, column, expressions):
+        """تعبئة عمود جديد للصفوف القديمة (تعبير SQL لكل نوع قاعدة بيانات)"""
+        expression = expressions.get(db.engine.dialect.name)
+        if not expression or not inspector.has_table(table):
+            return
+        try:
+            result = db.session.execute(sa.text(
+                f'UPDATE {table} SET {column} = {expression} WHERE {column} IS NULL'
+            ))
+            db.session.commit()
+            if result.rowcount:
+                print(f"  ~ {table}.{column}: {result.rowcount} rows")
+        except Exception as e:
+            db.session.rollback()
+            print(f"  ! {table}.{column} backfill: {e}")
+
+    def add_index(name, table, columns, unique=False):
+        try:
+            indexes = [i['name'] for i in inspector.get_indexes(table)]
+        except Exception:
+            return
+        if name not in indexes:
+            try:
+                kind = 'UNIQUE INDEX' if unique else 'INDEX'
+                db.session.execute(sa.text(f'CREATE {kind} IF NOT EXISTS {name} ON {table} ({columns})'))
+                db.session.commit()
+                print(f"  + index {name}")
+            except Exception as e:
+                db.session.rollback()
+                print(f"  ! index {name}: {e}")
+
+    def drop_index(name, table):
+        try:
+            indexes = [i['name'] for i in inspector.get_indexes(table)]
+        except Exception:
+            return
+        if name in indexes:
+            try:
+                db.session.execute(sa.text(f'DROP INDEX IF EXISTS {name}'))
+                db.session.commit()
+                print(f"  - index {name}")
+            except Exception as e:
+                db.session.rollback()
+                print(f"  ! index {name}: {e}")
+
     print("Auto-migration: checking columns...")
     add_column('users', 'employee_id', 'INTEGER')
     add_column('users', 'allowed_pages', 'TEXT')
@@ -249,6 +294,46 @@ def auto_migrate():
     add_column('salaries', 'is_calculated', 'BOOLEAN', 'FALSE')
     add_column('salaries', 'calculated_at', 'TIMESTAMP')
 
+    # الشهر المالي للراتب مطبّعاً من month_year (MM-YYYY / YYYY-MM / YYYYMMDD_YYYYMMDD)
+    add_column('salaries', 'period_year', 'INTEGER')
+    add_column('salaries', 'period_month', 'INTEGER')
+    backfill('salaries', 'period_year', {
+        'postgresql': r"""CASE
+            WHEN month_year ~ '^\d{4}-\d{1,2}$' THEN CAST(split_part(month_year, '-', 1) AS INTEGER)
+            WHEN month_year ~ '^\d{1,2}-\d{4}$' THEN CAST(split_part(month_year, '-', 2) AS INTEGER)
+            WHEN month_year ~ '^\d{8}_\d{8}$' THEN CAST(substr(month_year, 10, 4) AS INTEGER)
+        END""",
+        'sqlite': """CASE
+            WHEN month_year GLOB '[0-9][0-9][0-9][0-9]-[0-9]*' THEN CAST(substr(month_year, 1, 4) AS INTEGER)
+            WHEN month_year GLOB '[0-9]*-[0-9][0-9][0-9][0-9]' THEN CAST(substr(month_year, instr(month_year, '-') + 1) AS INTEGER)
+            WHEN month_year GLOB '[0-9][0-9][0-9][0-9][0-9][0-9][0-9][0-9]_[0-9]*' THEN CAST(substr(month_year, 10, 4) AS INTEGER)
+        END""",
+    })
+    backfill('salaries', 'period_month', {
+        'postgresql': r"""CASE
+            WHEN month_year ~ '^\d{4}-\d{1,2}$' THEN CAST(split_part(month_year, '-', 2) AS INTEGER)
+            WHEN month_year ~ '^\d{1,2}-\d{4}$' THEN CAST(split_part(month_year, '-', 1) AS INTEGER)
+            WHEN month_year ~ '^\d{8}_\d{8}$' THEN CAST(substr(month_year, 14, 2) AS INTEGER)
+        END""",
+        'sqlite': """CASE
+            WHEN month_year GLOB '[0-9][0-9][0-9][0-9]-[0-9]*' THEN CAST(substr(month_year, 6) AS INTEGER)
+            WHEN month_year GLOB '[0-9]*-[0-9][0-9][0-9][0-9]' THEN CAST(substr(month_year, 1, instr(month_year, '-') - 1) AS INTEGER)
+            WHEN month_year GLOB '[0-9][0-9][0-9][0-9][0-9][0-9][0-9][0-9]_[0-9]*' THEN CAST(substr(month_year, 14, 2) AS INTEGER)
+        END""",
+    })
+    add_index('ix_salaries_period', 'salaries', 'period_year, period_month, employee_id, is_paid')
+
+    # بوابة الموظف: قراءة سجلات موظف واحد بمدى تاريخ
+    add_index('ix_salaries_employee_period', 'salaries', 'employee_id, period_year, period_month')
+    # unique_employee_date يغطي (employee_id, date) بالفعل
+    drop_index('ix_attendances_employee_date', 'attendances')
+    add_index('ix_financial_transactions_employee_date', 'financial_transactions', 'employee_id, date')
+    add_index('ix_evaluations_employee_date', 'evaluations', 'employee_id, date')
+
+    # قائمة خطط العمل: ترقيم بالمؤشر وعدّ المهام لكل خطة
+    add_index('ix_work_plans_plan_date_id', 'work_plans', 'plan_date, id')
+    add_index('ix_work_plan_tasks_plan_id', 'work_plan_tasks', 'plan_id')
+
     add_column('companies', 'receivable_account_id', 'INTEGER')
 
     add_column('suppliers', 'payable_account_id', 'INTEGER')
@@ -266,6 +351,21 @@ def auto_migrate():
     add_column('attendances', 'sick_leave_days', 'INTEGER', '0')
     add_column('attendances', 'annual_leave_days', 'INTEGER', '0')
 
+    # شهر القيد (period_key) لفحص القيود المكررة عبر الفهرس بدلاً من البحث في الوصف
+    add_column('journal_entries', 'period_key', 'VARCHAR(7)')
+    backfill('journal_entries', 'period_key', {
+        'postgresql': "to_char(date, 'YYYY-MM')",
+        'sqlite': "strftime('%Y-%m', date)",
+    })
+    add_index('ix_journal_entries_reference', 'journal_entries', 'reference_type, reference_id')
+    add_index('ix_journal_entries_reference_period', 'journal_entries', 'reference_type, period_key')
+    add_index('ix_journal_entries_date_id', 'journal_entries', 'date, id')
+    add_index('ix_journal_entry_details_entry_id', 'journal_entry_details', 'entry_id')
+    add_index('ix_journal_entry_details_account_id', 'journal_entry_details', 'account_id')
+
+    # لقطات ميزان المراجعة عند إقفال الفترات (تاريخ + حساب)
+    add_index('ix_trial_balances_date_account', 'trial_balances', 'as_of_date, account_id', unique=True)
+
     print("Auto-migration: column check complete")
 
 
@@ -327,6 +427,11 @@ def init_db():
             seed_accounts()
             seed_system_settings()
             seed_demo_data()
+
+            # بناء أرصدة الفترات لأول مرة من القيود السابقة
+            rebuilt = AccountBalance.rebuild(only_if_empty=True)
+            if rebuilt:
+                print(f"Rebuilt {rebuilt} account period balances")
     except Exception as e:
         print(f"Database connection failed: {e}")
 
@@ -8,10 +8,19 @@ from models import (
     Evaluation, EvaluationCriteria, EvaluationDetail, FinancialTransaction, Salary,
     Contract, Supplier, SupplierInvoice, SupplierInvoicePayment, Invoice, Account, JournalEntry, JournalEntryDetail,
     JournalEntryDetail as JED, MealDeduction, LaborMonthlyCost, ContractorAnnualCost,
-    ExpenseCategory, SystemSettings, AllowanceSetting, WorkPlan, WorkPlanTask,
+    ExpenseCategory, AllowanceSetting, WorkPlan, WorkPlanTask,
     FinancialPeriod, LeaveType, LeaveBalance, LeaveRequest, BankInfo
 )
 
+from utils import (
+    get_next_entry_number, next_document_number, generate_supplier_invoice_number,
+    get_accounts_balances, build_trial_balance, build_income_statement, build_balance_sheet,
+    get_system_settings, invalidate_system_settings_cache, dashboard_stats_cache,
+    get_account_statement, get_account_by_code, post_journal_entries, reverse_journal_entries,
+    get_cash_flow_summary, get_cash_flow_details, list_journal_entries,
+    initialize_leave_balances, accrue_leave_balances, list_work_plans
+)
+
 rest_api = Blueprint('rest_api', __name__, url_prefix='/api')
 
 
@@ -23,6 +32,37 @@ def fail(message='error', status=400):
     return jsonify({'success': False, 'message': message}), status
 
 
+def ok_conditional(data=None, message='success'):
+    """
+    ok() مع ETag محسوب من الاستجابة - يعيد 304 إذا طابق If-None-Match
+
+    الـ ETag يوفر نقل البيانات فقط (الاستعلام يُنفذ دائماً)؛ لا Last-Modified
+    لأن السجلات تُعدّل دون طابع زمني للتعديل.
+    """
+    response = ok(data, message)
+    response.add_etag()
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
+
+
+def month_date_range(year, month=None):
+    """
+    [بداية، نهاية) لشهر أو سنة كاملة - للفلترة بمدى تاريخ يستفيد من الفهارس
+
+    Raises:
+        ValueError: شهر خارج 1-12 أو سنة خارج نطاق التواريخ
+    """
+    from datetime import date
+    if month is not None and not 1 <= month <= 12:
+        raise ValueError('الشهر يجب أن يكون بين 1 و 12')
+    if month:
+        start = date(year, month, 1)
+        end = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+    else:
+        start, end = date(year, 1, 1), date(year + 1, 1, 1)
+    return start, end
+
+
 def check_duplicate_journal_entry(reference_type, reference_id):
     """التحقق من عدم وجود قيد مكرر لنفس العملية"""
     existing = JournalEntry.query.filter_by(reference_type=reference_type, reference_id=reference_id).first()
@@ -327,38 +367,29 @@ def api_attendance_bulk():
         return fail('لا توجد سجلات للحفظ', 400)
 
     att_date = datetime.strptime(date_str, '%Y-%m-%d').date()
-    created = 0
-    skipped = 0
+    rows = []
     for rec in records:
-        emp_id = rec.get('employee_id')
-        status = rec.get('attendance_status', 'absent')
-        if not emp_id:
+        if not rec.get('employee_id'):
             continue
-        existing = Attendance.query.filter_by(employee_id=emp_id, date=att_date).first()
-        if existing:
-            existing.attendance_status = status
-            existing.notes = rec.get('notes', '')
-            if rec.get('time_in'):
-                existing.check_in_time = datetime.strptime(rec['time_in'], '%H:%M').time()
-            if rec.get('time_out'):
-                existing.check_out_time = datetime.strptime(rec['time_out'], '%H:%M').time()
-        else:
-            new_rec = Attendance(
-                employee_id=emp_id,
-                date=att_date,
-                attendance_status=status,
-                notes=rec.get('notes', ''),
-                attendance_type='group',
-            )
-            if rec.get('time_in'):
-                new_rec.check_in_time = datetime.strptime(rec['time_in'], '%H:%M').time()
-            if rec.get('time_out'):
-                new_rec.check_out_time = datetime.strptime(rec['time_out'], '%H:%M').time()
-            db.session.add(new_rec)
-            created += 1
+        row = {
+            'employee_id': rec['employee_id'],
+            'attendance_status': rec.get('attendance_status', 'absent'),
+            'notes': rec.get('notes', ''),
+        }
+        if rec.get('time_in'):
+            row['check_in_time'] = datetime.strptime(rec['time_in'], '%H:%M').time()
+        if rec.get('time_out'):
+            row['check_out_time'] = datetime.strptime(rec['time_out'], '%H:%M').time()
+        rows.append(row)
 
+    results = Attendance.bulk_upsert(att_date, rows, insert_values={'attendance_type': 'group'})
     db.session.commit()
-    return ok({'created': created, 'total': len(records)}, f'تم حفظ حضور {created} موظف')
+
+    counts = {'created': 0, 'updated': 0, 'unchanged': 0}
+    for r in results:
+        counts[r['result']] += 1
+    return ok({**counts, 'total': len(records), 'results': results},
+              f'تم حفظ حضور {counts["created"] + counts["updated"]} موظف')
 
 
 # ==================== COMPANIES ====================
@@ -666,12 +697,31 @@ def api_location_delete(lid):
 @rest_api.route('/work-plans')
 @login_required
 def api_work_plans_list():
-    plan_type = request.args.get('plan_type', '')
-    q = WorkPlan.query
-    if plan_type:
-        q = q.filter_by(plan_type=plan_type)
-    plans = q.order_by(WorkPlan.plan_date.desc()).limit(200).all()
-    return ok([p.to_dict() for p in plans])
+    """قائمة خطط العمل - view=summary: بدون المهام (عددها فقط)، المهام من /work-plans/<id>"""
+    summary = request.args.get('view') == 'summary'
+    try:
+        listing = list_work_plans(
+            plan_type=request.args.get('plan_type') or None,
+            status=request.args.get('status') or None,
+            limit=min(request.args.get('limit', 200, type=int), 1000 if summary else 200),
+            cursor=request.args.get('cursor') or None,
+            include_tasks=not summary,
+        )
+    except ValueError as e:
+        return fail(str(e), 400)
+    return jsonify({
+        'success': True,
+        'message': 'success',
+        'data': [p.to_dict(include_tasks=not summary) for p in listing['plans']],
+        'next_cursor': listing['next_cursor'],
+    })
+
+
+@rest_api.route('/work-plans/<int:pid>')
+@login_required
+def api_work_plan_detail(pid):
+    plan = WorkPlan.query.get_or_404(pid)
+    return ok(plan.to_dict())
 
 
 @rest_api.route('/work-plans', methods=['POST'])
@@ -858,10 +908,7 @@ def api_salaries_list():
     q = Salary.query
     month = request.args.get('month_year')
     if month:
-        parts = month.split('-')
-        if len(parts) == 2 and len(parts[0]) == 4:
-            month = f'{parts[1]}-{parts[0]}'
-        q = q.filter_by(month_year=month)
+        q = q.filter(Salary.period_matches(month))
     emp_id = request.args.get('employee_id')
     if emp_id:
         q = q.filter_by(employee_id=int(emp_id))
@@ -871,14 +918,14 @@ def api_salaries_list():
 
 def create_transaction_journal_entry(txn, data):
     """إنشاء قيد محاسبي للمعاملة المالية"""
-    cash_account = Account.query.filter_by(code='110001').first()
-    bank_account = Account.query.filter_by(code='110002').first()
-    advances_account = Account.query.filter_by(code='130001').first()
-    salary_payable = Account.query.filter_by(code='210001').first()
-    cafeteria_expense = Account.query.filter_by(code='511009').first() or Account.query.filter_by(code='520001').first()
-    restaurant_expense = Account.query.filter_by(code='511010').first() or Account.query.filter_by(code='520002').first()
-    deduction_expense = Account.query.filter_by(code='510002').first()
-    overtime_expense = Account.query.filter_by(code='510003').first()
+    cash_account = get_account_by_code('110001')
+    bank_account = get_account_by_code('110002')
+    advances_account = get_account_by_code('130001')
+    salary_payable = get_account_by_code('210001')
+    cafeteria_expense = get_account_by_code('511009') or get_account_by_code('520001')
+    restaurant_expense = get_account_by_code('511010') or get_account_by_code('520002')
+    deduction_expense = get_account_by_code('510002')
+    overtime_expense = get_account_by_code('510003')
 
     source_account = bank_account if txn.payment_method == 'bank' else cash_account
     emp = txn.employee
@@ -932,7 +979,32 @@ def create_transaction_journal_entry(txn, data):
     return entry
 
 
-def create_salary_journal_entry(salary, emp, month_year):
+# أكواد حسابات قيد الراتب (الكود الأول ثم البديل)
+SALARY_JOURNAL_ACCOUNTS = {
+    'salary_expense': ('511001', '510001'),
+    'resident_expense': ('511002',),
+    'overtime_expense': ('510003', '510002'),
+    'insurance_expense': ('511003', '510003'),
+    'clothing_expense': ('511004',),
+    'health_expense': ('511005',),
+    'salary_payable': ('210001',),
+    'insurance_payable': ('211003',),
+    'health_payable': ('211004',),
+    'clothing_payable': ('211005',),
+}
+
+
+def load_salary_journal_accounts():
+    """تحميل حسابات قيد الراتب في استعلام واحد"""
+    codes = {code for options in SALARY_JOURNAL_ACCOUNTS.values() for code in options}
+    by_code = {a.code: a for a in Account.query.filter(Account.code.in_(codes)).all()}
+    accounts = {}
+    for key, options in SALARY_JOURNAL_ACCOUNTS.items():
+        accounts[key] = next((by_code[code] for code in options if code in by_code), None)
+    return accounts
+
+
+def create_salary_journal_entry(salary, emp, month_year, accounts=None):
     """إنشاء قيد محاسبي متوازن للراتب
     القيد يسجل:
     1. مصروفات الدخل (أساسي + إقامة + إضافي) ← دائن مستحق الرواتب (total_earnings)
@@ -940,21 +1012,48 @@ def create_salary_journal_entry(salary, emp, month_year):
     3. خصومات الموظف ← مدين مستحق الرواتب (خفض ما يحصل عليه)
     4. مطعم/بوفية بدون مورد ← مدين مصروف + دائن مستحق الرواتب
     """
+    entry = build_salary_journal_entry(salary, emp, month_year, accounts or load_salary_journal_accounts())
+    if entry:
+        db.session.add(entry)
+        db.session.flush()
+    return entry
+
+
+def build_salary_journal_entry(salary, emp, month_year, accounts):
+    """بناء قيد الراتب مع تفاصيله في الذاكرة (بدون flush) - يعيد None إذا لا يوجد ما يُقيد"""
+    data = salary_journal_entry_data(salary, emp, month_year, accounts)
+    if not data:
+        return None
+
+    entry = JournalEntry(
+        entry_number=data['entry_number'],
+        date=data['date'],
+        description=data['description'],
+        reference_type=data['reference_type'],
+        reference_id=data['reference_id'],
+        created_by=current_user.id,
+    )
+    entry.details = [
+        JournalEntryDetail(account_id=account_id, debit=debit, credit=credit, description=description)
+        for account_id, debit, credit, description in data['lines']
+    ]
+    return entry
+
+
+def salary_journal_entry_data(salary, emp, month_year, accounts):
+    """بيانات قيد الراتب بصيغة post_journal_entries - يعيد None إذا لا يوجد ما يُقيد"""
     year, month = int(month_year.split('-')[1]), int(month_year.split('-')[0])
 
-    salary_expense = Account.query.filter_by(code='511001').first() or Account.query.filter_by(code='510001').first()
-    resident_expense = Account.query.filter_by(code='511002').first()
-    overtime_expense = Account.query.filter_by(code='510003').first() or Account.query.filter_by(code='510002').first()
-    insurance_expense = Account.query.filter_by(code='511003').first() or Account.query.filter_by(code='510003').first()
-    clothing_expense = Account.query.filter_by(code='511004').first()
-    health_expense = Account.query.filter_by(code='511005').first()
-    deduction_expense = Account.query.filter_by(code='510002').first()
-    cafeteria_expense = Account.query.filter_by(code='511009').first() or Account.query.filter_by(code='520001').first()
-    restaurant_expense = Account.query.filter_by(code='511010').first() or Account.query.filter_by(code='520002').first()
-    salary_payable = Account.query.filter_by(code='210001').first()
-    insurance_payable = Account.query.filter_by(code='211003').first()
-    health_payable = Account.query.filter_by(code='211004').first()
-    clothing_payable = Account.query.filter_by(code='211005').first()
+    salary_expense = accounts['salary_expense']
+    resident_expense = accounts['resident_expense']
+    overtime_expense = accounts['overtime_expense']
+    insurance_expense = accounts['insurance_expense']
+    clothing_expense = accounts['clothing_expense']
+    health_expense = accounts['health_expense']
+    salary_payable = accounts['salary_payable']
+    insurance_payable = accounts['insurance_payable']
+    health_payable = accounts['health_payable']
+    clothing_payable = accounts['clothing_payable']
 
     details = []
     total_debit = 0
@@ -1032,21 +1131,14 @@ def create_salary_journal_entry(salary, emp, month_year):
                 details.append({'account_id': salary_payable.id, 'debit': round(abs(diff), 2), 'credit': 0, 'description': f'فرق تصحيح - {emp.name}'})
                 total_debit += round(abs(diff), 2)
 
-    entry = JournalEntry(
-        entry_number=f'SAL-{month_year}-{emp.code or emp.id}',
-        date=datetime(year, month, min(28, 28)).date(),
-        description=f'رواتب {emp.name} - {month_year}',
-        reference_type='salary',
-        reference_id=salary.id,
-        created_by=current_user.id,
-    )
-    db.session.add(entry)
-    db.session.flush()
-
-    for d in details:
-        db.session.add(JournalEntryDetail(entry_id=entry.id, **d))
-
-    return entry
+    return {
+        'entry_number': f'SAL-{month_year}-{emp.code or emp.id}',
+        'date': datetime(year, month, min(28, 28)).date(),
+        'description': f'رواتب {emp.name} - {month_year}',
+        'reference_type': 'salary',
+        'reference_id': salary.id,
+        'lines': [(d['account_id'], d['debit'], d['credit'], d['description']) for d in details],
+    }
 
 
 @rest_api.route('/financial/salary-calculation', methods=['POST'])
@@ -1057,17 +1149,10 @@ def api_salary_calculation():
     company_id = data.get('company_id')
     create_entries = data.get('create_journal_entries', True)
 
-    parts = month_year_input.split('-')
-    if len(parts) == 2:
-        if len(parts[0]) == 4:
-            month_year = f'{parts[1]}-{parts[0]}'
-            year, month = int(parts[0]), int(parts[1])
-        else:
-            month_year = month_year_input
-            year, month = int(parts[1]), int(parts[0])
-    else:
-        month_year = datetime.now().strftime('%m-%Y')
+    year, month = Salary.period_for(month_year_input)
+    if year is None or '_' in month_year_input:
         year, month = datetime.now().year, datetime.now().month
+    month_year = f'{month:02d}-{year}'
 
     # التحقق من الفترة المالية المفتوحة
     period_start = datetime(year, month, 1).date()
@@ -1088,40 +1173,109 @@ def api_salary_calculation():
     employees = Employee.query.filter_by(is_active=True)
     if company_id:
         employees = employees.filter_by(company_id=int(company_id))
-    employees = employees.all()
-
-    results = []
-    created_entries = 0
 
     # قراءة إعدادات الخصومات التلقائية من النظام
-    insurance_setting = SystemSettings.query.filter_by(setting_key='monthly_insurance', is_active=True).first()
-    health_setting = SystemSettings.query.filter_by(setting_key='monthly_health', is_active=True).first()
-    clothing_setting = SystemSettings.query.filter_by(setting_key='monthly_clothing', is_active=True).first()
+    settings = get_system_settings()
 
-    monthly_insurance = float(insurance_setting.value) if insurance_setting else 10800.0
-    monthly_health = float(health_setting.value) if health_setting else 1250.0
-    monthly_clothing = float(clothing_setting.value) if clothing_setting else 2040.0
+    results, created_entries = run_monthly_payroll(
+        employees, year, month, month_year, create_entries,
+        monthly_insurance=float(settings.get('monthly_insurance', 10800.0)),
+        monthly_health=float(settings.get('monthly_health', 1250.0)),
+        monthly_clothing=float(settings.get('monthly_clothing', 2040.0)),
+    )
 
-    for emp in employees:
-        existing = Salary.query.filter_by(employee_id=emp.id, month_year=month_year).first()
-        if existing:
-            results.append(existing.to_dict())
-            continue
+    db.session.commit()
+    return ok(results, f'تم حساب {len(results)} راتب - {created_entries} قيد محاسبي')
 
-        from calendar import monthrange
-        days_in_month = monthrange(year, month)[1]
-        start_date = datetime(year, month, 1).date()
-        end_date = datetime(year, month, days_in_month).date()
 
-        attendances = Attendance.query.filter(
-            Attendance.employee_id == emp.id,
+def load_payroll_inputs(employee_ids_query, start_date, end_date, month_year):
+    """
+    تحميل مدخلات الرواتب لجميع الموظفين في استعلامات مجمّعة:
+    أيام الحضور، مجاميع المعاملات غير المسواة حسب النوع، الرواتب الموجودة
+    """
+    from sqlalchemy import case
+
+    status_count = lambda statuses: func.sum(case((Attendance.attendance_status.in_(statuses), 1), else_=0))
+    attendance = {
+        row.employee_id: row
+        for row in db.session.query(
+            Attendance.employee_id,
+            status_count(['present', 'late']).label('present_days'),
+            status_count(['sick']).label('sick_days'),
+            status_count(['annual_leave']).label('annual_leave_days'),
+        ).filter(
+            Attendance.employee_id.in_(employee_ids_query),
             Attendance.date >= start_date,
             Attendance.date <= end_date,
+        ).group_by(Attendance.employee_id).all()
+    }
+
+    # السلفة تُخصم بالقسط الشهري إن وجد، وإلا بكامل المبلغ
+    installment = case(
+        ((FinancialTransaction.monthly_installment != None) & (FinancialTransaction.monthly_installment != 0),
+         FinancialTransaction.monthly_installment),
+        else_=FinancialTransaction.amount
+    )
+    transactions = {}
+    for employee_id, transaction_type, amount, installments in db.session.query(
+        FinancialTransaction.employee_id,
+        FinancialTransaction.transaction_type,
+        func.sum(FinancialTransaction.amount),
+        func.sum(installment),
+    ).filter(
+        FinancialTransaction.employee_id.in_(employee_ids_query),
+        FinancialTransaction.is_settled == False,
+    ).group_by(FinancialTransaction.employee_id, FinancialTransaction.transaction_type).all():
+        value = installments if transaction_type == 'advance' else amount
+        transactions.setdefault(employee_id, {})[transaction_type] = float(value or 0)
+
+    # أول مورد بوفية/مطعم في معاملات كل موظف
+    suppliers = {}
+    for employee_id, transaction_type, supplier_id in db.session.query(
+        FinancialTransaction.employee_id,
+        FinancialTransaction.transaction_type,
+        FinancialTransaction.supplier_id,
+    ).filter(
+        FinancialTransaction.employee_id.in_(employee_ids_query),
+        FinancialTransaction.is_settled == False,
+        FinancialTransaction.transaction_type.in_(['cafeteria', 'restaurant']),
+        FinancialTransaction.supplier_id != None,
+    ).order_by(FinancialTransaction.id).all():
+        suppliers.setdefault((employee_id, transaction_type), supplier_id)
+
+    existing = {
+        s.employee_id: s
+        for s in Salary.query.filter(
+            Salary.employee_id.in_(employee_ids_query),
+            Salary.period_key_is(month_year),
         ).all()
+    }
+    return attendance, transactions, suppliers, existing
 
-        present_days = sum(1 for a in attendances if a.attendance_status in ['present', 'late'])
-        sick_days = sum(1 for a in attendances if a.attendance_status == 'sick')
-        annual_leave_days = sum(1 for a in attendances if a.attendance_status == 'annual_leave')
+
+def run_monthly_payroll(employees_query, year, month, month_year, create_entries,
+                        monthly_insurance, monthly_health, monthly_clothing):
+    """حساب رواتب الشهر لجميع الموظفين في الذاكرة ثم إدراجها مع قيودها دفعة واحدة"""
+    from calendar import monthrange
+
+    start_date = datetime(year, month, 1).date()
+    end_date = datetime(year, month, monthrange(year, month)[1]).date()
+
+    employees = employees_query.all()
+    employee_ids_query = employees_query.with_entities(Employee.id)
+    attendance, transactions, suppliers, existing = load_payroll_inputs(
+        employee_ids_query, start_date, end_date, month_year
+    )
+
+    results = []
+    new_salaries = []
+    for emp in employees:
+        if emp.id in existing:
+            results.append(existing[emp.id])
+            continue
+
+        att = attendance.get(emp.id)
+        present_days = int(att.present_days or 0) if att else 0
 
         daily_rate = emp.salary / 30
         basic_payout = round(daily_rate * present_days, 2)
@@ -1130,33 +1284,13 @@ def api_salary_calculation():
         if emp.is_resident:
             resident_allowance = round(500 * present_days, 2)
 
-        transactions = FinancialTransaction.query.filter(
-            FinancialTransaction.employee_id == emp.id,
-            FinancialTransaction.is_settled == False,
-        ).all()
-
-        advances = sum(float(t.monthly_installment or t.amount) for t in transactions if t.transaction_type == 'advance' and not t.is_settled)
-        overtime = sum(float(t.amount) for t in transactions if t.transaction_type == 'overtime')
-        deductions = sum(float(t.amount) for t in transactions if t.transaction_type == 'deduction')
-        penalties = sum(float(t.amount) for t in transactions if t.transaction_type == 'penalty')
-        cafeteria = sum(float(t.amount) for t in transactions if t.transaction_type == 'cafeteria')
-        restaurant = sum(float(t.amount) for t in transactions if t.transaction_type == 'restaurant')
-
-        # تحديد موردي البوفية والمطعم من المعاملات
-        cafeteria_supplier_id = None
-        restaurant_supplier_id = None
-        for t in transactions:
-            if t.transaction_type == 'cafeteria' and t.supplier_id and not cafeteria_supplier_id:
-                cafeteria_supplier_id = t.supplier_id
-            if t.transaction_type == 'restaurant' and t.supplier_id and not restaurant_supplier_id:
-                restaurant_supplier_id = t.supplier_id
-
-        total_earnings = basic_payout + resident_allowance + overtime
-
-        # تكاليف صاحب العمل (تأمينات، بطائق صحية، بدل ملابس) - لا تُخصم من راتب الموظف
-        insurance_cost = monthly_insurance
-        health_cost = monthly_health
-        clothing_cost = monthly_clothing
+        totals = transactions.get(emp.id, {})
+        advances = totals.get('advance', 0.0)
+        overtime = totals.get('overtime', 0.0)
+        deductions = totals.get('deduction', 0.0)
+        penalties = totals.get('penalty', 0.0)
+        cafeteria = totals.get('cafeteria', 0.0)
+        restaurant = totals.get('restaurant', 0.0)
 
         # الخصومات والجزاءات تُخصم من الراتب الأساسي فقط
         salary_deductions = deductions + penalties + cafeteria + restaurant
@@ -1168,6 +1302,7 @@ def api_salary_calculation():
         total_earnings_after_deductions = basic_after_deductions + resident_allowance + overtime
         net_salary = round(total_earnings_after_deductions - advances, 2)
 
+        # تكاليف صاحب العمل (تأمينات، بطائق صحية، بدل ملابس) - لا تُخصم من راتب الموظف
         salary = Salary(
             employee_id=emp.id,
             month_year=month_year,
@@ -1176,35 +1311,55 @@ def api_salary_calculation():
             basic_salary_amount=basic_after_deductions,
             resident_allowance_amount=resident_allowance,
             daily_allowance_amount=0,
-            clothing_allowance_amount=clothing_cost,
-            health_card_amount=health_cost,
-            insurance_amount=insurance_cost,
+            clothing_allowance_amount=monthly_clothing,
+            health_card_amount=monthly_health,
+            insurance_amount=monthly_insurance,
             overtime_amount=overtime,
             advance_amount=advances,
             deduction_amount=deductions,
             penalty_amount=penalties,
             cafeteria_deduction=cafeteria,
             restaurant_deduction=restaurant,
-            cafeteria_supplier_id=cafeteria_supplier_id,
-            restaurant_supplier_id=restaurant_supplier_id,
+            cafeteria_supplier_id=suppliers.get((emp.id, 'cafeteria')),
+            restaurant_supplier_id=suppliers.get((emp.id, 'restaurant')),
             total_salary=net_salary,
             is_calculated=True,
             calculated_at=datetime.utcnow(),
         )
-        db.session.add(salary)
-        db.session.flush()
+        new_salaries.append((salary, emp))
+        results.append(salary)
 
-        if create_entries:
-            if not check_duplicate_journal_entry('salary', salary.id):
-                entry = create_salary_journal_entry(salary, emp, month_year)
-                if entry:
-                    salary.journal_entry_id = entry.id
-                    created_entries += 1
+    # إدراج جميع الرواتب الجديدة في flush واحد
+    db.session.add_all([salary for salary, _ in new_salaries])
+    db.session.flush()
 
-        results.append(salary.to_dict())
+    created_entries = 0
+    if create_entries and new_salaries:
+        salary_ids = [salary.id for salary, _ in new_salaries]
+        already_posted = {
+            ref_id for (ref_id,) in db.session.query(JournalEntry.reference_id).filter(
+                JournalEntry.reference_type == 'salary',
+                JournalEntry.reference_id.in_(salary_ids)
+            ).all()
+        }
+        accounts = load_salary_journal_accounts()
+        posted = []
+        for salary, emp in new_salaries:
+            if salary.id in already_posted:
+                continue
+            data = salary_journal_entry_data(salary, emp, month_year, accounts)
+            if data:
+                posted.append((salary, data))
+
+        # إدراج جميع القيود وتفاصيلها دفعة واحدة ثم ربطها بالرواتب
+        inserted = post_journal_entries(
+            [data for _, data in posted], created_by=current_user.id, skip_validation=True, commit=False
+        )
+        for (salary, _), (entry_id, _) in zip(posted, inserted):
+            salary.journal_entry_id = entry_id
+        created_entries = len(posted)
 
-    db.session.commit()
-    return ok(results, f'تم حساب {len(results)} راتب - {created_entries} قيد محاسبي')
+    return [salary.to_dict() for salary in results], created_entries
 
 
 @rest_api.route('/financial/salaries/<int:sid>', methods=['DELETE'])
@@ -1224,9 +1379,9 @@ def api_salary_pay(sid):
     payment_method = data.get('payment_method', 'cash')
 
     if payment_method == 'cash':
-        account = Account.query.filter_by(code='110001').first()
+        account = get_account_by_code('110001')
     else:
-        account = Account.query.filter_by(code='110002').first()
+        account = get_account_by_code('110002')
 
     amount = float(s.total_salary or 0)
 
@@ -1239,7 +1394,7 @@ def api_salary_pay(sid):
     s.payment_method = payment_method
 
     # إنشاء قيد الدفع
-    salary_payable = Account.query.filter_by(code='210001').first()
+    salary_payable = get_account_by_code('210001')
     emp = s.employee
     emp_name = emp.name if emp else ''
 
@@ -1309,7 +1464,7 @@ def api_advance_settle():
 
     # التحقق من الرصيد
     account_code = '110001' if payment_method == 'cash' else '110002'
-    account = Account.query.filter_by(code=account_code).first()
+    account = get_account_by_code(account_code)
     if account:
         current_balance = float(account.get_balance() or 0)
         if current_balance < amount:
@@ -1356,7 +1511,7 @@ def api_advance_settle():
     db.session.flush()
 
     # القيد المحاسبي: مدين مستحق الرواتب + دائن الصندوق/البنك
-    salary_payable = Account.query.filter_by(code='210001').first()
+    salary_payable = get_account_by_code('210001')
     if account and salary_payable:
         entry = JournalEntry(
             entry_number=f'ADVSET-{t.id}-{datetime.now().strftime("%Y%m%d%H%M")}',
@@ -1459,7 +1614,7 @@ def api_transaction_create():
 
     if tx_type in ['advance']:
         account_code = '110001' if payment_method == 'cash' else '110002'
-        account = Account.query.filter_by(code=account_code).first()
+        account = get_account_by_code(account_code)
         if account:
             current_balance = float(account.get_balance() or 0)
             if current_balance < amount:
@@ -1492,8 +1647,8 @@ def api_transaction_create():
 @rest_api.route('/accounts/balance')
 @login_required
 def api_accounts_balance():
-    cash = Account.query.filter_by(code='110001').first()
-    bank = Account.query.filter_by(code='110002').first()
+    cash = get_account_by_code('110001')
+    bank = get_account_by_code('110002')
     return ok({
         'cash': float(cash.get_balance()) if cash else 0,
         'bank': float(bank.get_balance()) if bank else 0,
@@ -1562,8 +1717,28 @@ def api_account_delete(aid):
 @rest_api.route('/accounts/journal')
 @login_required
 def api_journal_list():
-    entries = JournalEntry.query.order_by(JournalEntry.date.desc()).limit(200).all()
-    return ok([e.to_dict() for e in entries])
+    try:
+        _, date_from, date_to = _statement_dates()
+        listing = list_journal_entries(
+            date_from=date_from,
+            date_to=date_to,
+            account_id=request.args.get('account_id', type=int),
+            reference_type=request.args.get('reference_type') or None,
+            search=request.args.get('search', '').strip() or None,
+            limit=min(request.args.get('limit', 200, type=int), 1000),
+            cursor=request.args.get('cursor') or None,
+        )
+    except ValueError as e:
+        return fail(str(e), 400)
+    return jsonify({
+        'success': True,
+        'message': 'success',
+        'data': [e.to_dict() for e in listing['entries']],
+        'count': listing['count'],
+        'total_debit': listing['total_debit'],
+        'total_credit': listing['total_credit'],
+        'next_cursor': listing['next_cursor'],
+    })
 
 
 @rest_api.route('/accounts/journal', methods=['POST'])
@@ -1577,7 +1752,7 @@ def api_journal_add():
         return fail('المدين لا يساوي الدائن - القيد غير متوازن', 400)
 
     entry = JournalEntry(
-        entry_number=data.get('entry_number', f'JE-{datetime.now().strftime("%Y%m%d%H%M")}'),
+        entry_number=data.get('entry_number') or get_next_entry_number(),
         date=datetime.strptime(data['date'], '%Y-%m-%d').date() if data.get('date') else datetime.now().date(),
         description=data.get('description', ''),
         created_by=current_user.id,
@@ -1597,11 +1772,41 @@ def api_journal_add():
     return ok({'id': entry.id}, 'تم إضافة القيد')
 
 
+@rest_api.route('/accounts/journal/bulk', methods=['POST'])
+@login_required
+def api_journal_bulk_add():
+    """ترحيل عدة قيود دفعة واحدة - إما أن تُرحل جميعها أو لا شيء"""
+    data = request.get_json(force=True, silent=True) or {}
+    items = data.get('entries', [])
+    if not items:
+        return fail('القيود مطلوبة', 400)
+
+    entries = []
+    for item in items:
+        entries.append({
+            'entry_number': item.get('entry_number'),
+            'date': datetime.strptime(item['date'], '%Y-%m-%d').date() if item.get('date') else datetime.now().date(),
+            'description': item.get('description', ''),
+            'reference_type': item.get('reference_type'),
+            'reference_id': item.get('reference_id'),
+            'lines': [
+                (d.get('account_id'), float(d.get('debit', 0) or 0), float(d.get('credit', 0) or 0), d.get('description', ''))
+                for d in item.get('details', [])
+            ],
+        })
+
+    try:
+        inserted = post_journal_entries(entries, created_by=current_user.id)
+    except ValueError as e:
+        return fail(str(e), 400)
+    return ok([{'id': eid, 'entry_number': number} for eid, number in inserted], f'تم ترحيل {len(inserted)} قيد')
+
+
 @rest_api.route('/accounts/journal/<int:jid>', methods=['DELETE'])
 @login_required
 def api_journal_delete(jid):
     entry = JournalEntry.query.get_or_404(jid)
-    JournalEntryDetail.query.filter_by(entry_id=jid).delete()
+    # حذف التفاصيل عبر cascade حتى تُخصم من أرصدة الفترات
     db.session.delete(entry)
     db.session.commit()
     return ok(message='تم حذف القيد')
@@ -1616,82 +1821,62 @@ def api_journal_bulk_reverse():
     if not entry_ids:
         return fail('معرفات القيود مطلوبة', 400)
 
-    reversed_count = 0
-    errors = []
-    for eid in entry_ids:
-        entry = JournalEntry.query.get(eid)
-        if not entry:
-            errors.append(f'القيد {eid} غير موجود')
-            continue
-        existing_reverse = JournalEntry.query.filter(
-            JournalEntry.reference_type == 'reverse',
-            JournalEntry.reference_id == entry.id
-        ).first()
-        if existing_reverse:
-            errors.append(f'القيد {entry.entry_number} تم عكسه مسبقاً')
-            continue
+    result = reverse_journal_entries(entry_ids, label='عكس قيد خاطئ', created_by=current_user.id)
+    errors = [f'القيد {eid} غير موجود' for eid in result['missing']]
+    errors += [f'القيد {entry.entry_number} تم عكسه مسبقاً' for entry, _ in result['already_reversed']]
+    errors += [f'القيد {entry.entry_number} لا يحتوي على تفاصيل' for entry in result['empty']]
+    reversed_count = len(result['reversed'])
 
-        reverse_entry = JournalEntry(
-            entry_number=f'REV-{entry.entry_number}',
-            date=datetime.now().date(),
-            description=f'عكس قيد خاطئ: {entry.entry_number} - {entry.description}',
-            reference_type='reverse',
-            reference_id=entry.id,
-            created_by=current_user.id,
-        )
-        db.session.add(reverse_entry)
-        db.session.flush()
+    return ok({'reversed': reversed_count, 'errors': errors}, f'تم عكس {reversed_count} قيود')
 
-        for detail in entry.details:
-            db.session.add(JournalEntryDetail(
-                entry_id=reverse_entry.id,
-                account_id=detail.account_id,
-                debit=detail.credit,
-                credit=detail.debit,
-                description=f'عكس: {detail.description}',
-            ))
-        reversed_count += 1
 
-    db.session.commit()
-    return ok({'reversed': reversed_count, 'errors': errors}, f'تم عكس {reversed_count} قيود')
+def _statement_dates():
+    """
+    قراءة تواريخ القوائم المالية من الطلب (as_of_date / date_from / date_to)
+
+    Raises:
+        ValueError: تاريخ بغير صيغة YYYY-MM-DD
+    """
+    def parse(name):
+        value = request.args.get(name, '')
+        try:
+            return datetime.strptime(value, '%Y-%m-%d').date() if value else None
+        except ValueError:
+            raise ValueError(f'التاريخ {name} غير صحيح (YYYY-MM-DD)') from None
+    return parse('as_of_date'), parse('date_from'), parse('date_to')
 
 
 @rest_api.route('/accounts/trial-balance')
 @login_required
 def api_trial_balance():
-    accounts = Account.query.filter_by(is_active=True).order_by(Account.code).all()
-    result = []
-    total_debit = 0
-    total_credit = 0
-    for a in accounts:
-        balance = float(a.get_balance())
-        if a.nature == 'debit':
-            if balance >= 0:
-                d, c = balance, 0
-            else:
-                d, c = 0, abs(balance)
-        else:
-            if balance >= 0:
-                d, c = 0, balance
-            else:
-                d, c = abs(balance), 0
-        if d > 0 or c > 0:
-            result.append({'code': a.code, 'name': a.name_ar or a.name, 'debit': d, 'credit': c, 'nature': a.nature})
-            total_debit += d
-            total_credit += c
-    return ok({'accounts': result, 'total_debit': round(total_debit, 2), 'total_credit': round(total_credit, 2)})
+    try:
+        as_of_date, _, _ = _statement_dates()
+    except ValueError as e:
+        return fail(str(e), 400)
+    tb = build_trial_balance(get_accounts_balances(as_of_date=as_of_date))
+    result = [
+        {'code': line['code'], 'name': line['name'], 'debit': line['debit'], 'credit': line['credit'], 'nature': line['nature']}
+        for line in tb['lines'] if line['debit'] > 0 or line['credit'] > 0
+    ]
+    return ok({'accounts': result, 'total_debit': round(tb['total_debit'], 2), 'total_credit': round(tb['total_credit'], 2)})
 
 
 @rest_api.route('/accounts/income-statement')
 @login_required
 def api_income_statement():
-    revenue_accounts = Account.query.filter_by(account_type='revenue', is_active=True).all()
-    expense_accounts = Account.query.filter_by(account_type='expense', is_active=True).all()
-    total_revenue = sum(abs(float(a.get_balance())) for a in revenue_accounts)
-    total_expense = sum(abs(float(a.get_balance())) for a in expense_accounts)
+    try:
+        as_of_date, date_from, date_to = _statement_dates()
+    except ValueError as e:
+        return fail(str(e), 400)
+    rows = get_accounts_balances(as_of_date=as_of_date, start_date=date_from, end_date=date_to)
+    statement = build_income_statement(rows)
+    revenue = [{'code': r['code'], 'name': r['name'], 'balance': abs(r['balance'])} for r in statement['revenue']]
+    expense = [{'code': r['code'], 'name': r['name'], 'balance': abs(r['balance'])} for r in statement['expense']]
+    total_revenue = sum(r['balance'] for r in revenue)
+    total_expense = sum(r['balance'] for r in expense)
     return ok({
-        'revenue': [{'code': a.code, 'name': a.name_ar or a.name, 'balance': abs(float(a.get_balance()))} for a in revenue_accounts],
-        'expense': [{'code': a.code, 'name': a.name_ar or a.name, 'balance': abs(float(a.get_balance()))} for a in expense_accounts],
+        'revenue': revenue,
+        'expense': expense,
         'total_revenue': total_revenue,
         'total_expense': total_expense,
         'net_income': total_revenue - total_expense,
@@ -1701,32 +1886,61 @@ def api_income_statement():
 @rest_api.route('/accounts/balance-sheet')
 @login_required
 def api_balance_sheet():
-    asset_accounts = Account.query.filter_by(account_type='asset', is_active=True).all()
-    liability_accounts = Account.query.filter_by(account_type='liability', is_active=True).all()
-    equity_accounts = Account.query.filter_by(account_type='equity', is_active=True).all()
-    revenue_accounts = Account.query.filter_by(account_type='revenue', is_active=True).all()
-    expense_accounts = Account.query.filter_by(account_type='expense', is_active=True).all()
-    
-    total_assets = sum(float(a.get_balance()) for a in asset_accounts)
-    total_liabilities = sum(float(a.get_balance()) for a in liability_accounts)
-    total_equity = sum(float(a.get_balance()) for a in equity_accounts)
-    total_revenue = sum(float(a.get_balance()) for a in revenue_accounts)
-    total_expense = sum(float(a.get_balance()) for a in expense_accounts)
-    net_income = total_revenue - total_expense
-    
+    try:
+        as_of_date, _, _ = _statement_dates()
+    except ValueError as e:
+        return fail(str(e), 400)
+    sheet = build_balance_sheet(get_accounts_balances(as_of_date=as_of_date))
+
+    def lines(rows):
+        return [{'code': r['code'], 'name': r['name'], 'balance': r['balance']} for r in rows]
+
     return ok({
-        'assets': [{'code': a.code, 'name': a.name_ar or a.name, 'balance': float(a.get_balance())} for a in asset_accounts],
-        'liabilities': [{'code': a.code, 'name': a.name_ar or a.name, 'balance': float(a.get_balance())} for a in liability_accounts],
-        'equity': [{'code': a.code, 'name': a.name_ar or a.name, 'balance': float(a.get_balance())} for a in equity_accounts],
-        'total_assets': total_assets,
-        'total_liabilities': total_liabilities,
-        'total_equity': total_equity,
-        'total_revenue': total_revenue,
-        'total_expense': total_expense,
-        'net_income': net_income,
+        'assets': lines(sheet['assets']),
+        'liabilities': lines(sheet['liabilities']),
+        'equity': lines(sheet['equity']),
+        'total_assets': sheet['total_assets'],
+        'total_liabilities': sheet['total_liabilities'],
+        'total_equity': sheet['total_equity'],
+        'total_revenue': sheet['total_revenue'],
+        'total_expense': sheet['total_expense'],
+        'net_income': sheet['net_income'],
     })
 
 
+def _cash_flow_dates():
+    """فترة قائمة التدفقات النقدية (الشهر الحالي افتراضياً)"""
+    _, date_from, date_to = _statement_dates()
+    today = datetime.now().date()
+    return date_from or today.replace(day=1), date_to or today
+
+
+@rest_api.route('/accounts/cash-flow')
+@login_required
+def api_cash_flow():
+    try:
+        date_from, date_to = _cash_flow_dates()
+    except ValueError as e:
+        return fail(str(e), 400)
+    summary = get_cash_flow_summary(date_from, date_to)
+    return ok({'date_from': date_from.strftime('%Y-%m-%d'), 'date_to': date_to.strftime('%Y-%m-%d'), **summary})
+
+
+@rest_api.route('/accounts/cash-flow/<kind>')
+@login_required
+def api_cash_flow_details(kind):
+    try:
+        date_from, date_to = _cash_flow_dates()
+        details = get_cash_flow_details(
+            kind, date_from, date_to,
+            limit=min(request.args.get('limit', 50, type=int), 500),
+            cursor=request.args.get('cursor') or None,
+        )
+    except ValueError as e:
+        return fail(str(e), 400)
+    return ok(details)
+
+
 @rest_api.route('/accounts/statement')
 @login_required
 def api_account_statement():
@@ -1742,36 +1956,17 @@ def api_account_statement():
             if not account:
                 return fail('الحساب غير موجود', 404)
 
-            details = JournalEntryDetail.query.filter_by(account_id=account.id).all()
-            if date_from:
-                df = datetime.strptime(date_from, '%Y-%m-%d').date()
-                details = [d for d in details if d.entry and d.entry.date and d.entry.date >= df]
-            if date_to:
-                dt = datetime.strptime(date_to, '%Y-%m-%d').date()
-                details = [d for d in details if d.entry and d.entry.date and d.entry.date <= dt]
-
-            details.sort(key=lambda d: d.entry.date if d.entry and d.entry.date else datetime.min.date())
-
-            transactions = []
-            running_balance = 0
-            for d in details:
-                entry = d.entry
-                running_balance += float(d.debit or 0) - float(d.credit or 0)
-                transactions.append({
-                    'date': entry.date.strftime('%Y-%m-%d') if entry.date else '',
-                    'entry_number': entry.entry_number or '',
-                    'description': d.description or entry.description or '',
-                    'debit': float(d.debit or 0),
-                    'credit': float(d.credit or 0),
-                    'balance': running_balance,
-                })
+            statement = get_account_statement(
+                account.id,
+                date_from=datetime.strptime(date_from, '%Y-%m-%d').date() if date_from else None,
+                date_to=datetime.strptime(date_to, '%Y-%m-%d').date() if date_to else None,
+                limit=request.args.get('limit', type=int),
+                cursor=request.args.get('cursor') or None,
+            )
 
             return ok({
                 'account': {'id': account.id, 'code': account.code, 'name': account.name_ar or account.name, 'type': account.account_type},
-                'transactions': transactions,
-                'total_debit': sum(t['debit'] for t in transactions),
-                'total_credit': sum(t['credit'] for t in transactions),
-                'final_balance': running_balance,
+                **statement,
             })
         else:
             q = Account.query.filter_by(is_active=True)
@@ -1782,6 +1977,8 @@ def api_account_statement():
                 'id': a.id, 'code': a.code, 'name': a.name_ar or a.name,
                 'type': a.account_type, 'balance': float(a.get_balance() or 0),
             } for a in accounts])
+    except ValueError as e:
+        return fail(str(e), 400)
     except Exception as e:
         return fail(str(e), 500)
 
@@ -1986,9 +2183,9 @@ def api_salary_deduction_pay():
             return fail('لا يوجد مبلغ مخصص', 400)
 
         if payment_method == 'cash':
-            cash_account = Account.query.filter_by(code='110001').first()
+            cash_account = get_account_by_code('110001')
         else:
-            cash_account = Account.query.filter_by(code='110002').first()
+            cash_account = get_account_by_code('110002')
 
         if cash_account and float(cash_account.get_balance() or 0) < total_amount:
             account_name = 'الصندوق' if payment_method == 'cash' else 'البنك'
@@ -2006,7 +2203,7 @@ def api_salary_deduction_pay():
 
         if cash_account and supplier_account:
             entry = JournalEntry(
-                entry_number=f'SALPAY-{deduction_type[:3].upper()}-{datetime.now().strftime("%Y%m%d%H%M")}',
+                entry_number=get_next_entry_number(),
                 date=datetime.now().date(),
                 description=f'دفع مخصصات {type_name} - {month} - {len(salaries)} موظف',
                 reference_type='salary_deduction_pay',
@@ -2102,9 +2299,9 @@ def api_supplier_invoice_pay(iid):
             return fail(f'المبلغ المدفوع ({amount}) أكبر من المتبقي ({inv.remaining_amount})', 400)
 
         if payment_method == 'cash':
-            cash_account = Account.query.filter_by(code='110001').first()
+            cash_account = get_account_by_code('110001')
         else:
-            cash_account = Account.query.filter_by(code='110002').first()
+            cash_account = get_account_by_code('110002')
 
         if cash_account and float(cash_account.get_balance() or 0) < amount:
             account_name = 'الصندوق' if payment_method == 'cash' else 'البنك'
@@ -2214,9 +2411,9 @@ def api_invoice_receive(iid):
             return fail(f'المبلغ ({amount}) أكبر من المتبقي ({remaining})', 400)
 
         if payment_method == 'cash':
-            cash_account = Account.query.filter_by(code='110001').first()
+            cash_account = get_account_by_code('110001')
         else:
-            cash_account = Account.query.filter_by(code='110002').first()
+            cash_account = get_account_by_code('110002')
 
         company_account = None
         contract = inv.contract
@@ -2651,63 +2848,91 @@ def api_reports_evaluations():
 @rest_api.route('/dashboard/stats')
 @login_required
 def api_dashboard_stats():
+    # الإحصائيات غير مقيدة بشركة المستخدم، لذا تُشارك نسخة واحدة بين الجميع
+    return ok(dashboard_stats_cache.get('rest_api.dashboard', compute_dashboard_stats))
+
+
+def compute_dashboard_stats():
+    """إحصائيات لوحة التحكم باستعلام تجميعي واحد لكل جدول"""
+    from sqlalchemy import case
+
     today = datetime.now().date()
     result = {}
 
-    def safe_count(query_func, default=0):
-        try:
-            return query_func() or default
-        except Exception:
-            db.session.rollback()
-            return default
-
-    def safe_sum(query_func, default=0):
+    def safe_row(query_func, keys):
         try:
-            return query_func() or default
+            row = query_func()
+            return {key: value or 0 for key, value in zip(keys, row)}
         except Exception:
             db.session.rollback()
-            return default
-
-    result['total_employees'] = safe_count(lambda: Employee.query.filter_by(is_active=True).count())
-    result['today_attendance'] = safe_count(lambda: Attendance.query.filter_by(date=today, attendance_status='present').count())
-    result['late_count'] = safe_count(lambda: Attendance.query.filter_by(date=today, attendance_status='late').count())
-    result['absent_count'] = safe_count(lambda: Attendance.query.filter_by(date=today, attendance_status='absent').count())
-    result['sick_count'] = safe_count(lambda: Attendance.query.filter_by(date=today, attendance_status='sick').count())
-    result['leave_count'] = safe_count(lambda: Attendance.query.filter_by(date=today, attendance_status='annual_leave').count())
-    result['pending_transactions'] = safe_count(lambda: FinancialTransaction.query.filter_by(is_settled=False).count())
-    result['pending_salaries'] = safe_count(lambda: Salary.query.filter_by(is_paid=False).count())
-
-    result['total_income'] = safe_sum(lambda: db.session.query(func.sum(FinancialTransaction.amount)).filter_by(transaction_type='income').scalar())
-    result['total_expense'] = safe_sum(lambda: db.session.query(func.sum(FinancialTransaction.amount)).filter_by(transaction_type='expense').scalar())
-
-    result['total_salaries_paid'] = safe_sum(lambda: db.session.query(func.sum(Salary.total_salary)).filter_by(is_paid=True).scalar())
-    result['total_salaries_unpaid'] = safe_sum(lambda: db.session.query(func.sum(Salary.total_salary)).filter_by(is_paid=False).scalar())
-
-    result['work_plans_total'] = safe_count(lambda: WorkPlan.query.count())
-    result['work_plans_completed'] = safe_count(lambda: WorkPlan.query.filter_by(status='completed').count())
-    result['work_plans_in_progress'] = safe_count(lambda: WorkPlan.query.filter_by(status='in_progress').count())
-    result['work_plans_pending'] = safe_count(lambda: WorkPlan.query.filter_by(status='pending').count())
-    result['work_plan_tasks_total'] = safe_count(lambda: WorkPlanTask.query.count())
-    result['work_plan_tasks_completed'] = safe_count(lambda: WorkPlanTask.query.filter_by(is_completed=True).count())
-
-    result['total_companies'] = safe_count(lambda: Company.query.count())
-    result['total_suppliers'] = safe_count(lambda: Supplier.query.count())
-    result['active_contracts'] = safe_count(lambda: Contract.query.filter_by(status='active').count() if hasattr(Contract, 'query') else 0)
+            return dict.fromkeys(keys, 0)
+
+    def count_if(condition):
+        return func.coalesce(func.sum(case((condition, 1), else_=0)), 0)
+
+    def sum_if(column, condition):
+        return func.coalesce(func.sum(case((condition, column), else_=0)), 0)
+
+    def count_all(model):
+        return db.select(func.count()).select_from(model).scalar_subquery()
+
+    result.update(safe_row(lambda: db.session.query(
+        count_all(Company), count_all(Supplier),
+        db.select(func.count()).select_from(Contract).where(Contract.status == 'active').scalar_subquery(),
+        db.select(func.count()).select_from(Employee).where(Employee.is_active == True).scalar_subquery(),
+    ).one(), ['total_companies', 'total_suppliers', 'active_contracts', 'total_employees']))
+
+    status = Attendance.attendance_status
+    result.update(safe_row(lambda: db.session.query(
+        count_if(status == 'present'), count_if(status == 'late'), count_if(status == 'absent'),
+        count_if(status == 'sick'), count_if(status == 'annual_leave'),
+    ).filter(Attendance.date == today).one(),
+        ['today_attendance', 'late_count', 'absent_count', 'sick_count', 'leave_count']))
+
+    result.update(safe_row(lambda: db.session.query(
+        count_if(FinancialTransaction.is_settled == False),
+        sum_if(FinancialTransaction.amount, FinancialTransaction.transaction_type == 'income'),
+        sum_if(FinancialTransaction.amount, FinancialTransaction.transaction_type == 'expense'),
+    ).one(), ['pending_transactions', 'total_income', 'total_expense']))
+
+    result.update(safe_row(lambda: db.session.query(
+        count_if(Salary.is_paid == False),
+        sum_if(Salary.total_salary, Salary.is_paid == True),
+        sum_if(Salary.total_salary, Salary.is_paid == False),
+    ).one(), ['pending_salaries', 'total_salaries_paid', 'total_salaries_unpaid']))
+
+    result.update(safe_row(lambda: db.session.query(
+        func.count(WorkPlan.id),
+        count_if(WorkPlan.status == 'completed'),
+        count_if(WorkPlan.status == 'in_progress'),
+        count_if(WorkPlan.status == 'pending'),
+        count_if(db.and_(WorkPlan.status.in_(['pending', 'in_progress']), WorkPlan.due_date < today)),
+        db.select(func.count()).select_from(WorkPlanTask).scalar_subquery(),
+        db.select(func.count()).select_from(WorkPlanTask).where(WorkPlanTask.is_completed == True).scalar_subquery(),
+    ).one(), ['work_plans_total', 'work_plans_completed', 'work_plans_in_progress', 'work_plans_pending',
+              'overdue_plans', 'work_plan_tasks_total', 'work_plan_tasks_completed']))
 
     result['recent_attendance'] = []
     try:
-        recent_attendance = Attendance.query.filter_by(date=today).order_by(Attendance.id.desc()).limit(10).all()
+        recent_attendance = db.session.query(
+            Employee.name, Attendance.attendance_status, Attendance.check_in_time
+        ).outerjoin(Employee, Employee.id == Attendance.employee_id).filter(
+            Attendance.date == today
+        ).order_by(Attendance.id.desc()).limit(10).all()
         result['recent_attendance'] = [{
-            'employee_name': r.employee.name if r.employee else '',
-            'status': r.attendance_status,
-            'time': r.check_in_time.strftime('%H:%M') if r.check_in_time else '',
-        } for r in recent_attendance]
+            'employee_name': name or '',
+            'status': att_status,
+            'time': check_in.strftime('%H:%M') if check_in else '',
+        } for name, att_status, check_in in recent_attendance]
     except Exception:
         db.session.rollback()
 
     result['recent_transactions'] = []
     try:
-        recent_transactions = FinancialTransaction.query.order_by(FinancialTransaction.date.desc()).limit(10).all()
+        recent_transactions = db.session.query(
+            FinancialTransaction.description, FinancialTransaction.amount,
+            FinancialTransaction.transaction_type, FinancialTransaction.date
+        ).order_by(FinancialTransaction.date.desc()).limit(10).all()
         result['recent_transactions'] = [{
             'description': t.description or '',
             'amount': t.amount,
@@ -2717,22 +2942,16 @@ def api_dashboard_stats():
     except Exception:
         db.session.rollback()
 
-    result['overdue_plans'] = safe_count(lambda: WorkPlan.query.filter(
-        WorkPlan.status.in_(['pending', 'in_progress']),
-        WorkPlan.due_date < today
-    ).count())
-
-    from sqlalchemy import func as sa_func
     result['top_employees'] = []
     try:
         top_employees = db.session.query(
             Employee.name,
-            sa_func.avg(Evaluation.score).label('avg_score'),
-            sa_func.count(Evaluation.id).label('eval_count')
+            func.avg(Evaluation.score).label('avg_score'),
+            func.count(Evaluation.id).label('eval_count')
         ).join(Evaluation, Evaluation.employee_id == Employee.id).group_by(
             Employee.id
-        ).having(sa_func.count(Evaluation.id) > 0).order_by(
-            sa_func.avg(Evaluation.score).desc()
+        ).having(func.count(Evaluation.id) > 0).order_by(
+            func.avg(Evaluation.score).desc()
         ).limit(5).all()
         result['top_employees'] = [{'name': t[0], 'score': round(float(t[1]), 1), 'count': t[2]} for t in top_employees]
     except Exception:
@@ -2740,16 +2959,20 @@ def api_dashboard_stats():
 
     result['recent_evaluations'] = []
     try:
-        recent_evaluations = Evaluation.query.order_by(Evaluation.date.desc()).limit(5).all()
+        recent_evaluations = db.session.query(
+            Employee.name, Evaluation.score, Evaluation.date
+        ).outerjoin(Employee, Employee.id == Evaluation.employee_id).order_by(
+            Evaluation.date.desc()
+        ).limit(5).all()
         result['recent_evaluations'] = [{
-            'employee_name': e.employee.name if e.employee else '',
-            'score': e.score,
-            'date': e.date.strftime('%Y-%m-%d') if e.date else '',
-        } for e in recent_evaluations]
+            'employee_name': name or '',
+            'score': score,
+            'date': eval_date.strftime('%Y-%m-%d') if eval_date else '',
+        } for name, score, eval_date in recent_evaluations]
     except Exception:
         db.session.rollback()
 
-    return ok(result)
+    return result
 
 
 # ==================== SETTINGS ====================
@@ -2768,6 +2991,7 @@ def api_settings():
 @login_required
 def api_settings_update():
     data = request.get_json(force=True, silent=True) or {}
+    invalidate_system_settings_cache()
     return ok(message='تم حفظ الإعدادات')
 
 
@@ -2944,11 +3168,12 @@ def api_invoices_list():
 @login_required
 def api_invoice_create():
     data = request.get_json(force=True, silent=True) or {}
+    invoice_date = datetime.strptime(data['date'], '%Y-%m-%d').date() if data.get('date') else datetime.now().date()
     i = Invoice(
-        invoice_number=data.get('invoice_number', ''),
+        invoice_number=data.get('invoice_number') or next_document_number('INV', invoice_date),
         contract_id=data.get('contract_id'),
         amount=data.get('amount', 0),
-        invoice_date=datetime.strptime(data['date'], '%Y-%m-%d').date() if data.get('date') else datetime.now().date(),
+        invoice_date=invoice_date,
     )
     if data.get('due_date'):
         i.due_date = datetime.strptime(data['due_date'], '%Y-%m-%d').date()
@@ -2960,7 +3185,7 @@ def api_invoice_create():
         company = i.contract.company
         if company.receivable_account_id:
             company_account = Account.query.get(company.receivable_account_id)
-            revenue_account = Account.query.filter_by(code='410004').first()
+            revenue_account = get_account_by_code('410004')
             if company_account and revenue_account:
                 entry = JournalEntry(
                     entry_number=f'INV-{i.id}-{datetime.now().strftime("%Y%m%d%H%M")}',
@@ -3009,7 +3234,7 @@ def api_supplier_invoice_create():
     try:
         inv = SupplierInvoice(
             supplier_id=data.get('supplier_id'),
-            invoice_number=data.get('invoice_number', ''),
+            invoice_number=data.get('invoice_number') or generate_supplier_invoice_number(),
             amount=data.get('amount', 0),
             paid_amount=0,
             remaining_amount=data.get('amount', 0),
@@ -3033,11 +3258,11 @@ def api_supplier_invoice_create():
             # تحديد حساب المصروف حسب نوع المورد
             expense_account = None
             if supplier.supplier_type == 'cafeteria':
-                expense_account = Account.query.filter_by(code='511009').first()
+                expense_account = get_account_by_code('511009')
             elif supplier.supplier_type == 'restaurant':
-                expense_account = Account.query.filter_by(code='511010').first()
+                expense_account = get_account_by_code('511010')
             else:
-                expense_account = Account.query.filter_by(code='520001').first()
+                expense_account = get_account_by_code('520001')
             if supplier_account and expense_account:
                 entry = JournalEntry(
                     entry_number=f'SUPINV-{inv.id}-{datetime.now().strftime("%Y%m%d%H%M")}',
@@ -3086,12 +3311,10 @@ def api_contractor_profit():
     from calendar import monthrange
     days_in_month = monthrange(year, month)[1]
 
-    insurance_setting = SystemSettings.query.filter_by(setting_key='monthly_insurance', is_active=True).first()
-    health_setting = SystemSettings.query.filter_by(setting_key='monthly_health', is_active=True).first()
-    clothing_setting = SystemSettings.query.filter_by(setting_key='monthly_clothing', is_active=True).first()
-    monthly_insurance = float(insurance_setting.value) if insurance_setting else 10800.0
-    monthly_health = float(health_setting.value) if health_setting else 1250.0
-    monthly_clothing = float(clothing_setting.value) if clothing_setting else 2040.0
+    settings = get_system_settings()
+    monthly_insurance = float(settings.get('monthly_insurance', 10800.0))
+    monthly_health = float(settings.get('monthly_health', 1250.0))
+    monthly_clothing = float(settings.get('monthly_clothing', 2040.0))
 
     employees = Employee.query.filter_by(is_active=True)
     if company_id:
@@ -3274,9 +3497,7 @@ def api_period_reopen(pid):
     period = FinancialPeriod.query.get_or_404(pid)
     if period.status == 'locked':
         return fail('هذه الفترة مقفلة ولا يمكن فتحها')
-    period.status = 'open'
-    period.closed_by = None
-    period.closed_at = None
+    period.reopen()
     db.session.commit()
     return ok(period.to_dict(), 'تم إعادة فتح الفترة')
 
@@ -3351,24 +3572,44 @@ def api_leave_balances_init():
     if not current_user.has_role('admin'):
         return fail('غير مصرح', 403)
     data = request.get_json(force=True, silent=True) or {}
-    year = data.get('year', datetime.now().year)
-    leave_types = LeaveType.query.filter_by(is_active=True).all()
-    employees = Employee.query.filter_by(is_active=True).all()
-    count = 0
-    for emp in employees:
-        for lt in leave_types:
-            existing = LeaveBalance.query.filter_by(employee_id=emp.id, leave_type_id=lt.id, year=year).first()
-            if not existing:
-                b = LeaveBalance(
-                    employee_id=emp.id, leave_type_id=lt.id, year=year,
-                    total_days=lt.days_per_year, used_days=0, remaining_days=lt.days_per_year
-                )
-                db.session.add(b)
-                count += 1
-    db.session.commit()
+    try:
+        year = int(data.get('year', datetime.now().year))
+    except (TypeError, ValueError):
+        return fail('السنة غير صحيحة')
+    count = initialize_leave_balances(year)
     return ok({'count': count}, f'تم تهيئة {count} رصيد')
 
 
+@rest_api.route('/leave-balances/accrue', methods=['POST'])
+@login_required
+def api_leave_balances_accrue():
+    """استحقاق أرصدة الإجازات (سنوي/شهري) لجميع الموظفين - dry_run للتقرير فقط"""
+    if not current_user.has_role('admin'):
+        return fail('غير مصرح', 403)
+    data = request.get_json(force=True, silent=True) or {}
+    try:
+        year = int(data.get('year', datetime.now().year))
+    except (TypeError, ValueError):
+        return fail('السنة غير صحيحة')
+    mode = data.get('mode', 'yearly')
+    if mode not in ('yearly', 'monthly'):
+        return fail('نظام الاستحقاق يجب أن يكون yearly أو monthly')
+    as_of = None
+    if data.get('as_of'):
+        try:
+            as_of = datetime.strptime(data['as_of'], '%Y-%m-%d').date()
+        except (TypeError, ValueError):
+            return fail('تاريخ الاستحقاق غير صحيح (YYYY-MM-DD)')
+    dry_run = bool(data.get('dry_run', False))
+
+    report = accrue_leave_balances(year, mode=mode, as_of=as_of, dry_run=dry_run)
+    if dry_run:
+        message = f'معاينة: {report["created_balances"]} رصيد جديد و {report["updated_balances"]} رصيد للتحديث'
+    else:
+        message = f'تم إنشاء {report["created_balances"]} رصيد وتحديث {report["updated_balances"]} رصيد'
+    return ok(report, message)
+
+
 @rest_api.route('/leave-requests', methods=['GET'])
 @login_required
 def api_leave_requests():
@@ -3509,18 +3750,25 @@ def api_employee_my_attendance():
     emp = Employee.query.get(current_user.employee_id)
     if not emp:
         return fail('لم يتم ربط حسابك بموظف', 404)
-    month = request.args.get('month')
+    month = request.args.get('month', type=int)
     year = request.args.get('year', datetime.now().year, type=int)
-    query = Attendance.query.filter_by(employee_id=emp.id)
-    if month:
-        from sqlalchemy import extract
-        query = query.filter(extract('month', Attendance.date) == int(month))
-    query = query.filter(extract('year', Attendance.date) == year)
-    records = query.order_by(Attendance.date.desc()).all()
-    return ok([{
+    try:
+        start, end = month_date_range(year, month)
+    except ValueError:
+        return fail('الشهر أو السنة غير صحيح')
+    records = db.session.query(
+        Attendance.id, Attendance.date, Attendance.attendance_status,
+        Attendance.late_minutes, Attendance.notes
+    ).filter(
+        Attendance.employee_id == emp.id,
+        Attendance.date >= start,
+        Attendance.date < end
+    ).order_by(Attendance.date.desc()).all()
+    status_names = {'present': 'حاضر', 'late': 'متأخر', 'sick': 'مرضي', 'absent': 'غائب', 'annual_leave': 'إجازة'}
+    return ok_conditional([{
         'id': r.id, 'date': r.date.strftime('%Y-%m-%d'),
         'status': r.attendance_status,
-        'status_name': {'present': 'حاضر', 'late': 'متأخر', 'sick': 'مرضي', 'absent': 'غائب', 'annual_leave': 'إجازة'}.get(r.attendance_status, r.attendance_status),
+        'status_name': status_names.get(r.attendance_status, r.attendance_status),
         'late_minutes': r.late_minutes,
         'notes': r.notes or '',
     } for r in records])
@@ -3535,8 +3783,12 @@ def api_employee_my_salaries():
     emp = Employee.query.get(current_user.employee_id)
     if not emp:
         return fail('لم يتم ربط حسابك بموظف', 404)
-    salaries = Salary.query.filter_by(employee_id=emp.id).order_by(Salary.month_year.desc()).all()
-    return ok([{
+    query = Salary.query.filter(Salary.employee_id == emp.id)
+    year = request.args.get('year', type=int)
+    if year:
+        query = query.filter(Salary.period_year == year)
+    salaries = query.order_by(*Salary.period_order()).all()
+    return ok_conditional([{
         'id': s.id, 'month_year': s.month_year,
         'basic_salary_amount': s.basic_salary_amount,
         'overtime_amount': s.overtime_amount,
@@ -3596,8 +3848,16 @@ def api_employee_my_transactions():
     emp = Employee.query.get(current_user.employee_id)
     if not emp:
         return fail('لم يتم ربط حسابك بموظف', 404)
-    txs = FinancialTransaction.query.filter_by(employee_id=emp.id).order_by(FinancialTransaction.date.desc()).all()
-    return ok([t.to_dict() for t in txs])
+    query = FinancialTransaction.query.filter(FinancialTransaction.employee_id == emp.id)
+    year = request.args.get('year', type=int)
+    if year:
+        try:
+            start, end = month_date_range(year, request.args.get('month', type=int))
+        except ValueError:
+            return fail('الشهر أو السنة غير صحيح')
+        query = query.filter(FinancialTransaction.date >= start, FinancialTransaction.date < end)
+    txs = query.order_by(FinancialTransaction.date.desc()).all()
+    return ok_conditional([t.to_dict() for t in txs])
 
 
 @rest_api.route('/employee/my-evaluations', methods=['GET'])
@@ -3609,8 +3869,16 @@ def api_employee_my_evaluations():
     emp = Employee.query.get(current_user.employee_id)
     if not emp:
         return fail('لم يتم ربط حسابك بموظف', 404)
-    evals = Evaluation.query.filter_by(employee_id=emp.id).order_by(Evaluation.date.desc()).all()
-    return ok([{
+    query = Evaluation.query.filter(Evaluation.employee_id == emp.id)
+    year = request.args.get('year', type=int)
+    if year:
+        try:
+            start, end = month_date_range(year, request.args.get('month', type=int))
+        except ValueError:
+            return fail('الشهر أو السنة غير صحيح')
+        query = query.filter(Evaluation.date >= start, Evaluation.date < end)
+    evals = query.order_by(Evaluation.date.desc()).all()
+    return ok_conditional([{
         'id': e.id, 'date': e.date.strftime('%Y-%m-%d') if e.date else None,
         'score': e.score, 'comments': e.comments or '',
         'evaluation_type': e.evaluation_type,
@@ -78,7 +78,7 @@ export default function ReportsPage() {
       api.get(`/reports/attendance?date_from=${pm}-01&date_to=${pm}-31`).catch(() => empty({ daily: [], attendance_rate: 0, summary: {} })),
       api.get(`/reports/financial?month_year=${selectedMonth.replace('-', '-')}`).catch(() => empty({ balance: 0, by_type: [], monthly: [] })),
       api.get(`/reports/financial?month_year=${pm.replace('-', '-')}`).catch(() => empty({ balance: 0, by_type: [], monthly: [] })),
-      api.get('/work-plans').catch(() => empty([])),
+      api.get('/work-plans?view=summary').catch(() => empty([])),
       api.get(`/reports/evaluations?month_year=${selectedMonth}`).catch(() => empty({ total_evaluations: 0, avg_score: 0, avg_rating: '-', rating_distribution: [], type_distribution: [], top_employees: [], monthly_trend: [], all_employees: [] })),
       api.get(`/reports/evaluations?month_year=${pm}`).catch(() => empty({ total_evaluations: 0, avg_score: 0, avg_rating: '-', rating_distribution: [], type_distribution: [], top_employees: [], monthly_trend: [], all_employees: [] })),
       api.get(`/reports/contractor-profit?month_year=${selectedMonth}`).catch(() => empty({ employees: [], summary: {} })),
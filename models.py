@@ -97,6 +97,85 @@ class Attendance(db.Model):
             cls.attendance_status == 'present'
         ).count()
 
+    @classmethod
+    def bulk_upsert(cls, att_date, records, insert_values=None, update_existing=True):
+        """
+        حفظ حضور مجموعة موظفين ليوم واحد دفعة واحدة
+
+        Args:
+            att_date: تاريخ الحضور
+            records: [{'employee_id': ..., <عمود>: قيمة, ...}] - تُطبق عند الإضافة والتحديث
+            insert_values: قيم تُضاف للسجلات الجديدة فقط (attendance_type, created_by ...)
+            update_existing: False لترك السجلات الموجودة كما هي
+
+        Returns:
+            list: [{'employee_id', 'attendance_id', 'result'}] حيث result هي
+                  created أو updated أو unchanged
+        """
+        by_employee = {}
+        for record in records:
+            if record.get('employee_id'):
+                by_employee[int(record['employee_id'])] = {
+                    k: v for k, v in record.items() if k != 'employee_id'
+                }
+        if not by_employee:
+            return []
+
+        existing = {
+            row['employee_id']: row
+            for row in db.session.execute(
+                db.select(cls.__table__).where(
+                    cls.employee_id.in_(list(by_employee)),
+                    cls.date == att_date
+                )
+            ).mappings()
+        }
+
+        results, to_insert, to_update = [], [], []
+        for employee_id, values in by_employee.items():
+            row = existing.get(employee_id)
+            if row is None:
+                to_insert.append({**(insert_values or {}), **values,
+                                  'employee_id': employee_id, 'date': att_date})
+                result = 'created'
+            elif not update_existing or all(row[k] == v for k, v in values.items()):
+                result = 'unchanged'
+            else:
+                to_update.append({'id': row['id'], **values})
+                result = 'updated'
+            results.append({
+                'employee_id': employee_id,
+                'attendance_id': row['id'] if row is not None else None,
+                'result': result,
+            })
+
+        # الإضافة بمجموعات متجانسة الأعمدة؛ ON CONFLICT يغطي السجلات التي أضيفت بالتزامن
+        groups = {}
+        for values in to_insert:
+            groups.setdefault(tuple(sorted(values)), []).append(values)
+
+        connection = db.session.connection()
+        for keys, rows in groups.items():
+            stmt = dialect_insert(connection, cls.__table__)
+            if stmt is None:
+                db.session.execute(db.insert(cls), rows)
+                continue
+            update_keys = [k for k in keys
+                           if k not in ('employee_id', 'date') and k not in (insert_values or {})]
+            if update_existing and update_keys:
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=['employee_id', 'date'],
+                    set_={k: stmt.excluded[k] for k in update_keys}
+                )
+            else:
+                stmt = stmt.on_conflict_do_nothing(index_elements=['employee_id', 'date'])
+            db.session.execute(stmt, rows)
+
+        if to_update:
+            db.session.execute(db.update(cls), to_update)
+
+        return results
+
     def get_status_display(self):
         """عرض الحالة بشكل مفهوم"""
         status_map = {
@@ -157,6 +236,10 @@ class FinancialTransaction(db.Model):
     journal_entry_id = db.Column(db.Integer, db.ForeignKey('journal_entries.id'), nullable=True)
     journal_entry = db.relationship('JournalEntry', foreign_keys=[journal_entry_id], backref='financial_transaction')
 
+    __table_args__ = (
+        db.Index('ix_financial_transactions_employee_date', 'employee_id', 'date'),
+    )
+
     def get_type_name(self):
         return self.TRANSACTION_TYPES.get(self.transaction_type, self.transaction_type)
 
@@ -234,90 +317,19 @@ class Employee(db.Model):
                                    allowances=None):
         """
         حساب توزيع الراتب - نسخة مبسطة ومستقرة
-        تعتمد على إعدادات النظام (SystemSettings) فقط
+        تعتمد على إعدادات النظام (SystemSettings) فقط - المعادلات في
+        utils.calculate_employees_salary_breakdowns
         """
-        from utils import get_system_setting, safe_float
-        from models import AllowanceSetting, FinancialTransaction
-        from datetime import datetime
-        from sqlalchemy import func
-
-        MONTHLY_DAYS = 30
-
-        # ========== 1. قراءة البيانات من إعدادات النظام (SystemSettings) ==========
-        BASIC_SALARY = safe_float(getattr(self, 'salary', 60000), 60000)
-        TOTAL_SALARY = safe_float(getattr(self, 'total_salary', BASIC_SALARY), BASIC_SALARY)
-
-        DAILY_RESIDENT = safe_float(get_system_setting('daily_resident_allowance', 500))
-        MONTHLY_CLOTHING = safe_float(get_system_setting('monthly_clothing', 2033.33))
-        MONTHLY_HEALTH = safe_float(get_system_setting('monthly_health', 1250.00))
-        MONTHLY_INSURANCE = safe_float(get_system_setting('monthly_insurance', 10800.00))
-
-        # ========== 2. حساب النسبة ==========
-        attendance_days = max(0, attendance_days)
-        paid_leave_days = max(0, paid_leave_days)
-        total_paid_days = min(MONTHLY_DAYS, attendance_days + paid_leave_days)
-        ratio = min(1.0, total_paid_days / MONTHLY_DAYS) if total_paid_days > 0 else 0.0
+        from utils import calculate_employees_salary_breakdowns
 
-        # ========== 3. حساب الراتب اليومي ==========
-        DAILY_RATE = BASIC_SALARY / MONTHLY_DAYS
-        basic_payout = DAILY_RATE * total_paid_days
-        is_resident = getattr(self, 'is_resident', False)
-        resident_payout = DAILY_RESIDENT * total_paid_days if is_resident else 0.0
-
-        # ========== 4. تكاليف الشركة (من إعدادات النظام) ==========
-        clothing_payout = MONTHLY_CLOTHING * ratio
-        health_payout = MONTHLY_HEALTH * ratio
-        insurance_payout = MONTHLY_INSURANCE * ratio
-
-        # ========== 5. ربح المتعهد ==========
-        difference = TOTAL_SALARY - BASIC_SALARY
-        contractor_profit = (difference * ratio) - (clothing_payout + health_payout + insurance_payout)
-
-        # ========== 6. صافي الراتب النقدي ==========
-        net_salary = basic_payout + resident_payout
-
-        # ========== 7. الإخراج النهائي (مباشر) ==========
-        return {
-            'attendance_days': attendance_days,
-            'total_paid_days': total_paid_days,
-            'ratio': round(ratio, 4),
-            'basic_salary': BASIC_SALARY,
-            'total_salary': TOTAL_SALARY,
-            'daily_rate': round(DAILY_RATE, 2),
-            'basic_payout': round(basic_payout, 2),
-            'resident_allowance': round(resident_payout, 2),
-            'clothing_allowance': round(clothing_payout, 2),
-            'health_card': round(health_payout, 2),
-            'insurance': round(insurance_payout, 2),
-            'contractor_profit': round(contractor_profit, 2),
-            'cash_payout': round(net_salary, 2),
-            'net_salary': round(net_salary, 2)
-        }
+        return calculate_employees_salary_breakdowns([self], [attendance_days], [paid_leave_days])[0]
 
 
     def get_unsettled_transactions_total(self):
         """الحصول على إجمالي المعاملات غير المسواة للموظف"""
-        from sqlalchemy import func
-
-        result = {
-            'advance': 0.0,
-            'overtime': 0.0,
-            'deduction': 0.0,
-            'penalty': 0.0,
-            'cafeteria': 0.0,
-            'restaurant': 0.0,
-            'meal': 0.0
-        }
-
-        for trans_type in result.keys():
-            total = db.session.query(func.coalesce(func.sum(FinancialTransaction.amount), 0)).filter(
-                FinancialTransaction.employee_id == self.id,
-                FinancialTransaction.transaction_type == trans_type,
-                FinancialTransaction.is_settled == False
-            ).scalar()
-            result[trans_type] = total or 0.0
+        from utils import get_employees_unsettled_totals
 
-        return result
+        return get_employees_unsettled_totals([self.id])[self.id]
 
     # ========== دوال مساعدة ==========
     def get_attendance_count(self, start_date, end_date):
@@ -406,6 +418,10 @@ class Evaluation(db.Model):
     location = db.relationship('Location', foreign_keys=[location_id], backref='location_evaluations')
     details = db.relationship('EvaluationDetail', backref='evaluation', cascade='all, delete-orphan')
 
+    __table_args__ = (
+        db.Index('ix_evaluations_employee_date', 'employee_id', 'date'),
+    )
+
     def set_criteria_scores(self, scores_list):
         """تخزين درجات المعايير"""
         import json
@@ -494,13 +510,14 @@ class Company(db.Model):
     def get_or_create_receivable_account(self):
         """الحصول على حساب العميل الفرعي أو إنشاؤه تلقائياً"""
         from models import Account
+        from utils import get_account_by_code
         if self.receivable_account_id:
             account = Account.query.get(self.receivable_account_id)
             if account:
                 return account
 
         # إنشاء حساب فرعي جديد
-        parent = Account.query.filter_by(code='120001').first()
+        parent = get_account_by_code('120001')
         if not parent:
             parent = Account(
                 code='120001', name='العملاء', name_ar='العملاء',
@@ -605,6 +622,9 @@ class Salary(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     employee_id = db.Column(db.Integer, db.ForeignKey('employees.id'), nullable=False)
     month_year = db.Column(db.String(20), nullable=False)
+    # الشهر المالي مطبّعاً من month_year (يُعبأ تلقائياً) - للفلترة عبر الفهرس
+    period_year = db.Column(db.Integer)
+    period_month = db.Column(db.Integer)
 
     # ✅ الأساسيات
     base_salary = db.Column(db.Numeric(12, 2), default=0)
@@ -664,8 +684,81 @@ class Salary(db.Model):
     # ✅ Unique Constraint
     __table_args__ = (
         db.UniqueConstraint('employee_id', 'month_year', name='uq_employee_period_salary'),
+        db.Index('ix_salaries_period', 'period_year', 'period_month', 'employee_id', 'is_paid'),
+        db.Index('ix_salaries_employee_period', 'employee_id', 'period_year', 'period_month'),
     )
 
+    @staticmethod
+    def period_for(month_year):
+        """
+        (السنة، الشهر) من month_year بأي من صيغه المخزنة:
+        MM-YYYY أو YYYY-MM أو YYYYMMDD_YYYYMMDD (شهر نهاية الفترة المالية)
+        """
+        try:
+            if '_' in month_year:
+                end = datetime.strptime(month_year.split('_')[1], '%Y%m%d')
+                return end.year, end.month
+            first, second = month_year.split('-')
+            year, month = (int(first), int(second)) if len(first) == 4 else (int(second), int(first))
+        except (AttributeError, TypeError, ValueError):
+            return None, None
+        if not 1 <= month <= 12:
+            return None, None
+        return year, month
+
+    @classmethod
+    def period_is(cls, year, month):
+        return db.and_(cls.period_year == year, cls.period_month == month)
+
+    @staticmethod
+    def month_spellings(month_year, year, month):
+        """صيغ الشهر المخزنة: الصيغة المعطاة أولاً ثم MM-YYYY و YYYY-MM"""
+        spellings = [month_year]
+        for key in (f'{month:02d}-{year}', f'{year}-{month:02d}'):
+            if key not in spellings:
+                spellings.append(key)
+        return spellings
+
+    @classmethod
+    def period_key_is(cls, month_year):
+        """مطابقة month_year حرفياً عبر فهرس الشهر"""
+        year, month = cls.period_for(month_year)
+        if year is None:
+            return cls.month_year == month_year
+        return db.and_(cls.period_is(year, month), cls.month_year == month_year)
+
+    @classmethod
+    def period_matches(cls, month_year):
+        """
+        شرط فلترة لقيمة month_year من الواجهة:
+        شهر (MM-YYYY أو YYYY-MM) يطابق صيغتي الشهر فقط - لا رواتب الفترات المالية
+        (YYYYMMDD_YYYYMMDD) المنسوبة لنفس الشهر؛ مفتاح الفترة يطابق نفسه فقط
+        """
+        year, month = cls.period_for(month_year)
+        if year is None or '_' in month_year:
+            return cls.period_key_is(month_year)
+        return db.and_(cls.period_is(year, month),
+                       cls.month_year.in_(cls.month_spellings(month_year, year, month)))
+
+    @classmethod
+    def stored_month_key(cls, month_year):
+        """
+        أول صيغة للشهر لها رواتب مخزنة (المعطاة أولاً ثم البديلة) - للإجماليات،
+        حتى لا يُجمع شهر مخزن بالصيغتين مرتين
+        """
+        year, month = cls.period_for(month_year)
+        if year is None or '_' in month_year:
+            return month_year
+        spellings = cls.month_spellings(month_year, year, month)
+        found = {key for key, in db.session.query(cls.month_year).filter(
+            cls.period_is(year, month), cls.month_year.in_(spellings)
+        ).distinct()}
+        return next((key for key in spellings if key in found), month_year)
+
+    @classmethod
+    def period_order(cls):
+        return cls.period_year.desc(), cls.period_month.desc()
+
     def get_breakdown(self):
         return {
             'employee_payout': {
@@ -707,6 +800,8 @@ class Salary(db.Model):
             'company_id': emp.company_id if emp else None,
             'company_name': emp.company.name if emp and emp.company else '',
             'month_year': self.month_year,
+            'period_year': self.period_year,
+            'period_month': self.period_month,
             'attendance_days': self.attendance_days,
             'base_salary': float(self.base_salary) if self.base_salary else 0,
             'basic_salary_amount': float(self.basic_salary_amount) if self.basic_salary_amount else 0,
@@ -855,6 +950,7 @@ class ContractorAnnualCost(db.Model):
 def create_labor_accounts():
     """إنشاء الحسابات المحاسبية لرواتب العمال"""
     from models import Account, db
+    from utils import get_account_by_code
 
     labor_accounts = [
         # مصروفات الرواتب
@@ -881,7 +977,7 @@ def create_labor_accounts():
 
     created_count = 0
     for code, name, name_ar, account_type, nature in labor_accounts:
-        existing = Account.query.filter_by(code=code).first()
+        existing = get_account_by_code(code)
         if not existing:
             account = Account(
                 code=code,
@@ -1755,23 +1851,50 @@ class Account(db.Model):
     journal_entries = db.relationship('JournalEntryDetail', backref='account')
 
     def get_balance(self, as_of_date=None):
-        """الحصول على رصيد الحساب حتى تاريخ معين"""
+        """الحصول على رصيد الحساب حتى تاريخ معين (من أرصدة الفترات AccountBalance)"""
         from sqlalchemy import func
+        from datetime import timedelta
 
-        query = db.session.query(func.sum(JournalEntryDetail.debit), func.sum(JournalEntryDetail.credit))
+        query = db.session.query(
+            func.coalesce(func.sum(AccountBalance.debit), 0),
+            func.coalesce(func.sum(AccountBalance.credit), 0)
+        ).filter(AccountBalance.account_id == self.id)
 
+        partial_debit = partial_credit = 0
         if as_of_date:
-            query = query.join(JournalEntry).filter(JournalEntry.date <= as_of_date)
+            if isinstance(as_of_date, datetime):
+                as_of_date = as_of_date.date()
+
+            # إذا كان التاريخ آخر يوم في الشهر يدخل الشهر كاملاً من جدول الأرصدة
+            if (as_of_date + timedelta(days=1)).day == 1:
+                last_year, last_period = as_of_date.year, as_of_date.month
+            else:
+                last_year, last_period = as_of_date.year, as_of_date.month - 1
+
+                # الجزء المنقضي من الشهر الحالي فقط
+                partial_debit, partial_credit = db.session.query(
+                    func.coalesce(func.sum(JournalEntryDetail.debit), 0),
+                    func.coalesce(func.sum(JournalEntryDetail.credit), 0)
+                ).join(JournalEntry, JournalEntry.id == JournalEntryDetail.entry_id).filter(
+                    JournalEntryDetail.account_id == self.id,
+                    JournalEntry.date >= as_of_date.replace(day=1),
+                    JournalEntry.date <= as_of_date
+                ).first()
 
-        result = query.filter(JournalEntryDetail.account_id == self.id).first()
+            query = query.filter(
+                (AccountBalance.fiscal_year < last_year) |
+                ((AccountBalance.fiscal_year == last_year) & (AccountBalance.period <= last_period))
+            )
 
-        total_debit = result[0] or 0
-        total_credit = result[1] or 0
+        result = query.first()
+
+        total_debit = float(result[0] or 0) + float(partial_debit or 0)
+        total_credit = float(result[1] or 0) + float(partial_credit or 0)
 
         if self.nature == 'debit':
-            balance = self.opening_balance + total_debit - total_credit
+            balance = (self.opening_balance or 0) + total_debit - total_credit
         else:
-            balance = self.opening_balance + total_credit - total_debit
+            balance = (self.opening_balance or 0) + total_credit - total_debit
 
         return balance
 
@@ -1809,6 +1932,7 @@ class JournalEntry(db.Model):
     description = db.Column(db.String(500), nullable=False)  # وصف القيد
     reference_type = db.Column(db.String(50), nullable=True)  # نوع المرجع (salary, transaction, invoice, etc.)
     reference_id = db.Column(db.Integer, nullable=True)  # معرف المرجع
+    period_key = db.Column(db.String(7))  # شهر القيد YYYY-MM (يُعبأ تلقائياً من التاريخ)
     created_by = db.Column(db.Integer, db.ForeignKey('users.id'))
     is_posted = db.Column(db.Boolean, default=True)  # هل تم ترحيل القيد
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -1818,10 +1942,28 @@ class JournalEntry(db.Model):
     creator = db.relationship('User', foreign_keys=[created_by])
     details = db.relationship('JournalEntryDetail', backref='entry', cascade='all, delete-orphan')
 
+    # فحص القيود المكررة (نفس المرجع / نفس الشهر) عبر الفهارس، وتصفح القيود حسب (التاريخ، المعرف)
+    __table_args__ = (
+        db.Index('ix_journal_entries_reference', 'reference_type', 'reference_id'),
+        db.Index('ix_journal_entries_reference_period', 'reference_type', 'period_key'),
+        db.Index('ix_journal_entries_date_id', 'date', 'id'),
+    )
+
+    # (مدين، دائن) محسوبة مسبقاً في SQL عند عرض القوائم - انظر utils.list_journal_entries
+    _totals = None
+
+    @staticmethod
+    def period_key_for(entry_date):
+        return entry_date.strftime('%Y-%m') if entry_date else None
+
     def get_total_debit(self):
+        if self._totals is not None:
+            return self._totals[0]
         return sum(d.debit for d in self.details) or 0
 
     def get_total_credit(self):
+        if self._totals is not None:
+            return self._totals[1]
         return sum(d.credit for d in self.details) or 0
 
     def is_balanced(self):
@@ -1846,8 +1988,8 @@ class JournalEntryDetail(db.Model):
     __tablename__ = 'journal_entry_details'
 
     id = db.Column(db.Integer, primary_key=True)
-    entry_id = db.Column(db.Integer, db.ForeignKey('journal_entries.id'), nullable=False)
-    account_id = db.Column(db.Integer, db.ForeignKey('accounts.id'), nullable=False)
+    entry_id = db.Column(db.Integer, db.ForeignKey('journal_entries.id'), nullable=False, index=True)
+    account_id = db.Column(db.Integer, db.ForeignKey('accounts.id'), nullable=False, index=True)
     debit = db.Column(db.Float, default=0)  # مدين
     credit = db.Column(db.Float, default=0)  # دائن
     description = db.Column(db.String(200))
@@ -1884,6 +2026,291 @@ class AccountBalance(db.Model):
 
     __table_args__ = (db.UniqueConstraint('account_id', 'fiscal_year', 'period', name='unique_account_period'),)
 
+    @staticmethod
+    def apply_deltas(connection, deltas):
+        """
+        إضافة حركات المدين/الدائن إلى أرصدة الفترات داخل نفس المعاملة
+
+        Args:
+            connection: اتصال المعاملة الحالية
+            deltas: {(account_id, fiscal_year, period): [debit, credit]}
+        """
+        now = datetime.utcnow()
+        rows = [
+            {'account_id': account_id, 'fiscal_year': year, 'period': period,
+             'debit': debit, 'credit': credit, 'updated_at': now}
+            for (account_id, year, period), (debit, credit) in deltas.items()
+            if account_id and (debit or credit)
+        ]
+        if not rows:
+            return
+
+        # أي حركة بتاريخ سابق للقطة ميزان مراجعة تجعلها (وما بعدها) غير صحيحة
+        first_year, first_period = min((row['fiscal_year'], row['period']) for row in rows)
+        TrialBalance.invalidate(connection, datetime(first_year, first_period, 1).date())
+
+        table = AccountBalance.__table__
+        stmt = dialect_insert(connection, table)
+        if stmt is not None:
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['account_id', 'fiscal_year', 'period'],
+                set_={
+                    'debit': db.func.coalesce(table.c.debit, 0) + stmt.excluded.debit,
+                    'credit': db.func.coalesce(table.c.credit, 0) + stmt.excluded.credit,
+                    'updated_at': stmt.excluded.updated_at,
+                }
+            )
+            connection.execute(stmt, rows)
+            return
+
+        # قواعد بيانات أخرى: تحديث ثم إدراج
+        for row in rows:
+            result = connection.execute(
+                table.update().where(
+                    (table.c.account_id == row['account_id']) &
+                    (table.c.fiscal_year == row['fiscal_year']) &
+                    (table.c.period == row['period'])
+                ).values(
+                    debit=db.func.coalesce(table.c.debit, 0) + row['debit'],
+                    credit=db.func.coalesce(table.c.credit, 0) + row['credit'],
+                    updated_at=now
+                )
+            )
+            if result.rowcount == 0:
+                connection.execute(table.insert().values(**row))
+
+    @staticmethod
+    def rebuild(only_if_empty=False):
+        """إعادة بناء أرصدة الفترات من تفاصيل القيود (للبيانات السابقة أو بعد تعديل يدوي)"""
+        from sqlalchemy import func, extract
+
+        connection = db.session.connection()
+        if connection.dialect.name == 'postgresql':
+            # منع عاملين (workers) من إعادة البناء في نفس الوقت
+            db.session.execute(db.text('LOCK TABLE account_balances IN EXCLUSIVE MODE'))
+
+        if only_if_empty:
+            if AccountBalance.query.first() is not None or JournalEntryDetail.query.first() is None:
+                db.session.commit()
+                return 0
+
+        year = extract('year', JournalEntry.date)
+        month = extract('month', JournalEntry.date)
+        rows = db.session.query(
+            JournalEntryDetail.account_id, year, month,
+            func.sum(JournalEntryDetail.debit), func.sum(JournalEntryDetail.credit)
+        ).join(JournalEntry, JournalEntry.id == JournalEntryDetail.entry_id).group_by(
+            JournalEntryDetail.account_id, year, month
+        ).all()
+
+        AccountBalance.query.delete()
+        deltas = {
+            (account_id, int(y), int(m)): [float(debit or 0), float(credit or 0)]
+            for account_id, y, m, debit, credit in rows
+        }
+        AccountBalance.apply_deltas(connection, deltas)
+        db.session.commit()
+        return len(deltas)
+
+
+class DocumentSequence(db.Model):
+    """عدادات ترقيم المستندات (قيود، فواتير...) لكل بادئة وسنة"""
+    __tablename__ = 'document_sequences'
+
+    id = db.Column(db.Integer, primary_key=True)
+    prefix = db.Column(db.String(20), nullable=False)  # JE, REV, SI, INV
+    year = db.Column(db.Integer, nullable=False)
+    last_value = db.Column(db.Integer, nullable=False, default=0)  # آخر رقم محجوز
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (db.UniqueConstraint('prefix', 'year', name='unique_document_sequence'),)
+
+    @staticmethod
+    def allocate(prefix, year, count=1, seed=None):
+        """
+        حجز مجموعة أرقام متتالية بشكل ذري وإرجاع أول رقم فيها
+
+        Args:
+            seed: دالة تُستدعى مرة واحدة عند إنشاء العداد لإرجاع آخر رقم مستخدم فعلياً
+        """
+        if db.session.get_bind().dialect.name == 'postgresql':
+            # معاملة مستقلة قصيرة: لا يبقى قفل العداد طوال معاملة الطلب
+            with db.engine.begin() as connection:
+                last_value = DocumentSequence._increment(connection, prefix, year, count, seed)
+        else:
+            last_value = DocumentSequence._increment(db.session.connection(), prefix, year, count, seed)
+        return last_value - count + 1
+
+    @staticmethod
+    def _increment(connection, prefix, year, count, seed):
+        table = DocumentSequence.__table__
+        now = datetime.utcnow()
+        last_value = connection.execute(
+            table.update()
+            .where((table.c.prefix == prefix) & (table.c.year == year))
+            .values(last_value=table.c.last_value + count, updated_at=now)
+            .returning(table.c.last_value)
+        ).scalar()
+        if last_value is not None:
+            return last_value
+
+        # أول استخدام للعداد في هذه السنة
+        start = int(seed() or 0) if seed else 0
+        stmt = dialect_insert(connection, table)
+        if stmt is None:
+            connection.execute(table.insert().values(prefix=prefix, year=year, last_value=start, updated_at=now))
+            return DocumentSequence._increment(connection, prefix, year, count, None)
+        stmt = stmt.values(prefix=prefix, year=year, last_value=start + count, updated_at=now)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['prefix', 'year'],
+            set_={'last_value': table.c.last_value + count, 'updated_at': now}
+        ).returning(table.c.last_value)
+        return connection.execute(stmt).scalar()
+
+
+def dialect_insert(connection, table):
+    """INSERT يدعم ON CONFLICT (PostgreSQL / SQLite) - يعيد None لباقي قواعد البيانات"""
+    if connection.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif connection.dialect.name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return None
+    return insert(table)
+
+
+# ==================== تحديث أرصدة الفترات تلقائياً مع كل قيد ====================
+# كل إضافة/تعديل/حذف لتفاصيل القيود (من أي مسار) تُجمع أثناء flush
+# ثم تُطبق على account_balances في نفس المعاملة
+
+def _stored_values(connection, target, keys):
+    """القيم المحفوظة في قاعدة البيانات قبل التعديل/الحذف الحالي"""
+    state = db.inspect(target)
+    values = {}
+    for key in keys:
+        history = state.attrs[key].history
+        if history.deleted:
+            values[key] = history.deleted[0]
+        elif history.unchanged:
+            values[key] = history.unchanged[0]
+        else:
+            # القيمة القديمة غير محمّلة (كائن منتهي الصلاحية) - قراءتها من الجدول
+            table = type(target).__table__
+            row = connection.execute(
+                db.select(*[table.c[k] for k in keys]).where(table.c.id == target.id)
+            ).first()
+            return dict(zip(keys, row)) if row else None
+    return values
+
+
+def _entry_date(session, connection, entry_id, entry=None):
+    if entry is None:
+        entry = session.identity_map.get(session.identity_key(JournalEntry, entry_id))
+    if entry is not None and 'date' in db.inspect(entry).dict and entry.date is not None:
+        return entry.date
+    return connection.execute(
+        db.select(JournalEntry.date).where(JournalEntry.id == entry_id)
+    ).scalar()
+
+
+def _add_ledger_delta(session, entry_date, account_id, debit, credit, sign=1):
+    if entry_date is None or not account_id:
+        return
+    deltas = session.info.setdefault('ledger_deltas', {})
+    bucket = deltas.setdefault((account_id, entry_date.year, entry_date.month), [0.0, 0.0])
+    bucket[0] += sign * float(debit or 0)
+    bucket[1] += sign * float(credit or 0)
+
+
+_DETAIL_LEDGER_KEYS = ('entry_id', 'account_id', 'debit', 'credit')
+
+
+def _remove_stored_detail(session, connection, target):
+    old = _stored_values(connection, target, _DETAIL_LEDGER_KEYS)
+    if old:
+        _add_ledger_delta(session, _entry_date(session, connection, old['entry_id']),
+                          old['account_id'], old['debit'], old['credit'], sign=-1)
+
+
+@db.event.listens_for(JournalEntryDetail, 'after_insert')
+def _ledger_detail_inserted(mapper, connection, target):
+    session = db.object_session(target)
+    # القيد الأب قد يكون مُدرجاً في نفس flush (غير موجود بعد في identity map)
+    entry = db.inspect(target).dict.get('entry')
+    entry_date = _entry_date(session, connection, target.entry_id, entry)
+    _add_ledger_delta(session, entry_date, target.account_id, target.debit, target.credit)
+
+
+@db.event.listens_for(JournalEntryDetail, 'before_update')
+def _ledger_detail_updated(mapper, connection, target):
+    state = db.inspect(target)
+    if not any(state.attrs[key].history.has_changes() for key in _DETAIL_LEDGER_KEYS):
+        return
+    session = db.object_session(target)
+    _remove_stored_detail(session, connection, target)
+    _add_ledger_delta(session, _entry_date(session, connection, target.entry_id),
+                      target.account_id, target.debit, target.credit)
+
+
+@db.event.listens_for(JournalEntryDetail, 'before_delete')
+def _ledger_detail_deleted(mapper, connection, target):
+    _remove_stored_detail(db.object_session(target), connection, target)
+
+
+@db.event.listens_for(JournalEntry, 'before_update')
+def _ledger_entry_date_changed(mapper, connection, target):
+    """نقل حركات القيد بين الفترات عند تغيير تاريخه"""
+    if not db.inspect(target).attrs.date.history.has_changes() or target.date is None:
+        return
+    old_date = _stored_values(connection, target, ('date',))['date']
+    new_date = target.date
+    if old_date is None or (old_date.year, old_date.month) == (new_date.year, new_date.month):
+        return
+    session = db.object_session(target)
+    rows = connection.execute(
+        db.select(JournalEntryDetail.account_id,
+                  db.func.sum(JournalEntryDetail.debit), db.func.sum(JournalEntryDetail.credit))
+        .where(JournalEntryDetail.entry_id == target.id)
+        .group_by(JournalEntryDetail.account_id)
+    ).all()
+    for account_id, debit, credit in rows:
+        _add_ledger_delta(session, old_date, account_id, debit, credit, sign=-1)
+        _add_ledger_delta(session, new_date, account_id, debit, credit)
+
+
+@db.event.listens_for(JournalEntry, 'before_insert')
+@db.event.listens_for(JournalEntry, 'before_update')
+def _journal_entry_period_key(mapper, connection, target):
+    state = db.inspect(target)
+    if 'date' not in state.dict:
+        return
+    period_key = JournalEntry.period_key_for(state.dict['date'])
+    if state.dict.get('period_key') != period_key:
+        target.period_key = period_key
+
+
+@db.event.listens_for(Salary, 'before_insert')
+@db.event.listens_for(Salary, 'before_update')
+def _salary_period(mapper, connection, target):
+    state = db.inspect(target)
+    if 'month_year' not in state.dict:
+        return
+    period = Salary.period_for(state.dict['month_year'])
+    if (state.dict.get('period_year'), state.dict.get('period_month')) != period:
+        target.period_year, target.period_month = period
+
+
+@db.event.listens_for(db.orm.Session, 'before_flush')
+def _ledger_reset_deltas(session, flush_context, instances):
+    session.info['ledger_deltas'] = {}
+
+
+@db.event.listens_for(db.orm.Session, 'after_flush')
+def _ledger_apply_deltas(session, flush_context):
+    deltas = session.info.pop('ledger_deltas', None)
+    if deltas:
+        AccountBalance.apply_deltas(session.connection(), deltas)
+
 
 class FiscalYear(db.Model):
     """نموذج السنة المالية"""
@@ -1918,6 +2345,19 @@ class TrialBalance(db.Model):
     # العلاقات
     account = db.relationship('Account', backref='trial_balances')
 
+    __table_args__ = (
+        db.Index('ix_trial_balances_date_account', 'as_of_date', 'account_id', unique=True),
+    )
+
+    @staticmethod
+    def invalidate(connection, from_date, to_date=None):
+        """حذف لقطات ميزان المراجعة التي لم تعد صحيحة (من تاريخ / حتى تاريخ)"""
+        table = TrialBalance.__table__
+        condition = table.c.as_of_date >= from_date
+        if to_date:
+            condition = condition & (table.c.as_of_date <= to_date)
+        connection.execute(table.delete().where(condition))
+
 
 # ==================== مدفوعات الشركات (من طلعت هائل إلى الشركات) ====================
 
@@ -1977,13 +2417,14 @@ class Supplier(db.Model):
     def get_or_create_payable_account(self):
         """الحصول على حساب المورد الفرعي أو إنشاؤه تلقائياً"""
         from models import Account
+        from utils import get_account_by_code
         if self.payable_account_id:
             account = Account.query.get(self.payable_account_id)
             if account:
                 return account
 
         # الحصول على الحساب الرئيسي للدائنون
-        parent = Account.query.filter_by(code='220001').first()
+        parent = get_account_by_code('220001')
         if not parent:
             parent = Account(
                 code='220001', name='الدائنون', name_ar='الدائنون',
@@ -2225,8 +2666,9 @@ class SystemSettings(db.Model):
     def get_account(self):
         """الحصول على كائن الحساب المحاسبي"""
         from models import Account
+        from utils import get_account_by_code
         if self.account_code:
-            return Account.query.filter_by(code=self.account_code).first()
+            return get_account_by_code(self.account_code)
         return None
 
     def get_display_value(self):
@@ -2362,8 +2804,21 @@ class WorkPlan(db.Model):
     creator = db.relationship('User', backref='created_plans')
     tasks = db.relationship('WorkPlanTask', backref='plan', cascade='all, delete-orphan', order_by='WorkPlanTask.order')
 
-    def to_dict(self):
-        return {
+    __table_args__ = (
+        db.Index('ix_work_plans_plan_date_id', 'plan_date', 'id'),
+    )
+
+    # (عدد المهام، المكتملة) محسوبة مسبقاً في SQL عند عرض القوائم - انظر utils.list_work_plans
+    _task_counts = None
+
+    def get_task_counts(self):
+        if self._task_counts is not None:
+            return self._task_counts
+        return len(self.tasks), sum(1 for t in self.tasks if t.is_completed)
+
+    def to_dict(self, include_tasks=True):
+        tasks_count, completed_tasks = self.get_task_counts()
+        data = {
             'id': self.id,
             'title': self.title,
             'description': self.description or '',
@@ -2384,11 +2839,13 @@ class WorkPlan(db.Model):
             'status': self.status,
             'status_name': {'pending': 'قيد الانتظار', 'in_progress': 'قيد التنفيذ', 'completed': 'مكتمل', 'cancelled': 'ملغي'}.get(self.status, self.status),
             'progress': self.progress,
-            'tasks_count': len(self.tasks),
-            'completed_tasks': sum(1 for t in self.tasks if t.is_completed),
-            'tasks': [t.to_dict() for t in self.tasks],
+            'tasks_count': tasks_count,
+            'completed_tasks': completed_tasks,
             'created_at': self.created_at.strftime('%Y-%m-%d %H:%M') if self.created_at else None,
         }
+        if include_tasks:
+            data['tasks'] = [t.to_dict() for t in self.tasks]
+        return data
 
 
 class WorkPlanTask(db.Model):
@@ -2396,7 +2853,7 @@ class WorkPlanTask(db.Model):
     __tablename__ = 'work_plan_tasks'
 
     id = db.Column(db.Integer, primary_key=True)
-    plan_id = db.Column(db.Integer, db.ForeignKey('work_plans.id'), nullable=False)
+    plan_id = db.Column(db.Integer, db.ForeignKey('work_plans.id'), nullable=False, index=True)
     title = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text)
     order = db.Column(db.Integer, default=0)
@@ -2464,10 +2921,20 @@ class FinancialPeriod(db.Model):
         return self.status == 'open'
 
     def close(self, user_id):
-        """إغلاق الفترة"""
+        """إغلاق الفترة مع حفظ لقطة ميزان المراجعة في نهايتها"""
+        from utils import snapshot_trial_balance
+
         self.status = 'closed'
         self.closed_by = user_id
         self.closed_at = datetime.utcnow()
+        snapshot_trial_balance(self.end_date)
+
+    def reopen(self):
+        """إعادة فتح الفترة - لقطة ميزان المراجعة داخلها لم تعد نهائية"""
+        self.status = 'open'
+        self.closed_by = None
+        self.closed_at = None
+        TrialBalance.invalidate(db.session.connection(), self.start_date, self.end_date)
 
     def lock(self):
         """قفل الفترة (لا يمكن فتحها مرة أخرى)"""
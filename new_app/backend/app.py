@@ -80,6 +80,9 @@ def create_app():
     app.register_blueprint(settings_bp)
     app.register_blueprint(employee_portal_bp)
 
+    from stats_cache import register_stats_invalidation
+    register_stats_invalidation(app)
+
     # Serve frontend build
     frontend_dir = os.path.join(os.path.dirname(__file__), '..', 'frontend', 'dist')
     if os.path.exists(frontend_dir):
@@ -1,6 +1,10 @@
 import os
+import threading
+import time
 import psycopg2
+import psycopg2.extensions
 import psycopg2.extras
+import psycopg2.pool
 from contextlib import contextmanager
 
 DATABASE_URL = os.environ.get('DATABASE_URL')
@@ -13,26 +17,118 @@ def get_db_url():
         return url
     return None
 
+# Pool sized to the gunicorn threads of one worker; nested get_db() calls in
+# a request take a second connection, hence the headroom
+DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', 1))
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', 2 * int(os.environ.get('GUNICORN_THREADS', 4))))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+# Connections idle longer than this are pinged before being handed out
+DB_POOL_PING_AFTER = float(os.environ.get('DB_POOL_PING_AFTER', 60))
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+_pool_slots = None
+_last_used = {}
+_sqlite_local = threading.local()
+
+
+def _get_pool():
+    global _pool, _pool_pid, _pool_slots
+    # gunicorn forks workers; a pool must never be shared across processes
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = psycopg2.pool.ThreadedConnectionPool(DB_POOL_MIN, DB_POOL_MAX, get_db_url())
+                _pool_slots = threading.BoundedSemaphore(DB_POOL_MAX)
+                _pool_pid = os.getpid()
+                _last_used.clear()
+    return _pool
+
+
+def _is_healthy(conn):
+    if conn.closed:
+        return False
+    last_used = _last_used.get(id(conn))
+    if last_used is None or time.monotonic() - last_used < DB_POOL_PING_AFTER:
+        return True
+    try:
+        cur = conn.cursor()
+        cur.execute('SELECT 1')
+        cur.close()
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def _checkout():
+    pool = _get_pool()
+    if not _pool_slots.acquire(timeout=DB_POOL_TIMEOUT):
+        raise psycopg2.pool.PoolError('connection pool exhausted')
+    try:
+        conn = pool.getconn()
+        if not _is_healthy(conn):
+            _last_used.pop(id(conn), None)
+            pool.putconn(conn, close=True)
+            conn = pool.getconn()
+        conn.autocommit = False
+        return pool, conn
+    except Exception:
+        _pool_slots.release()
+        raise
+
+
+def _checkin(pool, conn):
+    try:
+        close = bool(conn.closed)
+        if not close:
+            try:
+                # Leave no open transaction behind for the next borrower
+                if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                conn.autocommit = False
+            except psycopg2.Error:
+                close = True
+        if close:
+            _last_used.pop(id(conn), None)
+        else:
+            _last_used[id(conn)] = time.monotonic()
+        pool.putconn(conn, close=close)
+    finally:
+        _pool_slots.release()
+
+
+def _sqlite_connection():
+    conn = getattr(_sqlite_local, 'conn', None)
+    if conn is None:
+        import sqlite3
+        _db_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+        db_path = os.path.join(_db_dir, 'instance', 'aljwahrh_land.db')
+        conn = sqlite3.connect(db_path)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        _sqlite_local.conn = conn
+    return conn
+
+
 @contextmanager
 def get_db():
     db_url = get_db_url()
     if db_url:
-        conn = psycopg2.connect(db_url)
-        conn.autocommit = False
+        pool, conn = _checkout()
         try:
             yield conn
         finally:
-            conn.close()
+            _checkin(pool, conn)
     else:
-        import sqlite3
-        _db_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
-        db_path = os.path.join(_db_dir, 'instance', 'aljwahrh_land.db')
-        conn = sqlite3.connect(db_path)
-        conn.row_factory = sqlite3.Row
+        # One persistent connection per thread
+        conn = _sqlite_connection()
         try:
             yield conn
         finally:
-            conn.close()
+            if conn.in_transaction:
+                conn.rollback()
 
 def fetch_all(conn, query, params=None):
     db_url = get_db_url()
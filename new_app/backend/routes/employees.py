@@ -11,22 +11,19 @@ EMPLOYEE_COLUMNS = """id, code, full_name, phone, address, card_number, position
     hire_date, user_id, region"""
 
 
+def _employee_select():
+    """Employees with company and supervisor names resolved in the same query."""
+    columns = ', '.join(f'e.{c.strip()}' for c in EMPLOYEE_COLUMNS.split(','))
+    return (f"SELECT {columns}, c.name AS company_name, s.full_name AS supervisor_name FROM employees e"
+            " LEFT JOIN clean_companies c ON c.id = e.company_id"
+            " LEFT JOIN employees s ON s.id = e.supervisor_id")
+
+
+def _fetch_employees(conn, where='', params=()):
+    return fetch_all(conn, f"{_employee_select()} WHERE 1=1{where}", params)
+
+
 def _emp_to_dict(row):
-    company_name = None
-    supervisor_name = None
-    try:
-        if row.get('company_id'):
-            with get_db() as conn:
-                r = fetch_one(conn, "SELECT name FROM clean_companies WHERE id=%s", (row['company_id'],))
-                if r:
-                    company_name = r['name']
-        if row.get('supervisor_id'):
-            with get_db() as conn:
-                r = fetch_one(conn, "SELECT full_name FROM employees WHERE id=%s", (row['supervisor_id'],))
-                if r:
-                    supervisor_name = r['full_name']
-    except Exception:
-        pass
     return {
         'id': row.get('id'),
         'code': row.get('code'),
@@ -41,9 +38,9 @@ def _emp_to_dict(row):
         'is_active': row.get('is_active'),
         'is_resident': row.get('is_resident'),
         'company_id': row.get('company_id'),
-        'company_name': company_name,
+        'company_name': row.get('company_name'),
         'supervisor_id': row.get('supervisor_id'),
-        'supervisor_name': supervisor_name,
+        'supervisor_name': row.get('supervisor_name'),
         'user_id': row.get('user_id'),
         'qualification': row.get('qualification'),
         'specialization': row.get('specialization'),
@@ -58,6 +55,12 @@ def _emp_to_dict(row):
     }
 
 
+def _get_employee_row(emp_id):
+    with get_db() as conn:
+        rows = _fetch_employees(conn, " AND e.id=%s", (emp_id,))
+    return rows[0] if rows else None
+
+
 @employees_bp.route('/api/employees', methods=['GET'])
 @token_required
 def list_employees(current_user):
@@ -66,53 +69,49 @@ def list_employees(current_user):
     search = request.args.get('search', '')
     company_id = request.args.get('company_id', type=int)
 
-    q = f"SELECT {EMPLOYEE_COLUMNS} FROM employees WHERE 1=1"
+    where = ""
     params = []
 
     if current_user.role == 'supervisor':
         if current_user.company_id:
-            q += " AND company_id = %s"
+            where += " AND e.company_id = %s"
             params.append(current_user.company_id)
         if current_user.employee_id:
-            q += " AND supervisor_id = %s"
+            where += " AND e.supervisor_id = %s"
             params.append(current_user.employee_id)
     elif current_user.role not in ('admin', 'owner'):
         return jsonify({'success': False, 'message': 'Access denied'}), 403
 
     if search:
-        q += " AND (full_name ILIKE %s OR code ILIKE %s)"
+        where += " AND (e.full_name ILIKE %s OR e.code ILIKE %s)"
         params.extend([f'%{search}%', f'%{search}%'])
 
     if company_id and current_user.role in ('admin', 'owner'):
-        q += " AND company_id = %s"
+        where += " AND e.company_id = %s"
         params.append(company_id)
 
-    q += " ORDER BY full_name"
-
     with get_db() as conn:
         if page:
-            count_q = q.replace(f"SELECT {EMPLOYEE_COLUMNS}", "SELECT COUNT(*)")
             cur = conn.cursor()
-            cur.execute(count_q, tuple(params))
+            cur.execute(f"SELECT COUNT(*) FROM employees e WHERE 1=1{where}", tuple(params))
             total = cur.fetchone()[0]
             offset = (page - 1) * per_page
-            q += f" LIMIT {per_page} OFFSET {offset}"
-            rows = fetch_all(conn, q, tuple(params))
+            rows = _fetch_employees(conn, where + f" ORDER BY e.full_name LIMIT {per_page} OFFSET {offset}",
+                                    tuple(params))
             pages = (total + per_page - 1) // per_page
             return jsonify({'success': True, 'data': {
                 'items': [_emp_to_dict(r) for r in rows],
                 'total': total, 'page': page, 'pages': pages
             }})
         else:
-            rows = fetch_all(conn, q, tuple(params))
+            rows = _fetch_employees(conn, where + " ORDER BY e.full_name", tuple(params))
             return jsonify({'success': True, 'data': [_emp_to_dict(r) for r in rows]})
 
 
 @employees_bp.route('/api/employees/<int:emp_id>', methods=['GET'])
 @token_required
 def get_employee(current_user, emp_id):
-    with get_db() as conn:
-        row = fetch_one(conn, f"SELECT {EMPLOYEE_COLUMNS} FROM employees WHERE id=%s", (emp_id,))
+    row = _get_employee_row(emp_id)
     if not row:
         return jsonify({'success': False, 'message': 'Employee not found'}), 404
     return jsonify({'success': True, 'data': _emp_to_dict(row)})
@@ -175,8 +174,7 @@ def create_employee(current_user):
             emp_id = cur.fetchone()[0]
             conn.commit()
 
-        with get_db() as conn:
-            row = fetch_one(conn, f"SELECT {EMPLOYEE_COLUMNS} FROM employees WHERE id=%s", (emp_id,))
+        row = _get_employee_row(emp_id)
 
         return jsonify({'success': True, 'data': _emp_to_dict(row), 'message': 'تم إضافة الموظف بنجاح'}), 201
     except Exception as e:
@@ -231,8 +229,7 @@ def update_employee(current_user, emp_id):
     with get_db() as conn:
         execute(conn, f"UPDATE employees SET {','.join(sets)} WHERE id=%s", vals)
 
-    with get_db() as conn:
-        row = fetch_one(conn, f"SELECT {EMPLOYEE_COLUMNS} FROM employees WHERE id=%s", (emp_id,))
+    row = _get_employee_row(emp_id)
     if not row:
         return jsonify({'success': False, 'message': 'Employee not found'}), 404
     return jsonify({'success': True, 'data': _emp_to_dict(row), 'message': 'تم تعديل الموظف بنجاح'})
@@ -2,6 +2,7 @@ from flask import Blueprint, request, jsonify
 from auth import token_required
 from datetime import datetime, timedelta
 from db import get_db, fetch_all
+from stats_cache import stats_cache, user_scope
 import calendar
 
 reports_bp = Blueprint('reports', __name__)
@@ -27,84 +28,9 @@ def safe_query(cur, query, params=None):
 @token_required
 def reports_dashboard(current_user):
     try:
-        with get_db() as conn:
-            cur = conn.cursor()
-
-            q = "SELECT COUNT(*) FROM employees WHERE 1=1"
-            params = []
-            if current_user.role == 'supervisor':
-                if current_user.company_id:
-                    q += " AND company_id = %s"
-                    params.append(current_user.company_id)
-                if current_user.employee_id:
-                    q += " AND supervisor_id = %s"
-                    params.append(current_user.employee_id)
-            cur.execute(q, tuple(params))
-            total_employees = cur.fetchone()[0]
-
-            q2 = q.replace("COUNT(*)", "COUNT(*) FILTER (WHERE is_active = true)")
-            cur.execute(q2, tuple(params))
-            active_employees = cur.fetchone()[0]
-
-            total_companies = safe_count(cur, "SELECT COUNT(*) FROM clean_companies")
-
-            q3 = "SELECT COALESCE(SUM(s.total_salary), 0) FROM salaries s JOIN employees e ON s.employee_id = e.id WHERE 1=1"
-            params3 = []
-            if current_user.role == 'supervisor':
-                if current_user.company_id:
-                    q3 += " AND e.company_id = %s"
-                    params3.append(current_user.company_id)
-                if current_user.employee_id:
-                    q3 += " AND e.supervisor_id = %s"
-                    params3.append(current_user.employee_id)
-            cur.execute(q3, tuple(params3))
-            total_salaries = cur.fetchone()[0] or 0
-
-            today = datetime.utcnow().date()
-            q4 = "SELECT COUNT(*) FROM attendance a JOIN employees e ON a.employee_id = e.id WHERE a.date = %s"
-            params4 = [today]
-            if current_user.role == 'supervisor':
-                if current_user.company_id:
-                    q4 += " AND e.company_id = %s"
-                    params4.append(current_user.company_id)
-                if current_user.employee_id:
-                    q4 += " AND e.supervisor_id = %s"
-                    params4.append(current_user.employee_id)
-            cur.execute(q4, tuple(params4))
-            today_attendance = cur.fetchone()[0]
-
-            work_plans_total = safe_count(cur, "SELECT COUNT(*) FROM work_plans")
-            work_plans_pending = safe_count(cur, "SELECT COUNT(*) FROM work_plans WHERE status='pending'")
-            work_plans_in_progress = safe_count(cur, "SELECT COUNT(*) FROM work_plans WHERE status='in_progress'")
-            work_plans_completed = safe_count(cur, "SELECT COUNT(*) FROM work_plans WHERE status='completed'")
-            wp_tasks_total = safe_count(cur, "SELECT COUNT(*) FROM work_plan_tasks")
-            wp_tasks_completed = safe_count(cur, "SELECT COUNT(*) FROM work_plan_tasks WHERE is_completed=true")
-
-        return jsonify({
-            'success': True,
-            'data': {
-                'total_employees': total_employees,
-                'active_employees': active_employees,
-                'total_companies': total_companies,
-                'total_salaries': float(total_salaries),
-                'today_attendance': today_attendance,
-                'pending_salaries': 0,
-                'work_plans_total': work_plans_total,
-                'work_plans_pending': work_plans_pending,
-                'work_plans_in_progress': work_plans_in_progress,
-                'work_plans_completed': work_plans_completed,
-                'work_plan_tasks_total': wp_tasks_total,
-                'work_plan_tasks_completed': wp_tasks_completed,
-                'active_contracts': 0,
-                'pending_transactions': 0,
-                'total_income': 0,
-                'total_expense': 0,
-                'top_employees': [],
-                'recent_attendance': [],
-                'recent_evaluations': [],
-                'recent_transactions': [],
-            }
-        })
+        scope = user_scope(current_user)
+        data = stats_cache.get(('reports_dashboard',) + scope, lambda: compute_reports_dashboard(*scope))
+        return jsonify({'success': True, 'data': data})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e), 'data': {
             'total_employees': 0, 'active_employees': 0, 'total_companies': 0,
@@ -116,6 +42,71 @@ def reports_dashboard(current_user):
         }})
 
 
+def compute_reports_dashboard(role, company_id, employee_id):
+    with get_db() as conn:
+        cur = conn.cursor()
+
+        emp_where = ""
+        params = []
+        if role == 'supervisor':
+            if company_id:
+                emp_where += " AND e.company_id = %s"
+                params.append(company_id)
+            if employee_id:
+                emp_where += " AND e.supervisor_id = %s"
+                params.append(employee_id)
+
+        today = datetime.utcnow().date()
+        cur.execute(f"""
+            SELECT COUNT(*),
+                   COUNT(*) FILTER (WHERE e.is_active = true),
+                   (SELECT COALESCE(SUM(s.total_salary), 0) FROM salaries s
+                    JOIN employees e ON s.employee_id = e.id WHERE 1=1{emp_where}),
+                   (SELECT COUNT(*) FROM attendance a
+                    JOIN employees e ON a.employee_id = e.id WHERE a.date = %s{emp_where})
+            FROM employees e WHERE 1=1{emp_where}""", tuple(params + params + [today] + params))
+        total_employees, active_employees, total_salaries, today_attendance = cur.fetchone()
+
+        total_companies = safe_count(cur, "SELECT COUNT(*) FROM clean_companies")
+
+        work_plans = safe_query(cur, """
+            SELECT COUNT(*),
+                   COUNT(*) FILTER (WHERE status = 'pending'),
+                   COUNT(*) FILTER (WHERE status = 'in_progress'),
+                   COUNT(*) FILTER (WHERE status = 'completed')
+            FROM work_plans""")
+        work_plans_total, work_plans_pending, work_plans_in_progress, work_plans_completed = (
+            work_plans[0] if work_plans else (0, 0, 0, 0))
+
+        wp_tasks = safe_query(cur, """
+            SELECT COUNT(*), COUNT(*) FILTER (WHERE is_completed = true)
+            FROM work_plan_tasks""")
+        wp_tasks_total, wp_tasks_completed = wp_tasks[0] if wp_tasks else (0, 0)
+
+    return {
+        'total_employees': total_employees,
+        'active_employees': active_employees,
+        'total_companies': total_companies,
+        'total_salaries': float(total_salaries or 0),
+        'today_attendance': today_attendance,
+        'pending_salaries': 0,
+        'work_plans_total': work_plans_total,
+        'work_plans_pending': work_plans_pending,
+        'work_plans_in_progress': work_plans_in_progress,
+        'work_plans_completed': work_plans_completed,
+        'work_plan_tasks_total': wp_tasks_total,
+        'work_plan_tasks_completed': wp_tasks_completed,
+        'active_contracts': 0,
+        'pending_transactions': 0,
+        'total_income': 0,
+        'total_expense': 0,
+        'top_employees': [],
+        'recent_attendance': [],
+        'recent_evaluations': [],
+        'recent_transactions': [],
+    }
+
+
 @reports_bp.route('/api/reports/employees', methods=['GET'])
 @token_required
 def reports_employees(current_user):
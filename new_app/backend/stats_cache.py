@@ -0,0 +1,94 @@
+import threading
+import time
+
+from flask import current_app, request
+
+
+class StatsCache:
+    """Short-lived cache for dashboard statistics.
+
+    Within `ttl` seconds the cached value is returned as is. Until `stale_ttl`
+    the stale value is still returned while a background thread recomputes
+    it; older entries are computed inline.
+
+    Kept in step with utils.StatsCache in the main app: new_app is deployed on
+    its own (own requirements, backend/ as the import root) and cannot import
+    the main app's utils, which pulls in its models and report dependencies.
+    """
+
+    def __init__(self, ttl=30, stale_ttl=300):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._entries = {}
+        self._refreshing = set()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, compute):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            age = now - entry[0] if entry else None
+            if entry and age < self.ttl:
+                return entry[1]
+            if entry and age < self.stale_ttl:
+                if key not in self._refreshing:
+                    self._refreshing.add(key)
+                    self._refresh_in_background(key, compute, self._generation)
+                return entry[1]
+            generation = self._generation
+
+        value = compute()
+        self._store(key, value, generation)
+        return value
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+
+    def _store(self, key, value, generation):
+        with self._lock:
+            self._refreshing.discard(key)
+            # A result computed before the last invalidation is already outdated
+            if generation == self._generation:
+                self._entries[key] = (time.monotonic(), value)
+
+    def _refresh_in_background(self, key, compute, generation):
+        app = current_app._get_current_object()
+
+        def run():
+            with app.app_context():
+                try:
+                    value = compute()
+                except Exception:
+                    app.logger.exception('Dashboard stats refresh failed: %s', key)
+                    with self._lock:
+                        self._refreshing.discard(key)
+                    return
+            self._store(key, value, generation)
+
+        threading.Thread(target=run, daemon=True).start()
+
+
+stats_cache = StatsCache()
+
+# Successful writes through these blueprints change dashboard counters
+INVALIDATING_BLUEPRINTS = {'attendance', 'financial', 'work_plans'}
+
+
+def register_stats_invalidation(app):
+    @app.after_request
+    def invalidate_stats_on_write(response):
+        if (request.method not in ('GET', 'HEAD', 'OPTIONS')
+                and request.blueprint in INVALIDATING_BLUEPRINTS
+                and response.status_code < 400):
+            stats_cache.invalidate()
+        return response
+
+
+def user_scope(current_user):
+    """Cache key part and filter values for the user's data scope."""
+    if current_user.role == 'supervisor':
+        return ('supervisor', current_user.company_id, current_user.employee_id)
+    return ('all', None, None)
@@ -16,8 +16,6 @@ from utils import (
     get_financial_month_dates,
     format_currency,
     get_regions,
-    get_employee_attendance_summary,
-    get_employee_overtime_hours,
     get_employee_daily_allowance,
     get_current_month_preparation,
     get_status_badge_class,
@@ -45,7 +43,21 @@ from utils import (
     create_salary_accrual,
     refresh_all_reports,
     calculate_worker_salary_breakdown,
-    print_salary_breakdown
+    print_salary_breakdown,
+    get_accounts_balances,
+    build_trial_balance,
+    build_income_statement,
+    build_balance_sheet,
+    invalidate_system_settings_cache,
+    get_account_by_code,
+    build_account_tree,
+    get_cash_flow_summary,
+    get_cash_flow_details,
+    list_journal_entries,
+    calculate_employees_salary_breakdowns,
+    get_period_transfer_employees,
+    build_period_transfer_details,
+    rebuild_period_transfer
 )
 
 from config import Config
@@ -55,7 +67,6 @@ Evaluation, Company, Contract, Invoice, Location, Region,
 EvaluationCriteria, AttendancePreparation,MealDeductionSetting,MealDeduction,
 AttendancePreparationDetail,
 AttendancePeriodTransfer,           # ✅ تأكد من وجودها
-AttendancePeriodTransferDetail,     # ✅ تأكد من وجودها
 AreaEvaluationCriteria,
 AreaEvaluation, Account, TrialBalance, FiscalYear,
 AccountBalance, JournalEntryDetail, JournalEntry,
@@ -102,8 +113,8 @@ def register_routes(app):
             salaries_data = []
             for i in range(6):
                 date = datetime.now() - timedelta(days=30 * i)
-                month_year = date.strftime('%m-%Y')
-                total = db.session.query(func.sum(Salary.total_salary)).filter_by(month_year=month_year).scalar() or 0
+                total = db.session.query(func.sum(Salary.total_salary)).filter(
+                    Salary.period_key_is(date.strftime('%m-%Y'))).scalar() or 0
                 salaries_data.append({'month': date.strftime('%b'), 'total': float(total)})
 
             # بيانات المناطق
@@ -875,24 +886,22 @@ def register_routes(app):
             flash('الرجاء اختيار شركة أو منطقة', 'danger')
             return redirect(url_for('attendance_list', date=date))
 
-        employees = query.all()
-        count = 0
-
-        for employee in employees:
-            existing = Attendance.query.filter_by(employee_id=employee.id, date=date).first()
-            if not existing:
-                attendance = Attendance(
-                    employee_id=employee.id,
-                    date=date,
-                    attendance_type='group',
-                    attendance_status=attendance_status,
-                    late_minutes=15 if attendance_status == 'late' else 0,
-                    sick_leave=attendance_status == 'sick',
-                    sick_leave_days=1 if attendance_status == 'sick' else 0,
-                    created_by=current_user.id
-                )
-                db.session.add(attendance)
-                count += 1
+        employee_ids = [row.id for row in query.with_entities(Employee.id)]
+
+        # الحضور الجماعي لا يغيّر السجلات المسجلة مسبقاً
+        results = Attendance.bulk_upsert(
+            date,
+            [{
+                'employee_id': employee_id,
+                'attendance_status': attendance_status,
+                'late_minutes': 15 if attendance_status == 'late' else 0,
+                'sick_leave': attendance_status == 'sick',
+                'sick_leave_days': 1 if attendance_status == 'sick' else 0,
+            } for employee_id in employee_ids],
+            insert_values={'attendance_type': 'group', 'created_by': current_user.id},
+            update_existing=False
+        )
+        count = sum(1 for r in results if r['result'] == 'created')
 
         db.session.commit()
         flash(f'تم تسجيل الحضور الجماعي لـ {count} موظف في {filter_name}', 'success')
@@ -926,23 +935,23 @@ def register_routes(app):
         """حفظ جميع حالات الحضور دفعة واحدة مع دعم الإجازات السنوية"""
         try:
             date = datetime.strptime(request.form.get('date'), '%Y-%m-%d').date()
-            employee_ids = request.form.getlist('employee_ids')
+            employee_ids = [int(emp_id) for emp_id in request.form.getlist('employee_ids') if emp_id]
+            employees = {
+                e.id: e for e in Employee.query.filter(Employee.id.in_(employee_ids))
+            } if employee_ids else {}
 
-            count = 0
+            records = []
+            absent_ids = []
             for emp_id in employee_ids:
                 status = request.form.get(f'status_{emp_id}')
-                employee = Employee.query.get(emp_id)
+                employee = employees.get(emp_id)
 
                 if not status or not employee:
                     continue
 
-                # التحقق من وجود تسجيل سابق
-                existing = Attendance.query.filter_by(employee_id=emp_id, date=date).first()
-
                 # معالجة حالة الغياب
                 if status == 'absent':
-                    if existing:
-                        db.session.delete(existing)
+                    absent_ids.append(emp_id)
                     continue
 
                 # معالجة الوقت
@@ -980,33 +989,17 @@ def register_routes(app):
                     annual_leave_days = int(
                         request.form.get(f'annual_leave_days_{emp_id}', 0)) if status == 'annual_leave' else 0
 
-                if existing:
-                    # تحديث التسجيل الموجود
-                    existing.attendance_status = status
-                    existing.late_minutes = late_minutes
-                    existing.sick_leave = status == 'sick'
-                    existing.sick_leave_days = sick_leave_days
-                    existing.annual_leave_days = annual_leave_days
-                    existing.check_in_time = check_in_time
-                    existing.check_out_time = check_out_time
-                    existing.notes = request.form.get(f'notes_{emp_id}', '')
-                else:
-                    # إنشاء تسجيل جديد
-                    attendance = Attendance(
-                        employee_id=emp_id,
-                        date=date,
-                        attendance_type='individual',
-                        attendance_status=status,
-                        late_minutes=late_minutes,
-                        sick_leave=status == 'sick',
-                        sick_leave_days=sick_leave_days,
-                        annual_leave_days=annual_leave_days,
-                        check_in_time=check_in_time,
-                        check_out_time=check_out_time,
-                        notes=request.form.get(f'notes_{emp_id}', ''),
-                        created_by=current_user.id
-                    )
-                    db.session.add(attendance)
+                records.append({
+                    'employee_id': emp_id,
+                    'attendance_status': status,
+                    'late_minutes': late_minutes,
+                    'sick_leave': status == 'sick',
+                    'sick_leave_days': sick_leave_days,
+                    'annual_leave_days': annual_leave_days,
+                    'check_in_time': check_in_time,
+                    'check_out_time': check_out_time,
+                    'notes': request.form.get(f'notes_{emp_id}', ''),
+                })
 
                 # طباعة معلومات التصحيح للإجازة المدفوعة
                 if status == 'annual_leave' and days_before > 0:
@@ -1015,7 +1008,18 @@ def register_routes(app):
                 elif status == 'annual_leave_unpaid':
                     print(f'📅 {employee.name}: إجازة سنوية بدون أجر {annual_leave_days} يوم')
 
-                count += 1
+            # الغياب يعني عدم وجود سجل حضور لليوم
+            if absent_ids:
+                Attendance.query.filter(
+                    Attendance.employee_id.in_(absent_ids),
+                    Attendance.date == date
+                ).delete(synchronize_session=False)
+
+            Attendance.bulk_upsert(
+                date, records,
+                insert_values={'attendance_type': 'individual', 'created_by': current_user.id}
+            )
+            count = len(records)
 
             db.session.commit()
             flash(f'تم تسجيل/تحديث حضور {count} موظف بنجاح', 'success')
@@ -1189,49 +1193,12 @@ def register_routes(app):
             return redirect(url_for('period_transfer_list'))
 
         try:
-            start_date = transfer.start_date
-            end_date = transfer.end_date
-
-            # حذف التفاصيل القديمة
-            for detail in transfer.transfers_details:
-                db.session.delete(detail)
-
-            # جلب الموظفين حسب الفلتر
-            query = Employee.query.filter_by(is_active=True)
-
-            if transfer.company_id:
-                query = query.filter_by(company_id=transfer.company_id)
-                filter_desc = f"شركة {transfer.company.name if transfer.company else ''}"
-            elif transfer.region:
-                query = query.filter_by(region=transfer.region)
-                filter_desc = f"منطقة {transfer.region}"
-            else:
-                query = query.filter(Employee.employee_type == 'worker')
-                filter_desc = "جميع العمال"
-
-            employees = query.all()
+            count = rebuild_period_transfer(transfer)
 
-            if not employees:
+            if count is None:
                 flash('لا يوجد موظفين في هذا الفلتر', 'warning')
                 return redirect(url_for('period_transfer_list'))
 
-            count = 0
-            for employee in employees:
-                attendance_summary = get_employee_attendance_summary(employee, start_date, end_date)
-                overtime_hours = get_employee_overtime_hours(employee, start_date, end_date)
-
-                detail = AttendancePeriodTransferDetail(
-                    transfer_id=transfer.id,
-                    employee_id=employee.id,
-                    attendance_days=attendance_summary['attendance_days'],
-                    absent_days=attendance_summary['absent_days'],
-                    sick_days=attendance_summary['sick_days'],
-                    late_minutes_total=attendance_summary['late_minutes_total'],
-                    overtime_hours=overtime_hours
-                )
-                db.session.add(detail)
-                count += 1
-
             db.session.commit()
 
             flash(f'✅ تم تحديث فترة "{transfer.period_name}" بنجاح - {count} موظف', 'success')
@@ -1333,50 +1300,27 @@ def register_routes(app):
             db.session.commit()
 
             # جلب الموظفين حسب الفلتر ونوع الراتب
-            query = Employee.query.filter_by(is_active=True)
-
-            if payroll_type == 'admin':
-                # إدارة: admin, supervisor
-                query = query.filter(Employee.employee_type.in_(['admin', 'supervisor']))
-            else:
-                # عمال: worker فقط
-                query = query.filter(Employee.employee_type == 'worker')
+            employees = get_period_transfer_employees(payroll_type, company_id, region)
 
             if company_id:
-                query = query.filter_by(company_id=company_id)
                 filter_desc = f"شركة {Company.query.get(company_id).name if company_id else ''}"
             elif region:
-                query = query.filter_by(region=region)
                 filter_desc = f"منطقة {region}"
             else:
                 filter_desc = "جميع الموظفين"
 
-            employees = query.all()
-
             if not employees:
                 flash('لا يوجد موظفين في هذا الفلتر', 'warning')
                 db.session.delete(transfer)
                 db.session.commit()
                 return redirect(url_for('create_period_transfer'))
 
-            count = 0
-            for employee in employees:
-                # استخراج إحصائيات الحضور من سجلات الحضور اليومية
-                attendance_summary = get_employee_attendance_summary(employee, start_date, end_date)
-                overtime_hours = get_employee_overtime_hours(employee, start_date, end_date)
-
-                detail = AttendancePeriodTransferDetail(
-                    transfer_id=transfer.id,
-                    employee_id=employee.id,
-                    attendance_days=attendance_summary['attendance_days'],
-                    absent_days=attendance_summary['absent_days'],
-                    sick_days=attendance_summary['sick_days'],
-                    late_minutes_total=attendance_summary['late_minutes_total'],
-                    overtime_hours=overtime_hours
-                )
-                db.session.add(detail)
-                count += 1
-
+            try:
+                count = len(build_period_transfer_details(transfer, employees))
+            except ValueError as e:
+                db.session.rollback()
+                flash(f'❌ {e}', 'danger')
+                return redirect(url_for('create_period_transfer'))
             db.session.commit()
 
             flash(f'✅ تم إنشاء ترحيل فترة الدوام لـ {count} موظف في {filter_desc} من {start_date} إلى {end_date}',
@@ -2297,8 +2241,8 @@ def register_routes(app):
             today_attendance = 0
 
         current_month = datetime.now().strftime('%m-%Y')
-        total_salaries_month = db.session.query(func.sum(Salary.total_salary)).filter_by(
-            month_year=current_month).scalar() or 0
+        total_salaries_month = db.session.query(func.sum(Salary.total_salary)).filter(
+            Salary.period_key_is(current_month)).scalar() or 0
 
         attendance_rate = round((today_attendance / total_employees * 100) if total_employees > 0 else 0)
 
@@ -2487,7 +2431,7 @@ def register_routes(app):
         # ========== 2. عرض جميع الرواتب مع Pagination ==========
         if month_year == 'all' or not month_year:
             # استخدام paginate بدلاً من all()
-            paginated_salaries = Salary.query.order_by(Salary.month_year.desc()).paginate(
+            paginated_salaries = Salary.query.order_by(*Salary.period_order(), Salary.id.desc()).paginate(
                 page=page, per_page=per_page, error_out=False
             )
             salaries = paginated_salaries.items
@@ -2540,16 +2484,9 @@ def register_routes(app):
         # ========== 3. عرض شهر محدد مع Pagination ==========
         elif month_year and month_year != 'all':
             try:
-                # البحث عن الرواتب بالتنسيقين
-                query = Salary.query.filter(Salary.month_year == month_year)
-
-                if query.count() == 0 and '-' in month_year:
-                    parts = month_year.split('-')
-                    if len(parts[0]) == 4:  # YYYY-MM
-                        alt_format = f"{parts[1]}-{parts[0]}"
-                    else:  # MM-YYYY
-                        alt_format = f"{parts[1]}-{parts[0]}"
-                    query = Salary.query.filter(Salary.month_year == alt_format)
+                # البحث عن الرواتب بالصيغة المعطاة أو البديلة (الأولى التي لها رواتب)
+                period_filter = Salary.period_key_is(Salary.stored_month_key(month_year))
+                query = Salary.query.filter(period_filter)
 
                 # استخدام paginate
                 paginated_salaries = query.order_by(Salary.employee_id).paginate(
@@ -2587,9 +2524,9 @@ def register_routes(app):
                     # إحصائيات الشهر
                     total_employees = query.count()
                     total_attendance_days = db.session.query(func.sum(Salary.attendance_days)).filter(
-                        Salary.month_year == month_year).scalar() or 0
+                        period_filter).scalar() or 0
                     total_salaries = db.session.query(func.sum(Salary.total_salary)).filter(
-                        Salary.month_year == month_year).scalar() or 0
+                        period_filter).scalar() or 0
                     paid_salaries = query.filter(Salary.is_paid == True).count()
 
                     report = {
@@ -2688,7 +2625,7 @@ def register_routes(app):
         if request.method == 'POST':
             month_year = request.form.get('month_year')
             start_date, end_date = get_financial_month_dates(month_year)
-            salaries = Salary.query.filter_by(month_year=month_year).all()
+            salaries = Salary.query.filter(Salary.period_key_is(month_year)).all()
 
             report = {
                 'month_year': month_year,
@@ -2719,32 +2656,44 @@ def register_routes(app):
             end_date = datetime(year, month + 1, 1).date() - timedelta(days=1)
 
         month_name = start_date.strftime('%B %Y')
-        # ==================== الرواتب (حل مرن) ====================
+        # ==================== الرواتب (أول صيغة لها رواتب) ====================
         month_year_formats = [
             start_date.strftime('%Y-%m'),  # 2026-04
             start_date.strftime('%m-%Y')  # 04-2026
         ]
+        month_filter = db.and_(Salary.period_is(year, month), Salary.month_year.in_(month_year_formats))
+
+        salaries_by_format = {}
+        for fmt, is_paid, total in db.session.query(
+            Salary.month_year, Salary.is_paid, func.sum(Salary.total_salary)
+        ).filter(month_filter).group_by(Salary.month_year, Salary.is_paid).all():
+            salaries_by_format.setdefault(fmt, {})[is_paid] = total or 0
 
         salaries_total = 0
         salaries_paid = 0
         salaries_unpaid = 0
 
         for fmt in month_year_formats:
-            salaries_paid = db.session.query(func.sum(Salary.total_salary)).filter(
-                Salary.month_year == fmt,
-                Salary.is_paid == True
-            ).scalar() or 0
-
-            salaries_unpaid = db.session.query(func.sum(Salary.total_salary)).filter(
-                Salary.month_year == fmt,
-                Salary.is_paid == False
-            ).scalar() or 0
-
+            salaries_paid = salaries_by_format.get(fmt, {}).get(True, 0)
+            salaries_unpaid = salaries_by_format.get(fmt, {}).get(False, 0)
             salaries_total = salaries_paid + salaries_unpaid
 
             if salaries_total > 0:
                 break
 
+        # الرواتب المدفوعة لكل شركة (لكل شركة أول صيغة لها رواتب)
+        company_rows = db.session.query(
+            Employee.company_id, Salary.month_year, func.sum(Salary.total_salary)
+        ).join(Employee, Employee.id == Salary.employee_id).filter(
+            month_filter,
+            Salary.is_paid == True
+        ).group_by(Employee.company_id, Salary.month_year).all()
+
+        paid_salaries_by_company = {}
+        for company_id, fmt, total in sorted(company_rows, key=lambda row: month_year_formats.index(row[1])):
+            if total and company_id not in paid_salaries_by_company:
+                paid_salaries_by_company[company_id] = total
+
         print(
             f"✅ Found salaries for {start_date.strftime('%Y-%m')}: Total={salaries_total}, Paid={salaries_paid}, Unpaid={salaries_unpaid}")
 
@@ -2851,17 +2800,7 @@ def register_routes(app):
             company_total_income = company_contracts_value + company_invoices
 
             # رواتب الشركة
-            company_salaries = 0
-
-            for fmt in month_year_formats:
-                value = db.session.query(func.sum(Salary.total_salary)).filter(
-                    Salary.month_year == fmt,
-                    Salary.is_paid == True
-                ).join(Employee).filter(Employee.company_id == company.id).scalar() or 0
-
-                if value > 0:
-                    company_salaries = value
-                    break
+            company_salaries = paid_salaries_by_company.get(company.id) or 0
 
             # سلف الشركة
             company_advances = db.session.query(func.sum(FinancialTransaction.amount)).filter(
@@ -3270,11 +3209,11 @@ def register_routes(app):
         month_year = request.args.get('month_year')
 
         if month_year and month_year != 'all':
-            salaries = Salary.query.filter_by(month_year=month_year).all()
+            salaries = Salary.query.filter(Salary.period_key_is(month_year)).all()
             start_date, end_date = get_financial_month_dates(month_year)
             report_title = f'تقرير الرواتب - {month_year}'
         else:
-            salaries = Salary.query.order_by(Salary.month_year.desc()).all()
+            salaries = Salary.query.order_by(*Salary.period_order()).all()
             start_date = None
             end_date = None
             report_title = 'تقرير الرواتب - جميع الأشهر'
@@ -3333,7 +3272,7 @@ def register_routes(app):
 
         # فلترة حسب الفترة
         if period_key:
-            query = query.filter(Salary.month_year == period_key)
+            query = query.filter(Salary.period_key_is(period_key))
 
         # فلترة حسب الحالة
         if status_filter == 'paid':
@@ -3360,7 +3299,7 @@ def register_routes(app):
                 query = query.filter(False)
 
         # Pagination
-        paginated_salaries = query.order_by(Salary.month_year.desc()).paginate(
+        paginated_salaries = query.order_by(*Salary.period_order(), Salary.id.desc()).paginate(
             page=page, per_page=per_page, error_out=False
         )
         all_salaries = paginated_salaries.items
@@ -3406,7 +3345,7 @@ def register_routes(app):
         # إحصائيات سريعة
         stats_query = db.session.query(Salary)
         if period_key:
-            stats_query = stats_query.filter(Salary.month_year == period_key)
+            stats_query = stats_query.filter(Salary.period_key_is(period_key))
         if company_id:
             stats_query = stats_query.join(Salary.employee).filter(Employee.company_id == company_id)
 
@@ -3509,9 +3448,25 @@ def register_routes(app):
                 total_salaries = 0
                 failed_employees = []
 
-                for detail in transfer.transfers_details:
+                # توزيع رواتب جميع موظفي الترحيل دفعة واحدة (حساب جماعي)
+                details = transfer.transfers_details
+                employees_by_id = {
+                    e.id: e for e in Employee.query.filter(
+                        Employee.id.in_({d.employee_id for d in details})
+                    ).all()
+                }
+                batch = [(d, employees_by_id[d.employee_id]) for d in details if d.employee_id in employees_by_id]
+                breakdowns = dict(zip(
+                    [d.id for d, _ in batch],
+                    calculate_employees_salary_breakdowns(
+                        [employee for _, employee in batch],
+                        [max(0, min(d.attendance_days, 31)) for d, _ in batch],
+                    )
+                ))
+
+                for detail in details:
                     try:
-                        employee = db.session.get(Employee, detail.employee_id)
+                        employee = employees_by_id.get(detail.employee_id)
 
                         if not employee:
                             print(f"⚠️ موظف غير موجود للمعرف {detail.employee_id}")
@@ -3524,13 +3479,8 @@ def register_routes(app):
                         attendance_days = max(0, min(detail.attendance_days, 31))
                         period_key = f"{start_date.strftime('%Y%m%d')}_{end_date.strftime('%Y%m%d')}"
 
-                        # ✅ حساب الراتب باستخدام الدالة المبسطة
-                        breakdown = employee.calculate_salary_breakdown(
-                            attendance_days=attendance_days,
-                            paid_leave_days=0,
-                            start_date=start_date,
-                            end_date=end_date
-                        )
+                        # ✅ توزيع الراتب (محسوب مسبقاً لجميع الموظفين)
+                        breakdown = breakdowns[detail.id]
 
                         # ✅ التحقق من صحة الحساب
                         if breakdown.get('cash_payout', 0) <= 0 and attendance_days > 0:
@@ -3649,8 +3599,8 @@ def register_routes(app):
 
         # ========== 2. عرض نموذج الصرف (GET) ==========
         if request.method == 'GET':
-            cash = Account.query.filter_by(code='110001').first()
-            bank = Account.query.filter_by(code='110002').first()
+            cash = get_account_by_code('110001')
+            bank = get_account_by_code('110002')
             cash_balance = cash.get_balance() if cash else 0
             bank_balance = bank.get_balance() if bank else 0
 
@@ -3676,7 +3626,7 @@ def register_routes(app):
             notes = request.form.get('notes', '')
 
             # البحث عن الحسابات
-            salaries_payable = Account.query.filter_by(code='210001').first()
+            salaries_payable = get_account_by_code('210001')
             if not salaries_payable:
                 salaries_payable = Account(
                     code='210001',
@@ -3692,7 +3642,7 @@ def register_routes(app):
 
             # تحديد حساب الدفع
             if payment_method == 'bank_transfer':
-                payment_account = Account.query.filter_by(code='110002').first()
+                payment_account = get_account_by_code('110002')
                 if not payment_account:
                     payment_account = Account(
                         code='110002',
@@ -3712,7 +3662,7 @@ def register_routes(app):
                     flash(f'⚠️ رصيد البنك غير كافٍ! المتوفر: {current_balance:,.2f} ريال', 'danger')
                     return redirect(url_for('pay_salary', salary_id=salary_id))
             else:
-                payment_account = Account.query.filter_by(code='110001').first()
+                payment_account = get_account_by_code('110001')
                 if not payment_account:
                     payment_account = Account(
                         code='110001',
@@ -4438,7 +4388,7 @@ def register_routes(app):
         total_salaries = Salary.query.filter_by(is_paid=False).count()
 
         recent_transactions = FinancialTransaction.query.order_by(FinancialTransaction.date.desc()).limit(10).all()
-        recent_salaries = Salary.query.order_by(Salary.month_year.desc()).limit(10).all()
+        recent_salaries = Salary.query.order_by(*Salary.period_order(), Salary.id.desc()).limit(10).all()
 
         return render_template('financial/dashboard.html',
                                total_advances=total_advances,
@@ -4804,32 +4754,19 @@ def register_routes(app):
         """عرض دليل الحسابات"""
         from sqlalchemy import func
 
-        # جلب جميع الحسابات النشطة
-        accounts = Account.query.filter_by(is_active=True).order_by(Account.code).all()
+        # أرصدة جميع الحسابات باستعلام واحد، والشجرة من فهرس دليل الحسابات
+        balances = {row['id']: row['balance'] for row in get_accounts_balances(active_only=True)}
+        account_tree = build_account_tree(balances, active_only=True)
 
-        # ✅ دالة لفلترة الحسابات (تسطيح الهيكل الشجري)
+        # ✅ تسطيح جميع الحسابات للحصول على الإحصائيات الصحيحة
         def flatten_accounts(account_list):
             """تسطيح قائمة الحسابات (بما فيها الحسابات الفرعية)"""
             result = []
             for acc in account_list:
                 result.append(acc)
-                if hasattr(acc, 'children') and acc.children:
-                    result.extend(flatten_accounts(acc.children))
+                result.extend(flatten_accounts(acc.children))
             return result
 
-        # بناء هيكل شجري
-        def build_tree(parent_id=None, level=0):
-            tree = []
-            for acc in accounts:
-                if acc.parent_id == parent_id:
-                    acc.level = level
-                    acc.children = build_tree(acc.id, level + 1)
-                    tree.append(acc)
-            return tree
-
-        account_tree = build_tree()
-
-        # ✅ تسطيح جميع الحسابات للحصول على الإحصائيات الصحيحة
         all_accounts = flatten_accounts(account_tree)
 
         # ✅ حساب الإحصائيات الأساسية
@@ -4841,7 +4778,7 @@ def register_routes(app):
         total_revenue = 0
 
         for acc in all_accounts:
-            balance = acc.get_balance()
+            balance = acc.balance
 
             # حساب حسابات العملاء (تلك التي تبدأ بـ 1201)
             if acc.code and acc.code.startswith('1201'):
@@ -4873,7 +4810,7 @@ def register_routes(app):
             # محاولة الحصول على حساب العميل
             account = company.get_or_create_receivable_account()
             if account and account.is_active:
-                balance = account.get_balance()
+                balance = balances.get(account.id, 0)
                 companies_with_accounts.append({
                     'company': company,
                     'account': account,
@@ -4888,7 +4825,7 @@ def register_routes(app):
                 Account.is_active == True
             ).all()
             for acc in customer_sub_accounts:
-                balance = acc.get_balance()
+                balance = balances.get(acc.id, 0)
                 # محاولة العثور على الشركة المرتبطة
                 company = Company.query.filter_by(receivable_account_id=acc.id).first()
                 if not company:
@@ -4916,7 +4853,7 @@ def register_routes(app):
             # محاولة الحصول على حساب المورد
             account = supplier.get_or_create_payable_account()
             if account and account.is_active:
-                balance = account.get_balance()
+                balance = balances.get(account.id, 0)
                 suppliers_with_accounts.append({
                     'supplier': supplier,
                     'account': account,
@@ -4931,7 +4868,7 @@ def register_routes(app):
                 Account.is_active == True
             ).all()
             for acc in supplier_sub_accounts:
-                balance = acc.get_balance()
+                balance = balances.get(acc.id, 0)
                 # محاولة العثور على المورد المرتبط
                 supplier = Supplier.query.filter_by(payable_account_id=acc.id).first()
                 if not supplier:
@@ -5128,25 +5065,23 @@ def register_routes(app):
         start_date = request.args.get('start_date')
         end_date = request.args.get('end_date')
 
-        query = JournalEntry.query
-
-        if start_date:
-            query = query.filter(JournalEntry.date >= datetime.strptime(start_date, '%Y-%m-%d').date())
-        if end_date:
-            query = query.filter(JournalEntry.date <= datetime.strptime(end_date, '%Y-%m-%d').date())
-
-        entries = query.order_by(JournalEntry.date.desc(), JournalEntry.entry_number.desc()).all()
-
-        # التحقق من وجود قيود عكسية لكل قيد
-        for entry in entries:
-            entry.has_reverse = JournalEntry.query.filter(
-                JournalEntry.reference_type == 'reverse',
-                JournalEntry.reference_id == entry.id
-            ).first() is not None
-
-        # ✅ حساب الإجماليات في الباكند
-        total_debit = sum(entry.get_total_debit() for entry in entries)
-        total_credit = sum(entry.get_total_credit() for entry in entries)
+        # القيود مع تفاصيلها وإجمالياتها (محسوبة في SQL) وحالة العكس - صفحة واحدة
+        try:
+            listing = list_journal_entries(
+                date_from=datetime.strptime(start_date, '%Y-%m-%d').date() if start_date else None,
+                date_to=datetime.strptime(end_date, '%Y-%m-%d').date() if end_date else None,
+                account_id=request.args.get('account_id', type=int),
+                reference_type=request.args.get('reference_type') or None,
+                search=request.args.get('search', '').strip() or None,
+                limit=min(request.args.get('limit', 200, type=int), 1000),
+                cursor=request.args.get('cursor') or None,
+            )
+        except ValueError:
+            flash('تاريخ أو مؤشر صفحة غير صحيح', 'danger')
+            return redirect(url_for('journal_entries_list'))
+        entries = listing['entries']
+        total_debit = listing['total_debit']
+        total_credit = listing['total_credit']
 
         # جلب الحسابات لإضافة قيد جديد
         accounts = Account.query.filter_by(is_active=True).order_by(Account.code).all()
@@ -5156,6 +5091,8 @@ def register_routes(app):
                                accounts=accounts,
                                total_debit=total_debit,
                                total_credit=total_credit,
+                               entries_count=listing['count'],
+                               next_cursor=listing['next_cursor'],
                                start_date=start_date,
                                end_date=end_date)
 
@@ -5419,7 +5356,7 @@ def register_routes(app):
         from utils import create_journal_entry, get_next_entry_number
 
         # التأكد من وجود حساب الصندوق
-        cash_account = Account.query.filter_by(code='110001').first()
+        cash_account = get_account_by_code('110001')
         if not cash_account:
             cash_account = Account(
                 code='110001', name='Cash', name_ar='الصندوق',
@@ -5446,9 +5383,9 @@ def register_routes(app):
                 if transaction_type == 'deposit':
                     # إيداع: زيادة الصندوق
                     # الحصول على حساب رأس المال أو الأرباح المحتجزة
-                    equity_account = Account.query.filter_by(code='310001').first()
+                    equity_account = get_account_by_code('310001')
                     if not equity_account:
-                        equity_account = Account.query.filter_by(code='320001').first()
+                        equity_account = get_account_by_code('320001')
 
                     if not equity_account:
                         equity_account = Account(
@@ -5473,7 +5410,7 @@ def register_routes(app):
                         return redirect(url_for('settle_cash'))
 
                     # الحصول على حساب المصروفات
-                    expense_account = Account.query.filter_by(code='530005').first()
+                    expense_account = get_account_by_code('530005')
                     if not expense_account:
                         expense_account = Account(
                             code='530005', name='General Expense', name_ar='مصروفات عامة',
@@ -5518,7 +5455,7 @@ def register_routes(app):
 
     def get_equity_account():
         """الحصول على حساب حقوق الملكية (رأس المال أو الأرباح المحتجزة)"""
-        equity = Account.query.filter_by(code='310001').first()
+        equity = get_account_by_code('310001')
         if not equity:
             equity = Account(
                 code='310001', name='Capital', name_ar='رأس المال',
@@ -5530,7 +5467,7 @@ def register_routes(app):
 
     def get_expense_account():
         """الحصول على حساب المصروفات العامة"""
-        expense = Account.query.filter_by(code='530005').first()
+        expense = get_account_by_code('530005')
         if not expense:
             expense = Account(
                 code='530005', name='General Expense', name_ar='مصروفات عامة',
@@ -5552,32 +5489,17 @@ def register_routes(app):
         else:
             as_of_date = datetime.strptime(as_of_date, '%Y-%m-%d').date()
 
-        accounts = Account.query.filter_by(is_active=True).order_by(Account.code).all()
-
-        trial_balance_data = []
-        total_debit = 0
-        total_credit = 0
+        tb = build_trial_balance(get_accounts_balances(as_of_date=as_of_date))
 
-        for account in accounts:
-            balance = account.get_balance(as_of_date)
-
-            if account.nature == 'debit':
-                debit = balance if balance > 0 else 0
-                credit = abs(balance) if balance < 0 else 0
-            else:
-                credit = balance if balance > 0 else 0
-                debit = abs(balance) if balance < 0 else 0
-
-            total_debit += debit
-            total_credit += credit
-
-            trial_balance_data.append({
-                'account': account,
-                'opening_balance': account.opening_balance,
-                'debit': debit,
-                'credit': credit,
-                'balance': balance
-            })
+        trial_balance_data = [{
+            'account': line['account'],
+            'opening_balance': line['opening_balance'],
+            'debit': line['debit'],
+            'credit': line['credit'],
+            'balance': line['balance']
+        } for line in tb['lines']]
+        total_debit = tb['total_debit']
+        total_credit = tb['total_credit']
 
         return render_template('accounts/trial_balance.html',
                                trial_balance=trial_balance_data,
@@ -5607,25 +5529,13 @@ def register_routes(app):
             start_date = datetime(today.year, today.month, 1).date()
             end_date = today
 
-        revenues = Account.query.filter_by(account_type='revenue', is_active=True).all()
-        expenses = Account.query.filter_by(account_type='expense', is_active=True).all()
+        statement = build_income_statement(get_accounts_balances(start_date=start_date, end_date=end_date))
 
-        revenue_data = []
-        expense_data = []
-        total_revenue = 0
-        total_expense = 0
-
-        for acc in revenues:
-            balance = acc.get_balance(end_date)
-            revenue_data.append({'account': acc, 'balance': balance})
-            total_revenue += balance
-
-        for acc in expenses:
-            balance = acc.get_balance(end_date)
-            expense_data.append({'account': acc, 'balance': balance})
-            total_expense += balance
-
-        net_income = total_revenue - total_expense
+        revenue_data = [{'account': row['account'], 'balance': row['balance']} for row in statement['revenue']]
+        expense_data = [{'account': row['account'], 'balance': row['balance']} for row in statement['expense']]
+        total_revenue = statement['total_revenue']
+        total_expense = statement['total_expense']
+        net_income = statement['net_income']
 
         return render_template('accounts/income_statement.html',
                                revenue_data=revenue_data,
@@ -5650,39 +5560,18 @@ def register_routes(app):
         else:
             as_of_date = datetime.strptime(as_of_date, '%Y-%m-%d').date()
 
-        # الحصول على الحسابات
-        assets = Account.query.filter_by(account_type='asset', is_active=True).all()
-        liabilities = Account.query.filter_by(account_type='liability', is_active=True).all()
-        equity = Account.query.filter_by(account_type='equity', is_active=True).all()
+        # أرصدة جميع الحسابات في استعلام واحد
+        sheet = build_balance_sheet(get_accounts_balances(as_of_date=as_of_date))
 
-        # حساب الأرصدة (بدون إضافة الرواتب المصروفة)
-        asset_data = []
-        liability_data = []
-        equity_data = []
+        asset_data = [{'account': row['account'], 'balance': row['balance']} for row in sheet['assets']]
+        # الخصوم (الحسابات الحقيقية فقط) - تخطي الحسابات الخاصة بالرواتب المصروفة إذا وجدت
+        liability_data = [{'account': row['account'], 'balance': row['balance']}
+                          for row in sheet['liabilities'] if 'الرواتب المصروفة' not in row['account'].name_ar]
+        equity_data = [{'account': row['account'], 'balance': row['balance']} for row in sheet['equity']]
 
-        total_assets = 0
-        total_liabilities = 0
-        total_equity = 0
-
-        # الأصول
-        for acc in assets:
-            balance = acc.get_balance(as_of_date)
-            asset_data.append({'account': acc, 'balance': balance})
-            total_assets += balance
-
-        # الخصوم (الحسابات الحقيقية فقط)
-        for acc in liabilities:
-            balance = acc.get_balance(as_of_date)
-            # تخطي الحسابات الخاصة بالرواتب المصروفة إذا وجدت
-            if 'الرواتب المصروفة' not in acc.name_ar:
-                liability_data.append({'account': acc, 'balance': balance})
-                total_liabilities += balance
-
-        # حقوق الملكية
-        for acc in equity:
-            balance = acc.get_balance(as_of_date)
-            equity_data.append({'account': acc, 'balance': balance})
-            total_equity += balance
+        total_assets = sheet['total_assets']
+        total_liabilities = sum(item['balance'] for item in liability_data)
+        total_equity = sheet['total_equity']
 
         # حساب الفرق والتوازن
         difference = total_assets - (total_liabilities + total_equity)
@@ -5703,8 +5592,7 @@ def register_routes(app):
             is_closed = reopen_entry is None
 
         # حساب إجمالي المصروفات للعرض
-        expense_accounts = Account.query.filter_by(account_type='expense', is_active=True).all()
-        total_expenses = sum(e.get_balance(as_of_date) for e in expense_accounts)
+        total_expenses = sheet['total_expense']
 
         return render_template('accounts/balance_sheet.html',
                                asset_data=asset_data,
@@ -5897,33 +5785,8 @@ def register_routes(app):
 
     def generate_supplier_invoice_number():
         """توليد رقم فاتورة مورد تلقائي"""
-        from datetime import datetime
-
-        # الحصول على آخر رقم فاتورة
-        last_invoice = SupplierInvoice.query.order_by(SupplierInvoice.id.desc()).first()
-
-        if last_invoice and last_invoice.invoice_number:
-            # استخراج الرقم من التنسيق SI-YYYYMMDD-XXX
-            try:
-                parts = last_invoice.invoice_number.split('-')
-                if len(parts) >= 3:
-                    last_num = int(parts[2])
-                    new_num = last_num + 1
-                else:
-                    new_num = 1
-            except (ValueError, IndexError):
-                new_num = 1
-        else:
-            new_num = 1
-
-        # تنسيق التاريخ
-        today = datetime.now()
-        date_str = today.strftime('%Y%m%d')
-
-        # تنسيق الرقم: SI-YYYYMMDD-XXX
-        invoice_number = f"SI-{date_str}-{str(new_num).zfill(3)}"
-
-        return invoice_number
+        from utils import next_document_number
+        return next_document_number('SI')
 
     @app.route('/suppliers')
     @login_required
@@ -6077,15 +5940,15 @@ def register_routes(app):
                 db.session.flush()
 
                 # حساب المصاريف حسب الفئة
-                expense_account = Account.query.filter_by(code='530005').first()
+                expense_account = get_account_by_code('530005')
 
                 if category_id:
                     category = ExpenseCategory.query.get(category_id)
                     if category and category.account_code:
-                        expense_account = Account.query.filter_by(code=category.account_code).first()
+                        expense_account = get_account_by_code(category.account_code)
 
                 if not expense_account:
-                    expense_account = Account.query.filter_by(code='530005').first()
+                    expense_account = get_account_by_code('530005')
                     if not expense_account:
                         expense_account = Account(
                             code='530005',
@@ -6249,10 +6112,10 @@ def register_routes(app):
             # ========== التحقق من الرصيد الموجب ==========
             # تحديد حساب الدفع
             if payment_method == 'bank_transfer':
-                payment_account = Account.query.filter_by(code='110002').first()
+                payment_account = get_account_by_code('110002')
                 account_name = "البنك"
             else:
-                payment_account = Account.query.filter_by(code='110001').first()
+                payment_account = get_account_by_code('110001')
                 account_name = "الصندوق"
 
             if not payment_account:
@@ -6562,7 +6425,7 @@ def register_routes(app):
                 flash('⚠️ المبلغ يجب أن يكون أكبر من صفر', 'danger')
                 return redirect(url_for('chart_of_accounts'))
 
-            customers = Account.query.filter_by(code='120001').first()
+            customers = get_account_by_code('120001')
             current_balance = customers.get_balance()
 
             if amount > current_balance:
@@ -6570,10 +6433,10 @@ def register_routes(app):
                 return redirect(url_for('chart_of_accounts'))
 
             if payment_method == 'bank':
-                target_account = Account.query.filter_by(code='110002').first()
+                target_account = get_account_by_code('110002')
                 method_name = 'البنك'
             else:
-                target_account = Account.query.filter_by(code='110001').first()
+                target_account = get_account_by_code('110001')
                 method_name = 'الصندوق'
 
             if not target_account:
@@ -6746,10 +6609,12 @@ def register_routes(app):
             'details': results
         }
 
-    def create_worker_salary_journal_entry(company_id, month_year, cost_summary):
+    def create_worker_salary_journal_entry(company_id, month_year, cost_summary, entry_date=None):
         """
         إنشاء قيد محاسبي لرواتب وتكاليف العمال
 
+        entry_date: تاريخ القيد (نهاية فترة الترحيل - يحدد period_key لفحص التكرار)، افتراضياً اليوم
+
         القيد يتكون من:
         مدين:
             - مصروف رواتب العمال الأساسية (511001)
@@ -6770,15 +6635,15 @@ def register_routes(app):
         summary = cost_summary['summary']
 
         # البحث عن الحسابات
-        basic_salary_expense = Account.query.filter_by(code='511001').first()
-        resident_allowance_expense = Account.query.filter_by(code='511002').first()
-        insurance_expense = Account.query.filter_by(code='511003').first()
-        clothing_expense = Account.query.filter_by(code='511004').first()
-        health_expense = Account.query.filter_by(code='511005').first()
+        basic_salary_expense = get_account_by_code('511001')
+        resident_allowance_expense = get_account_by_code('511002')
+        insurance_expense = get_account_by_code('511003')
+        clothing_expense = get_account_by_code('511004')
+        health_expense = get_account_by_code('511005')
 
-        salaries_payable = Account.query.filter_by(code='211001').first()
-        allowances_payable = Account.query.filter_by(code='211002').first()
-        insurance_payable = Account.query.filter_by(code='211003').first()
+        salaries_payable = get_account_by_code('211001')
+        allowances_payable = get_account_by_code('211002')
+        insurance_payable = get_account_by_code('211003')
 
         # التأكد من وجود الحسابات - إنشاؤها إذا لم تكن موجودة
         from models import create_labor_accounts
@@ -6786,24 +6651,24 @@ def register_routes(app):
                     clothing_expense, health_expense, salaries_payable, allowances_payable, insurance_payable]):
             create_labor_accounts()
             # إعادة المحاولة
-            basic_salary_expense = Account.query.filter_by(code='511001').first()
-            resident_allowance_expense = Account.query.filter_by(code='511002').first()
-            insurance_expense = Account.query.filter_by(code='511003').first()
-            clothing_expense = Account.query.filter_by(code='511004').first()
-            health_expense = Account.query.filter_by(code='511005').first()
-            salaries_payable = Account.query.filter_by(code='211001').first()
-            allowances_payable = Account.query.filter_by(code='211002').first()
-            insurance_payable = Account.query.filter_by(code='211003').first()
+            basic_salary_expense = get_account_by_code('511001')
+            resident_allowance_expense = get_account_by_code('511002')
+            insurance_expense = get_account_by_code('511003')
+            clothing_expense = get_account_by_code('511004')
+            health_expense = get_account_by_code('511005')
+            salaries_payable = get_account_by_code('211001')
+            allowances_payable = get_account_by_code('211002')
+            insurance_payable = get_account_by_code('211003')
 
         entry_number = get_next_entry_number()
 
         # إنشاء القيد المحاسبي
         journal_entry = JournalEntry(
             entry_number=entry_number,
-            date=datetime.now().date(),
+            date=entry_date or datetime.now().date(),
             description=f'رواتب وتكاليف العمال عن شهر {month_year} - شركة رقم {company_id}',
             reference_type='worker_salaries',
-            reference_id=None,
+            reference_id=company_id,
             created_by=current_user.id
         )
         db.session.add(journal_entry)
@@ -6936,10 +6801,21 @@ def register_routes(app):
                     month_year=transfer.period_name
                 )
 
-            # التحقق من وجود قيد مسبق
+            # التحقق من وجود قيد مسبق: الشركة (reference_id) وشهر نهاية الفترة (period_key)
+            # القيود القديمة بدون مرجع (مؤرخة بيوم إنشائها) تُطابق بوصفها الكامل
             existing = JournalEntry.query.filter(
                 JournalEntry.reference_type == 'worker_salaries',
-                JournalEntry.description.like(f'%{transfer.period_name}%')
+                db.or_(
+                    db.and_(
+                        JournalEntry.reference_id == transfer.company_id,
+                        JournalEntry.period_key == JournalEntry.period_key_for(transfer.end_date)
+                    ),
+                    db.and_(
+                        JournalEntry.reference_id.is_(None),
+                        JournalEntry.description ==
+                        f'رواتب وتكاليف العمال عن شهر {transfer.period_name} - شركة رقم {transfer.company_id}'
+                    )
+                )
             ).first()
 
             if existing:
@@ -6950,7 +6826,8 @@ def register_routes(app):
             journal_entry = create_worker_salary_journal_entry(
                 company_id=transfer.company_id,
                 month_year=transfer.period_name,
-                cost_summary=result
+                cost_summary=result,
+                entry_date=transfer.end_date
             )
 
             flash(f'✅ تم إنشاء القيد المحاسبي لتكاليف العمال', 'success')
@@ -7069,19 +6946,19 @@ def register_routes(app):
                 return redirect(url_for('contractor_annual_costs', year=year))
 
             # البحث عن الحسابات
-            tax_expense = Account.query.filter_by(code='521001').first()
-            zakat_expense = Account.query.filter_by(code='521002').first()
-            tax_payable = Account.query.filter_by(code='221001').first()
-            zakat_payable = Account.query.filter_by(code='221002').first()
+            tax_expense = get_account_by_code('521001')
+            zakat_expense = get_account_by_code('521002')
+            tax_payable = get_account_by_code('221001')
+            zakat_payable = get_account_by_code('221002')
 
             # إنشاء الحسابات إذا لم تكن موجودة
             from models import create_labor_accounts
             if not all([tax_expense, zakat_expense, tax_payable, zakat_payable]):
                 create_labor_accounts()
-                tax_expense = Account.query.filter_by(code='521001').first()
-                zakat_expense = Account.query.filter_by(code='521002').first()
-                tax_payable = Account.query.filter_by(code='221001').first()
-                zakat_payable = Account.query.filter_by(code='221002').first()
+                tax_expense = get_account_by_code('521001')
+                zakat_expense = get_account_by_code('521002')
+                tax_payable = get_account_by_code('221001')
+                zakat_payable = get_account_by_code('221002')
 
             entry_number = get_next_entry_number()
 
@@ -7196,7 +7073,7 @@ def register_routes(app):
             # إذا كانت الفترة تم ترحيلها إلى الرواتب، نحذف الرواتب المرتبطة
             if transfer.is_transferred:
                 period_key = f"{transfer.start_date.strftime('%Y%m%d')}_{transfer.end_date.strftime('%Y%m%d')}"
-                salaries = Salary.query.filter_by(month_year=period_key).all()
+                salaries = Salary.query.filter(Salary.period_key_is(period_key)).all()
 
                 for salary in salaries:
                     # حذف القيد المحاسبي للصرف إذا وجد
@@ -7242,51 +7119,19 @@ def register_routes(app):
             return jsonify({'success': False, 'error': 'لا يمكن تحديث فترة تم ترحيلها بالفعل'}), 400
 
         try:
-            start_date = transfer.start_date
-            end_date = transfer.end_date
-
-            # حذف التفاصيل القديمة
-            for detail in transfer.transfers_details:
-                db.session.delete(detail)
-            db.session.flush()
+            count = rebuild_period_transfer(transfer)
 
-            # جلب الموظفين حسب الفلتر
-            query = Employee.query.filter_by(is_active=True)
-
-            if transfer.company_id:
-                query = query.filter_by(company_id=transfer.company_id)
-            elif transfer.region:
-                query = query.filter_by(region=transfer.region)
-            else:
-                query = query.filter(Employee.employee_type == 'worker')
-
-            employees = query.all()
-
-            if not employees:
+            if count is None:
                 db.session.rollback()
                 return jsonify({'success': False, 'error': 'لا يوجد موظفين في هذا الفلتر'}), 400
 
-            count = 0
-            for employee in employees:
-                attendance_summary = get_employee_attendance_summary(employee, start_date, end_date)
-                overtime_hours = get_employee_overtime_hours(employee, start_date, end_date)
-
-                detail = AttendancePeriodTransferDetail(
-                    transfer_id=transfer.id,
-                    employee_id=employee.id,
-                    attendance_days=attendance_summary['attendance_days'],
-                    absent_days=attendance_summary['absent_days'],
-                    sick_days=attendance_summary['sick_days'],
-                    late_minutes_total=attendance_summary['late_minutes_total'],
-                    overtime_hours=overtime_hours
-                )
-                db.session.add(detail)
-                count += 1
-
             db.session.commit()
 
             return jsonify({'success': True, 'message': f'تم تحديث {count} موظف بنجاح'})
 
+        except ValueError as e:
+            db.session.rollback()
+            return jsonify({'success': False, 'error': str(e)}), 400
         except Exception as e:
             db.session.rollback()
             return jsonify({'success': False, 'error': str(e)}), 500
@@ -7338,14 +7183,14 @@ def register_routes(app):
 
                 # البحث عن الرواتب بهذا المفتاح
                 salaries = Salary.query.filter(
-                    Salary.month_year == period_key
+                    Salary.period_key_is(period_key)
                 ).all()
 
                 # البحث عن الرواتب بصيغة MM-YYYY (للحالات القديمة)
                 if not salaries:
                     alt_key = transfer.start_date.strftime('%m-%Y')
                     salaries = Salary.query.filter(
-                        Salary.month_year == alt_key
+                        Salary.period_key_is(alt_key)
                     ).all()
 
                 for salary in salaries:
@@ -7510,6 +7355,7 @@ def register_routes(app):
                         print(f"   ⚠️ المفتاح {account_key} غير موجود في البيانات!")
 
             db.session.commit()
+            invalidate_system_settings_cache()
             flash('✅ تم تحديث إعدادات النظام بنجاح', 'success')
 
         except Exception as e:
@@ -7620,52 +7466,41 @@ def register_routes(app):
             start_date = datetime(today.year, today.month, 1).date()
             end_date = today
 
-        # التدفقات النقدية الداخلة
-        cash_inflows = []
-
-        # الإيرادات من العقود (المدفوعات)
-        contract_payments = JournalEntryDetail.query.join(JournalEntry).filter(
-            JournalEntry.date >= start_date,
-            JournalEntry.date <= end_date,
-            JournalEntryDetail.credit > 0
-        ).join(Account).filter(Account.account_type == 'revenue').all()
-
-        total_inflows = sum(p.credit for p in contract_payments)
-
-        # التدفقات النقدية الخارجة
-        cash_outflows = []
-
-        # الرواتب المصروفة
-        salaries_paid = Salary.query.filter(
-            Salary.paid_date >= start_date,
-            Salary.paid_date <= end_date,
-            Salary.is_paid == True
-        ).all()
-        total_salaries = sum(s.total_salary for s in salaries_paid)
-
-        # فواتير الموردين المدفوعة
-        supplier_payments = SupplierInvoicePayment.query.filter(
-            SupplierInvoicePayment.payment_date >= start_date,
-            SupplierInvoicePayment.payment_date <= end_date
-        ).all()
-        total_supplier_payments = sum(p.amount for p in supplier_payments)
-
-        total_outflows = total_salaries + total_supplier_payments
-
-        # صافي التدفق
-        net_cash_flow = total_inflows - total_outflows
+        # الإجماليات والتوزيع حسب البند والشهر محسوبة في قاعدة البيانات
+        summary = get_cash_flow_summary(start_date, end_date)
 
+        # السطور التفصيلية: الصفحة الأولى فقط، والباقي عبر /accounts/cash_flow/details
         return render_template('accounts/cash_flow.html',
                                start_date=start_date,
                                end_date=end_date,
-                               total_inflows=total_inflows,
-                               total_outflows=total_outflows,
-                               net_cash_flow=net_cash_flow,
-                               salaries_paid=salaries_paid,
-                               supplier_payments=supplier_payments,
-                               contract_payments=contract_payments,
+                               total_inflows=summary['total_inflows'],
+                               total_outflows=summary['total_outflows'],
+                               net_cash_flow=summary['net_cash_flow'],
+                               totals=summary['totals'],
+                               by_category=summary['by_category'],
+                               by_month=summary['by_month'],
+                               salaries_paid=get_cash_flow_details('salaries', start_date, end_date),
+                               supplier_payments=get_cash_flow_details('supplier_payments', start_date, end_date),
+                               contract_payments=get_cash_flow_details('revenue', start_date, end_date),
                                now=datetime.now())
 
+    @app.route('/accounts/cash_flow/details')
+    @login_required
+    @role_required('admin', 'finance')
+    def cash_flow_details():
+        """صفحة من سطور أحد بنود التدفقات النقدية (تصفح بالمؤشر)"""
+        try:
+            start_date = datetime.strptime(request.args.get('start_date', ''), '%Y-%m-%d').date()
+            end_date = datetime.strptime(request.args.get('end_date', ''), '%Y-%m-%d').date()
+            details = get_cash_flow_details(
+                request.args.get('kind', 'revenue'), start_date, end_date,
+                limit=min(request.args.get('limit', 50, type=int), 500),
+                cursor=request.args.get('cursor') or None,
+            )
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        return jsonify({'success': True, **details})
+
     from flask import send_file
     import pandas as pd
     from io import BytesIO
@@ -7678,7 +7513,7 @@ def register_routes(app):
 
         query = Salary.query
         if period_key:
-            query = query.filter(Salary.month_year == period_key)
+            query = query.filter(Salary.period_key_is(period_key))
 
         salaries = query.all()
 
@@ -7847,9 +7682,9 @@ def register_routes(app):
                 month_year=period_key
             ).first()
         elif employee_id:
-            salary = Salary.query.filter_by(employee_id=employee_id).order_by(Salary.month_year.desc()).first()
+            salary = Salary.query.filter_by(employee_id=employee_id).order_by(*Salary.period_order()).first()
         else:
-            salary = Salary.query.order_by(Salary.month_year.desc()).first()
+            salary = Salary.query.order_by(*Salary.period_order()).first()
 
         if salary:
             print(f"   📄 الراتب الموجود:")
@@ -1,9 +1,12 @@
 # utils.py
+import threading
+import time
 from functools import wraps
 from flask import flash, redirect, url_for, current_app
 from flask_login import current_user
 from datetime import datetime, timedelta
 from models import db
+from sqlalchemy import event
 
 
 def safe_float(value, default=0.0):
@@ -107,87 +110,92 @@ def filter_by_user_role(query, model, user, company_field='company_id'):
         return query.filter(False)
     return query.filter(False)
 
-def get_employee_attendance_summary(employee, start_date, end_date):
-    """الحصول على ملخص الحضور للموظف في فترة محددة"""
-    from models import Attendance
-    from datetime import timedelta
+def count_weekdays(start_date, end_date, weekday):
+    """عدد أيام الأسبوع المحددة (0=الاثنين ... 4=الجمعة) في فترة شاملة للطرفين"""
+    total_days = (end_date - start_date).days + 1
+    if total_days <= 0:
+        return 0
+    first_offset = (weekday - start_date.weekday()) % 7
+    if first_offset >= total_days:
+        return 0
+    return 1 + (total_days - 1 - first_offset) // 7
 
-    attendances = Attendance.query.filter(
-        Attendance.employee_id == employee.id,
-        Attendance.date >= start_date,
-        Attendance.date <= end_date
-    ).all()
 
-    attendance_dict = {att.date: att for att in attendances}
-
-    summary = {
-        'attendance_days': 0,
-        'absent_days': 0,
-        'sick_days': 0,
-        'late_minutes_total': 0,
-        'paid_leave_days': 0,
-        'unpaid_leave_days': 0,  # ✅ أضف هذا
-        'friday_attendance_days': 0,
-        'total_days': (end_date - start_date).days + 1,
-        'work_days': 0,
-    }
+def get_employees_attendance_summaries(employees, start_date, end_date):
+    """
+    ملخص الحضور لمجموعة موظفين في فترة محددة باستعلام واحد مجمّع
 
-    current_date = start_date
-    while current_date <= end_date:
-        is_friday = current_date.weekday() == 4
-
-        if current_date in attendance_dict:
-            att = attendance_dict[current_date]
-
-            if att.attendance_status == 'present':
-                summary['attendance_days'] += 1
-                if is_friday:
-                    summary['friday_attendance_days'] += 1
-
-            elif att.attendance_status == 'sick':
-                summary['sick_days'] += 1
-                if is_friday:
-                    summary['friday_attendance_days'] += 1
-
-            elif att.attendance_status == 'annual_leave':
-                days = att.annual_leave_days or 1
-                summary['paid_leave_days'] += days
-                if is_friday:
-                    summary['friday_attendance_days'] += 1
-
-            elif att.attendance_status == 'annual_leave_unpaid':  # ✅ دعم الإجازة بدون أجر
-                days = att.annual_leave_days or 1
-                summary['unpaid_leave_days'] += days
-
-            elif att.attendance_status == 'absent':
-                if not is_friday:
-                    summary['absent_days'] += 1
-                else:
-                    summary['friday_attendance_days'] += 1
-
-            elif att.attendance_status == 'late':
-                summary['attendance_days'] += 1
-                summary['late_minutes_total'] += att.late_minutes or 0
-                if is_friday:
-                    summary['friday_attendance_days'] += 1
-        else:
-            if not is_friday:
-                summary['absent_days'] += 1
+    Args:
+        employees: قائمة موظفين أو معرفاتهم
+        start_date: تاريخ البداية
+        end_date: تاريخ النهاية
 
-        current_date += timedelta(days=1)
+    Returns:
+        dict: {employee_id: summary} بنفس حقول get_employee_attendance_summary
+    """
+    from models import Attendance
+    from sqlalchemy import case, func
+
+    employee_ids = [getattr(emp, 'id', emp) for emp in employees]
+    total_days = (end_date - start_date).days + 1
+    friday_count = count_weekdays(start_date, end_date, 4)
+    non_friday_days = max(total_days, 0) - friday_count
+
+    first_friday = start_date + timedelta(days=(4 - start_date.weekday()) % 7)
+    fridays = [first_friday + timedelta(weeks=i) for i in range(friday_count)]
+
+    status = Attendance.attendance_status
+    is_friday = Attendance.date.in_(fridays) if fridays else db.false()
+    leave_days = func.coalesce(func.nullif(Attendance.annual_leave_days, 0), 1)
+
+    def count_when(*conditions):
+        return func.coalesce(func.sum(case((db.and_(*conditions), 1), else_=0)), 0)
+
+    rows = []
+    if employee_ids:
+        rows = db.session.query(
+            Attendance.employee_id,
+            count_when(status.in_(['present', 'late'])),
+            count_when(status == 'sick'),
+            func.coalesce(func.sum(case(
+                (status == 'late', func.coalesce(Attendance.late_minutes, 0)), else_=0
+            )), 0),
+            func.coalesce(func.sum(case((status == 'annual_leave', leave_days), else_=0)), 0),
+            func.coalesce(func.sum(case((status == 'annual_leave_unpaid', leave_days), else_=0)), 0),
+            count_when(is_friday, status.in_(['present', 'late', 'sick', 'annual_leave', 'absent'])),
+            # أيام العمل المسجلة بحالة غير الغياب (الأيام غير المسجلة تُحتسب غياباً)
+            count_when(db.not_(is_friday), db.or_(status.is_(None), status != 'absent')),
+        ).filter(
+            Attendance.employee_id.in_(employee_ids),
+            Attendance.date >= start_date,
+            Attendance.date <= end_date
+        ).group_by(Attendance.employee_id).all()
+
+    by_employee = {row[0]: row[1:] for row in rows}
+
+    summaries = {}
+    for employee_id in employee_ids:
+        (attendance_days, sick_days, late_minutes, paid_leave, unpaid_leave,
+         fridays_attended, non_absent_work_days) = by_employee.get(employee_id, (0,) * 7)
+
+        summaries[employee_id] = {
+            'attendance_days': int(attendance_days),
+            'absent_days': non_friday_days - int(non_absent_work_days),
+            'sick_days': int(sick_days),
+            'late_minutes_total': int(late_minutes),
+            'paid_leave_days': int(paid_leave),
+            'unpaid_leave_days': int(unpaid_leave),
+            'friday_attendance_days': int(fridays_attended),
+            'total_days': total_days,
+            'work_days': total_days - (friday_count - int(fridays_attended)),
+        }
 
-    # حساب أيام العمل
-    friday_count = 0
-    current_date = start_date
-    while current_date <= end_date:
-        if current_date.weekday() == 4:
-            friday_count += 1
-        current_date += timedelta(days=1)
+    return summaries
 
-    fridays_attended = summary['friday_attendance_days']
-    summary['work_days'] = summary['total_days'] - (friday_count - fridays_attended)
 
-    return summary
+def get_employee_attendance_summary(employee, start_date, end_date):
+    """الحصول على ملخص الحضور للموظف في فترة محددة"""
+    return get_employees_attendance_summaries([employee], start_date, end_date)[employee.id]
 
 def get_employee_daily_allowance(employee, attendance_days):
     """حساب قيمة البدل اليومي"""
@@ -408,55 +416,125 @@ def can_create_journal_entry_before_salary():
     """
     from models import Salary, AttendancePeriodTransfer
 
+    # العددان يُحفظان في الجلسة حتى نهاية المعاملة أو أي كتابة على الرواتب أو الترحيلات
+    counts = db.session.info.get('pending_posting_counts')
+    if counts is None:
+        counts = db.session.info['pending_posting_counts'] = (
+            Salary.query.filter_by(is_paid=False).count(),
+            AttendancePeriodTransfer.query.filter_by(is_transferred=False).count(),
+        )
+    pending_salaries, pending_transfers = counts
+
     # التحقق من وجود رواتب غير محسوبة
-    pending_salaries = Salary.query.filter_by(is_paid=False).count()
     if pending_salaries > 0:
         return False, f"⚠️ يوجد {pending_salaries} راتب غير مدفوع. يرجى صرف الرواتب أولاً"
 
     # التحقق من وجود فترات دوام غير مترحلة
-    pending_transfers = AttendancePeriodTransfer.query.filter_by(is_transferred=False).count()
     if pending_transfers > 0:
         return False, f"⚠️ يوجد {pending_transfers} فترة دوام غير مرحل. يرجى ترحيل فترات الدوام أولاً"
 
     return True, "يمكن إنشاء القيد"
 
 
-def validate_account_balance(account_id, amount, account_type):
-    """
-    التحقق من صحة رصيد الحساب قبل إنشاء القيد
-    منع عمل قيد لحساب موجب أو سالب بشكل غير صحيح
+_POSTING_GUARD_TABLES = {'salaries', 'attendance_period_transfers'}
 
-    Returns:
-        (is_valid, message)
-    """
-    from models import Account
 
-    account = Account.query.get(account_id)
-    if not account:
-        return False, f"الحساب غير موجود"
+@event.listens_for(db.orm.Session, 'after_flush')
+def _posting_guard_after_flush(session, flush_context):
+    if any(getattr(obj, '__tablename__', None) in _POSTING_GUARD_TABLES
+           for obj in list(session.new) + list(session.dirty) + list(session.deleted)):
+        session.info.pop('pending_posting_counts', None)
+
+
+@event.listens_for(db.orm.Session, 'do_orm_execute')
+def _posting_guard_bulk_execute(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        table = getattr(orm_execute_state.statement, 'table', None)
+        if getattr(table, 'name', None) in _POSTING_GUARD_TABLES:
+            orm_execute_state.session.info.pop('pending_posting_counts', None)
+
+
+@event.listens_for(db.orm.Session, 'after_commit')
+def _posting_guard_after_commit(session):
+    # عمليات أخرى قد تصرف رواتب أو ترحل فترات بعد انتهاء المعاملة
+    session.info.pop('pending_posting_counts', None)
+
 
-    current_balance = account.get_balance()
+@event.listens_for(db.orm.Session, 'after_soft_rollback')
+def _posting_guard_after_rollback(session, previous_transaction):
+    session.info.pop('pending_posting_counts', None)
 
+
+def _check_account_balance(account, current_balance, amount, account_type):
+    """قاعدة منع الأرصدة الخاطئة لسطر واحد - (is_valid, message)"""
     # الحسابات التي لا يمكن أن تصبح سالبة (أصول ومصروفات)
     # طبيعتها مدين (Debit)
-    if account.nature == 'debit':
+    if account['nature'] == 'debit':
         # عند إضافة مدين، يجب ألا يصبح الرصيد سالباً بشكل مفرط
         if account_type == 'debit' and amount > 0:
             # التحقق من أن الرصيد لن يصبح سالباً جداً (أقل من -1000 مثلاً)
             if current_balance + amount < -1000:
-                return False, f"❌ لا يمكن إضافة مدين {amount:,.0f} ريال لحساب {account.name_ar} برصيد {current_balance:,.0f} ريال (سيصبح سالباً بشكل كبير)"
+                return False, f"❌ لا يمكن إضافة مدين {amount:,.0f} ريال لحساب {account['account'].name_ar} برصيد {current_balance:,.0f} ريال (سيصبح سالباً بشكل كبير)"
 
     # الحسابات التي لا يمكن أن تصبح مدينة (خصوم وإيرادات)
     # طبيعتها دائن (Credit)
-    if account.nature == 'credit':
+    if account['nature'] == 'credit':
         # عند إضافة دائن، يجب ألا يصبح الرصيد سالباً
         if account_type == 'credit' and amount > 0:
             if current_balance - amount < -1000:
-                return False, f"❌ لا يمكن إضافة دائن {amount:,.0f} ريال لحساب {account.name_ar} برصيد {current_balance:,.0f} ريال"
+                return False, f"❌ لا يمكن إضافة دائن {amount:,.0f} ريال لحساب {account['account'].name_ar} برصيد {current_balance:,.0f} ريال"
+
+    return True, "الحساب صالح"
+
+
+def _load_line_balances(lines):
+    """أرصدة الحسابات الواردة في السطور - {account_id: صف get_accounts_balances}"""
+    return {
+        row['id']: row
+        for row in get_accounts_balances(active_only=False, account_ids={line[0] for line in lines})
+    }
+
+
+def validate_journal_lines(entries, balances=None):
+    """
+    التحقق من أرصدة جميع سطور قيد (أو مجموعة قيود) باستعلام أرصدة واحد
+
+    Args:
+        entries: سطور (account_id, debit, credit, ...)
+        balances: أرصدة محمّلة مسبقاً من _load_line_balances (اختياري)
+
+    Returns:
+        (is_valid, message) لأول سطر مخالف
+    """
+    entries = list(entries)
+    if balances is None:
+        balances = _load_line_balances(entries)
+
+    for account_id, debit, credit, *_ in entries:
+        account = balances.get(account_id)
+        for amount, account_type in ((debit, 'debit'), (credit, 'credit')):
+            if amount > 0:
+                if account is None:
+                    return False, "الحساب غير موجود"
+                valid, msg = _check_account_balance(account, account['balance'], amount, account_type)
+                if not valid:
+                    return False, msg
 
     return True, "الحساب صالح"
 
 
+def validate_account_balance(account_id, amount, account_type):
+    """
+    التحقق من صحة رصيد الحساب قبل إنشاء القيد
+    منع عمل قيد لحساب موجب أو سالب بشكل غير صحيح
+
+    Returns:
+        (is_valid, message)
+    """
+    debit, credit = (amount, 0) if account_type == 'debit' else (0, amount)
+    return validate_journal_lines([(account_id, debit, credit)])
+
+
 def create_journal_entry(date, description, entries, reference_type=None, reference_id=None, skip_validation=False):
     """
     إنشاء قيد يومي جديد مع ضوابط أمان
@@ -491,15 +569,9 @@ def create_journal_entry(date, description, entries, reference_type=None, refere
 
     # ========== 3. التحقق من صحة الحسابات (منع الأرصدة الموجبة/السالبة الخاطئة) ==========
     if not skip_validation:
-        for account_id, debit, credit, entry_description in entries:
-            if debit > 0:
-                valid, msg = validate_account_balance(account_id, debit, 'debit')
-                if not valid:
-                    raise ValueError(msg)
-            if credit > 0:
-                valid, msg = validate_account_balance(account_id, credit, 'credit')
-                if not valid:
-                    raise ValueError(msg)
+        valid, msg = validate_journal_lines(entries)
+        if not valid:
+            raise ValueError(msg)
 
     # ========== 4. إنشاء القيد ==========
     # إنشاء رقم القيد
@@ -542,6 +614,121 @@ def create_journal_entry(date, description, entries, reference_type=None, refere
     print(f"✅ تم إنشاء القيد: {entry_number}")
     return journal_entry
 
+def post_journal_entries(entries, created_by=None, skip_validation=False, commit=True, prefix='JE'):
+    """
+    ترحيل عدة قيود دفعة واحدة (الكل أو لا شيء)
+
+    الأرقام تُحجز في خطوة واحدة، والتحقق يتم على جميع القيود معاً،
+    ثم تُدرج الرؤوس والتفاصيل بإدراج جماعي (executemany).
+
+    Args:
+        entries: قائمة dict لكل قيد:
+            date, description, lines [(account_id, debit, credit, description)],
+            reference_type, reference_id, entry_number (اختياري - يُحجز رقم جديد إن لم يُحدد)
+        created_by: معرف المستخدم المنشئ
+        skip_validation: تخطي التحقق (للاستخدام الداخلي فقط)
+        commit: حفظ المعاملة في النهاية (False عند الترحيل ضمن معاملة أكبر)
+        prefix: بادئة الأرقام المحجوزة (JE / REV)
+
+    Returns:
+        قائمة (id, entry_number) بنفس ترتيب القيود
+    """
+    from models import db, JournalEntry, JournalEntryDetail, AccountBalance
+    from flask_login import current_user
+
+    entries = list(entries)
+    if not entries:
+        return []
+
+    if created_by is None:
+        created_by = current_user.id if hasattr(current_user, 'id') else 1
+
+    try:
+        # ========== 1. التحقق من إمكانية إنشاء القيود ==========
+        if not skip_validation and any(
+                e.get('reference_type') not in ['salary', 'salary_payment', 'adjustment'] for e in entries):
+            can_create, msg = can_create_journal_entry_before_salary()
+            if not can_create:
+                raise ValueError(msg)
+
+        # ========== 2. التحقق من صحة المدخلات والتوازن ==========
+        for index, e in enumerate(entries, 1):
+            lines = e.get('lines') or []
+            if not lines:
+                raise ValueError(f"القيد {index}: لا توجد تفاصيل للقيد")
+            total_debit = sum(line[1] for line in lines)
+            total_credit = sum(line[2] for line in lines)
+            if abs(total_debit - total_credit) > 0.01:
+                raise ValueError(f"القيد {index} غير متوازن: مدين={total_debit}, دائن={total_credit}")
+
+        # ========== 3. التحقق من الأرصدة (استعلام أرصدة واحد لكل القيود) ==========
+        # كل قيد يُتحقق منه على الرصيد بعد القيود السابقة له في الدفعة
+        if not skip_validation:
+            balances = _load_line_balances([line for e in entries for line in e['lines']])
+            for index, e in enumerate(entries, 1):
+                valid, msg = validate_journal_lines(e['lines'], balances)
+                if not valid:
+                    raise ValueError(f"القيد {index}: {msg}")
+                for account_id, debit, credit, *_ in e['lines']:
+                    row = balances.get(account_id)
+                    if row:
+                        row['balance'] += (debit - credit) if row['nature'] == 'debit' else (credit - debit)
+
+        # ========== 4. حجز الأرقام دفعة واحدة ==========
+        numbers = iter(next_document_numbers(prefix, sum(1 for e in entries if not e.get('entry_number'))))
+        now = datetime.utcnow()
+        header_rows = [{
+            'entry_number': e.get('entry_number') or next(numbers),
+            'date': e['date'],
+            'description': e['description'],
+            'reference_type': e.get('reference_type'),
+            'reference_id': e.get('reference_id'),
+            'period_key': JournalEntry.period_key_for(e['date']),
+            'created_by': created_by,
+            'is_posted': True,
+            'created_at': now,
+            'updated_at': now,
+        } for e in entries]
+
+        # ========== 5. الإدراج الجماعي ==========
+        inserted = db.session.execute(
+            db.insert(JournalEntry).returning(
+                JournalEntry.id, JournalEntry.entry_number, sort_by_parameter_order=True
+            ),
+            header_rows
+        ).all()
+
+        detail_rows = []
+        deltas = {}
+        for (entry_id, _), e in zip(inserted, entries):
+            for account_id, debit, credit, line_description in e['lines']:
+                if debit == 0 and credit == 0:
+                    continue
+                detail_rows.append({
+                    'entry_id': entry_id, 'account_id': account_id,
+                    'debit': debit, 'credit': credit,
+                    'description': line_description, 'created_at': now,
+                })
+                bucket = deltas.setdefault((account_id, e['date'].year, e['date'].month), [0.0, 0.0])
+                bucket[0] += float(debit or 0)
+                bucket[1] += float(credit or 0)
+        if detail_rows:
+            db.session.execute(db.insert(JournalEntryDetail), detail_rows)
+
+        # الإدراج الجماعي لا يمر بأحداث flush - تحديث أرصدة الفترات مباشرة
+        AccountBalance.apply_deltas(db.session.connection(), deltas)
+
+        if commit:
+            db.session.commit()
+    except Exception:
+        if commit:
+            db.session.rollback()
+        raise
+
+    print(f"✅ تم ترحيل {len(inserted)} قيد")
+    return [tuple(row) for row in inserted]
+
+
 def safe_transfer_transaction(transaction_id):
     """
     ترحيل معاملة مالية بشكل آمن مع التحقق
@@ -581,28 +768,7 @@ def safe_transfer_transaction(transaction_id):
 
 def generate_supplier_invoice_number():
     """توليد رقم فاتورة مورد تلقائي"""
-    from datetime import datetime
-    from models import db, JournalEntry, JournalEntryDetail, SupplierInvoice  # ✅ أضف db
-
-    last_invoice = SupplierInvoice.query.order_by(SupplierInvoice.id.desc()).first()
-
-    if last_invoice and last_invoice.invoice_number:
-        try:
-            parts = last_invoice.invoice_number.split('-')
-            if len(parts) >= 3:
-                last_num = int(parts[2])
-                new_num = last_num + 1
-            else:
-                new_num = 1
-        except (ValueError, IndexError):
-            new_num = 1
-    else:
-        new_num = 1
-
-    today = datetime.now()
-    date_str = today.strftime('%Y%m%d')
-
-    return f"SI-{date_str}-{str(new_num).zfill(3)}"
+    return next_document_number('SI')
 
 
 def auto_close_expenses():
@@ -622,11 +788,11 @@ def auto_close_expenses():
     ).all()
 
     # إضافة حساب المصروفات العامة إذا كان له رصيد
-    general_expense = Account.query.filter_by(code='530005').first()
+    general_expense = get_account_by_code('530005')
     if general_expense and general_expense.get_balance() != 0:
         expense_accounts.append(general_expense)
 
-    retained_earnings = Account.query.filter_by(code='320001').first()
+    retained_earnings = get_account_by_code('320001')
 
     if not retained_earnings:
         retained_earnings = Account(
@@ -663,7 +829,7 @@ def auto_close_expenses():
     current_month = datetime.now().strftime('%Y-%m')
     existing = JournalEntry.query.filter(
         JournalEntry.reference_type == 'closing_expenses',
-        JournalEntry.description.like(f'%{current_month}%')
+        JournalEntry.period_key == current_month
     ).first()
 
     if existing:
@@ -723,7 +889,7 @@ def redistribute_expenses():
     from models import Account, JournalEntry, JournalEntryDetail, db
     from datetime import datetime
 
-    general_expense = Account.query.filter_by(code='530005').first()
+    general_expense = get_account_by_code('530005')
     if not general_expense:
         return {'success': False, 'message': 'حساب المصروفات العامة غير موجود'}
 
@@ -767,7 +933,7 @@ def redistribute_expenses():
     distributed = 0
     for code, data in expense_distribution.items():
         if data['amount'] > 0:
-            expense_account = Account.query.filter_by(code=code).first()
+            expense_account = get_account_by_code(code)
             if expense_account:
                 detail = JournalEntryDetail(
                     entry_id=journal_entry.id,
@@ -819,7 +985,7 @@ def create_salary_accrual(salary):
     from models import db, JournalEntry, JournalEntryDetail, Account
 
     # ✅ تعريف الحسابات داخل الدالة
-    salary_expense = Account.query.filter_by(code='510001').first()
+    salary_expense = get_account_by_code('510001')
     if not salary_expense:
         salary_expense = Account(
             code='510001',
@@ -833,7 +999,7 @@ def create_salary_accrual(salary):
         db.session.add(salary_expense)
         db.session.commit()
 
-    salaries_payable = Account.query.filter_by(code='210001').first()
+    salaries_payable = get_account_by_code('210001')
     if not salaries_payable:
         salaries_payable = Account(
             code='210001',
@@ -921,9 +1087,9 @@ def create_meal_supplier_settlement_journal_entry(meal_type, amount, payment_met
     if not credit_account:
         # حساب افتراضي حسب النوع
         if meal_type == 'cafeteria':
-            credit_account = Account.query.filter_by(code='22020003').first()  # بوفية الشركة
+            credit_account = get_account_by_code('22020003')  # بوفية الشركة
         else:
-            credit_account = Account.query.filter_by(code='22020002').first()  # مطعم الشركة
+            credit_account = get_account_by_code('22020002')  # مطعم الشركة
 
     if meal_type == 'cafeteria':
         name_ar = 'البوفية'
@@ -1003,7 +1169,7 @@ def create_salary_journal_entry(salary):
 
     missing_accounts = []
     for key, (code, name_ar) in required_accounts.items():
-        account = Account.query.filter_by(code=code, is_active=True).first()
+        account = get_account_by_code(code, active_only=True)
         if not account:
             missing_accounts.append(f"{code} - {name_ar}")
         accounts[key] = account
@@ -1272,7 +1438,7 @@ def create_invoice_journal_entry(invoice):
             customer_account = invoice.contract.company.get_or_create_receivable_account()
 
         if not customer_account:
-            customer_account = Account.query.filter_by(code='120001').first()
+            customer_account = get_account_by_code('120001')
 
         if not customer_account:
             customer_account = Account(
@@ -1291,7 +1457,7 @@ def create_invoice_journal_entry(invoice):
         # =========================
         # حساب الإيرادات
         # =========================
-        revenue_account = Account.query.filter_by(code='410001').first()
+        revenue_account = get_account_by_code('410001')
 
         if not revenue_account:
             revenue_account = Account(
@@ -1392,13 +1558,13 @@ def create_invoice_payment_journal_entry(invoice, paid_amount, payment_method):
     # حساب التحصيل
     # =========================
     if payment_method == 'cash':
-        collection_account = Account.query.filter_by(code='110001').first()
+        collection_account = get_account_by_code('110001')
 
     elif payment_method == 'bank':
-        collection_account = Account.query.filter_by(code='110002').first()
+        collection_account = get_account_by_code('110002')
 
     else:
-        collection_account = Account.query.filter_by(code='110001').first()
+        collection_account = get_account_by_code('110001')
 
     # =========================
     # حساب العميل
@@ -1406,7 +1572,7 @@ def create_invoice_payment_journal_entry(invoice, paid_amount, payment_method):
     if invoice.contract and invoice.contract.company:
         receivable_account = invoice.contract.company.get_or_create_receivable_account()
     else:
-        receivable_account = Account.query.filter_by(code='120001').first()
+        receivable_account = get_account_by_code('120001')
 
     # =========================
     # التحقق
@@ -1451,8 +1617,8 @@ def create_salary_payment_journal_entry(salary):
 
 
     # البحث عن الحسابات
-    payable_account = Account.query.filter_by(code='210001').first()
-    bank_account = Account.query.filter_by(code='110002').first()
+    payable_account = get_account_by_code('210001')
+    bank_account = get_account_by_code('110002')
 
     if not payable_account or not bank_account:
         raise ValueError("الحسابات المحاسبية غير مهيأة بشكل صحيح")
@@ -1507,10 +1673,10 @@ def create_supplier_invoice_journal_entry(invoice):
 
     # ✅ استخدام account_code من ExpenseCategory
     if invoice.category and invoice.category.account_code:
-        expense_account = Account.query.filter_by(code=invoice.category.account_code).first()
+        expense_account = get_account_by_code(invoice.category.account_code)
     else:
         # حساب المصروفات العامة الافتراضي
-        expense_account = Account.query.filter_by(code='530005').first()
+        expense_account = get_account_by_code('530005')
 
         # إذا لم يكن موجوداً، قم بإنشائه
         if not expense_account:
@@ -1556,8 +1722,8 @@ def create_expense_invoice_journal_entry(invoice):
     }
 
     account_code = expense_accounts.get(invoice.category.name, '530005')
-    expense_account = Account.query.filter_by(code=account_code).first()
-    payable_account = Account.query.filter_by(code='220001').first()  # الدائنون
+    expense_account = get_account_by_code(account_code)
+    payable_account = get_account_by_code('220001')  # الدائنون
 
     if not expense_account or not payable_account:
         raise ValueError("الحسابات المحاسبية غير مهيأة بشكل صحيح")
@@ -1580,12 +1746,12 @@ def create_expense_payment_journal_entry(payment):
     """إنشاء قيد محاسبي لدفع مصروف"""
     from models import Account
 
-    payable_account = Account.query.filter_by(code='220001').first()  # الدائنون
+    payable_account = get_account_by_code('220001')  # الدائنون
 
     if payment.payment_method == 'cash':
-        bank_account = Account.query.filter_by(code='110001').first()  # الصندوق
+        bank_account = get_account_by_code('110001')  # الصندوق
     else:
-        bank_account = Account.query.filter_by(code='110002').first()  # البنك
+        bank_account = get_account_by_code('110002')  # البنك
 
     if not payable_account or not bank_account:
         raise ValueError("الحسابات المحاسبية غير مهيأة بشكل صحيح")
@@ -1604,54 +1770,83 @@ def create_expense_payment_journal_entry(payment):
     )
 
 
-def reverse_journal_entry(journal_entry_id):
-    """عكس قيد محاسبي (إنشاء قيد عكسي)"""
-    from models import JournalEntry, JournalEntryDetail, db
-    from flask_login import current_user
-    from datetime import datetime
+def reverse_journal_entries(entry_ids, label='عكس قيد', created_by=None, commit=True):
+    """
+    عكس عدة قيود محاسبية دفعة واحدة (تبديل المدين والدائن)
 
+    القيود وتفاصيلها تُجلب في استعلامين، والقيود المعكوسة مسبقاً باستعلام IN واحد،
+    ثم تُرحل القيود العكسية عبر post_journal_entries.
 
-    original_entry = JournalEntry.query.get(journal_entry_id)
-    if not original_entry:
-        raise ValueError("القيد المحاسبي غير موجود")
+    Returns:
+        dict: reversed [(original_entry, reverse_id, reverse_number)],
+              missing [entry_id], already_reversed [(original_entry, reverse_number)],
+              empty [original_entry] (قيود بلا تفاصيل - لا تُعكس ولا تُفشل الدفعة)
+    """
+    from models import JournalEntry, db
+    from sqlalchemy.orm import selectinload
 
-    # التحقق من عدم وجود قيد عكسي مسبق
-    existing_reverse = JournalEntry.query.filter(
-        JournalEntry.reference_type == 'reverse',
-        JournalEntry.reference_id == original_entry.id
-    ).first()
+    entry_ids = list(dict.fromkeys(int(eid) for eid in entry_ids))
+    entries = {
+        e.id: e for e in JournalEntry.query.options(selectinload(JournalEntry.details))
+        .filter(JournalEntry.id.in_(entry_ids)).all()
+    }
+    existing = dict(
+        db.session.query(JournalEntry.reference_id, JournalEntry.entry_number).filter(
+            JournalEntry.reference_type == 'reverse',
+            JournalEntry.reference_id.in_(list(entries))
+        ).all()
+    ) if entries else {}
+
+    result = {'reversed': [], 'missing': [], 'already_reversed': [], 'empty': []}
+    targets = []
+    for eid in entry_ids:
+        original_entry = entries.get(eid)
+        if original_entry is None:
+            result['missing'].append(eid)
+        elif eid in existing:
+            result['already_reversed'].append((original_entry, existing[eid]))
+        elif not original_entry.details:
+            result['empty'].append(original_entry)
+        else:
+            targets.append(original_entry)
 
-    if existing_reverse:
-        raise ValueError(f"يوجد قيد عكسي مسبق: {existing_reverse.entry_number}")
+    today = datetime.now().date()
+    inserted = post_journal_entries([{
+        'date': today,
+        'description': f'{label}: {original_entry.entry_number} - {original_entry.description[:80]}',
+        'reference_type': 'reverse',
+        'reference_id': original_entry.id,
+        # عكس: الدائن يصبح مدين والمدين يصبح دائن
+        'lines': [
+            (detail.account_id, detail.credit or 0, detail.debit or 0,
+             f'عكس: {detail.description} (قيد أصلي: {original_entry.entry_number})')
+            for detail in original_entry.details
+        ],
+    } for original_entry in targets], created_by=created_by, skip_validation=True, commit=commit, prefix='REV')
+
+    result['reversed'] = [
+        (original_entry, reverse_id, reverse_number)
+        for original_entry, (reverse_id, reverse_number) in zip(targets, inserted)
+    ]
+    return result
 
-    # إنشاء رقم القيد العكسي
-    entry_number = get_next_entry_number()
 
-    # إنشاء قيد عكسي
-    reverse_entry = JournalEntry(
-        entry_number=entry_number,
-        date=datetime.now().date(),
-        description=f'عكس قيد: {original_entry.entry_number} - {original_entry.description[:80]}',
-        reference_type='reverse',
-        reference_id=original_entry.id,
-        created_by=current_user.id if hasattr(current_user, 'id') else 1
-    )
-    db.session.add(reverse_entry)
-    db.session.flush()
+def reverse_journal_entry(journal_entry_id):
+    """عكس قيد محاسبي (إنشاء قيد عكسي)"""
+    from models import JournalEntry, db
 
-    # عكس تفاصيل القيد (تبديل المدين والدائن)
-    for detail in original_entry.details:
-        reverse_detail = JournalEntryDetail(
-            entry_id=reverse_entry.id,
-            account_id=detail.account_id,
-            debit=detail.credit,  # عكس: الدائن يصبح مدين
-            credit=detail.debit,  # عكس: المدين يصبح دائن
-            description=f'عكس: {detail.description} (قيد أصلي: {original_entry.entry_number})'
-        )
-        db.session.add(reverse_detail)
+    result = reverse_journal_entries([journal_entry_id])
+    if result['missing']:
+        raise ValueError("القيد المحاسبي غير موجود")
 
-    db.session.commit()
-    return reverse_entry
+    # التحقق من عدم وجود قيد عكسي مسبق
+    if result['already_reversed']:
+        raise ValueError(f"يوجد قيد عكسي مسبق: {result['already_reversed'][0][1]}")
+
+    if result['empty']:
+        raise ValueError("لا توجد تفاصيل للقيد")
+
+    return db.session.get(JournalEntry, result['reversed'][0][1])
 
 def reverse_invoice_journal_entry(invoice):
     """عكس القيد المحاسبي للفاتورة"""
@@ -1670,30 +1865,97 @@ def reverse_invoice_journal_entry(invoice):
     return reverse_entry
 
 
+def get_employees_overtime_hours(employees, start_date, end_date):
+    """
+    ساعات العمل الإضافي لمجموعة موظفين في الفترة باستعلام واحد مجمّع
+
+    المبالغ الكبيرة (> 1000) تُحوَّل إلى ساعات بأجر الساعة × 1.5،
+    والقيم الصغيرة تُعتبر ساعات بالفعل.
+
+    Returns:
+        dict: {employee_id: ساعات الإضافي}
+
+    Raises:
+        ValueError: مبالغ إضافي لموظفين بدون راتب (لا يمكن تحويلها إلى ساعات)
+    """
+    from models import FinancialTransaction
+    from sqlalchemy import case, func
+
+    employees = list(employees)
+    rows = []
+    if employees:
+        amount = FinancialTransaction.amount
+        rows = db.session.query(
+            FinancialTransaction.employee_id,
+            func.coalesce(func.sum(case((amount > 1000, amount), else_=0)), 0),
+            func.coalesce(func.sum(case((amount > 1000, 0), else_=amount)), 0),
+        ).filter(
+            FinancialTransaction.employee_id.in_([emp.id for emp in employees]),
+            FinancialTransaction.transaction_type == 'overtime',
+            FinancialTransaction.date >= start_date,
+            FinancialTransaction.date <= end_date,
+            FinancialTransaction.is_settled == False
+        ).group_by(FinancialTransaction.employee_id).all()
+
+    by_employee = {row[0]: (row[1], row[2]) for row in rows}
+
+    hours = {}
+    without_salary = []
+    for employee in employees:
+        large_amounts, small_amounts = by_employee.get(employee.id, (0, 0))
+        # حساب الأجر بالساعة
+        hourly_rate = (employee.salary or 0) / 30 / 8
+        total_hours = small_amounts
+        if large_amounts:
+            if not hourly_rate:
+                without_salary.append(employee.name)
+                continue
+            total_hours += large_amounts / (hourly_rate * 1.5)
+        hours[employee.id] = round(total_hours, 1)  # تقريب إلى أقرب 0.5 ساعة
+
+    if without_salary:
+        raise ValueError(
+            f"لا يمكن تحويل مبالغ الإضافي إلى ساعات لموظفين بدون راتب: {', '.join(without_salary)}"
+        )
+    return hours
+
+
 def get_employee_overtime_hours(employee, start_date, end_date):
     """الحصول على ساعات العمل الإضافي في الفترة (تحويل المبالغ إلى ساعات)"""
+    return get_employees_overtime_hours([employee], start_date, end_date)[employee.id]
+
+
+def get_employees_unsettled_totals(employee_ids):
+    """
+    إجمالي المعاملات غير المسواة لمجموعة موظفين مجمّعة حسب النوع باستعلام واحد
+
+    Returns:
+        dict: {employee_id: {نوع المعاملة: الإجمالي}} بنفس مفاتيح
+        Employee.get_unsettled_transactions_total
+    """
     from models import FinancialTransaction
+    from sqlalchemy import func
 
-    overtime_trans = FinancialTransaction.query.filter(
-        FinancialTransaction.employee_id == employee.id,
-        FinancialTransaction.transaction_type == 'overtime',
-        FinancialTransaction.date >= start_date,
-        FinancialTransaction.date <= end_date,
-        FinancialTransaction.is_settled == False
-    ).all()
+    employee_ids = list(employee_ids)
+    types = ('advance', 'overtime', 'deduction', 'penalty', 'cafeteria', 'restaurant', 'meal')
+    totals = {employee_id: dict.fromkeys(types, 0.0) for employee_id in employee_ids}
+    if not employee_ids:
+        return totals
 
-    # حساب الأجر بالساعة
-    hourly_rate = employee.salary / 30 / 8
+    rows = db.session.query(
+        FinancialTransaction.employee_id,
+        FinancialTransaction.transaction_type,
+        func.coalesce(func.sum(FinancialTransaction.amount), 0)
+    ).filter(
+        FinancialTransaction.employee_id.in_(employee_ids),
+        FinancialTransaction.transaction_type.in_(types),
+        FinancialTransaction.is_settled == False
+    ).group_by(FinancialTransaction.employee_id, FinancialTransaction.transaction_type).all()
 
-    total_hours = 0
-    for t in overtime_trans:
-        if t.amount > 1000:  # مبلغ كبير -> نحوله إلى ساعات
-            hours = t.amount / (hourly_rate * 1.5)
-            total_hours += hours
-        else:  # قيمة صغيرة -> قد تكون ساعات بالفعل
-            total_hours += t.amount
+    for employee_id, trans_type, total in rows:
+        totals[employee_id][trans_type] = total or 0.0
 
-    return round(total_hours, 1)  # تقريب إلى أقرب 0.5 ساعة
+    return totals
 
 
 def create_contract_journal_entry(contract, month_date=None):
@@ -1712,7 +1974,7 @@ def create_contract_journal_entry(contract, month_date=None):
 
     # تحديد حساب الإيرادات حسب نوع العقد
     if contract.contract_type == 'annual':
-        revenue_account = Account.query.filter_by(code='410001').first()
+        revenue_account = get_account_by_code('410001')
         if not revenue_account:
             revenue_account = Account(
                 code='410001', name='Annual Contract Revenue', name_ar='إيرادات العقود السنوية',
@@ -1722,7 +1984,7 @@ def create_contract_journal_entry(contract, month_date=None):
             db.session.flush()
         monthly_amount = contract.contract_value / 12
     elif contract.contract_type == 'monthly':
-        revenue_account = Account.query.filter_by(code='410002').first()
+        revenue_account = get_account_by_code('410002')
         if not revenue_account:
             revenue_account = Account(
                 code='410002', name='Monthly Contract Revenue', name_ar='إيرادات العقود الشهرية',
@@ -1732,7 +1994,7 @@ def create_contract_journal_entry(contract, month_date=None):
             db.session.flush()
         monthly_amount = contract.contract_value
     else:
-        revenue_account = Account.query.filter_by(code='410001').first()
+        revenue_account = get_account_by_code('410001')
         if not revenue_account:
             revenue_account = Account(
                 code='410001', name='Annual Contract Revenue', name_ar='إيرادات العقود السنوية',
@@ -1749,7 +2011,7 @@ def create_contract_journal_entry(contract, month_date=None):
     existing = JournalEntry.query.filter(
         JournalEntry.reference_type == 'contract',
         JournalEntry.reference_id == contract.id,
-        JournalEntry.description.like(f'%{month_str}%')
+        JournalEntry.period_key == month_str
     ).first()
 
     if existing:
@@ -1807,7 +2069,7 @@ def get_or_create_receivable_account(self):
             return account
 
     # إنشاء حساب فرعي جديد
-    parent = Account.query.filter_by(code='120001').first()
+    parent = get_account_by_code('120001')
     if not parent:
         parent = Account(
             code='120001', name='Customers', name_ar='العملاء',
@@ -1854,10 +2116,10 @@ def create_supplier_invoice_payment_journal_entry(invoice, payment_amount, payme
 
     # حساب الدفع
     if payment_method == 'cash':
-        bank_account = Account.query.filter_by(code='110001').first()  # الصندوق
+        bank_account = get_account_by_code('110001')  # الصندوق
         payment_name = 'الصندوق'
     else:
-        bank_account = Account.query.filter_by(code='110002').first()  # البنك
+        bank_account = get_account_by_code('110002')  # البنك
         payment_name = 'البنك'
 
     if not payable_account:
@@ -1921,9 +2183,9 @@ def fix_contract_revenue_accounts():
     from datetime import datetime
 
     # الحسابات
-    service_revenue = Account.query.filter_by(code='410001').first()
-    monthly_revenue = Account.query.filter_by(code='410002').first()
-    quarterly_revenue = Account.query.filter_by(code='410003').first()
+    service_revenue = get_account_by_code('410001')
+    monthly_revenue = get_account_by_code('410002')
+    quarterly_revenue = get_account_by_code('410003')
 
     if not service_revenue:
         print("❌ حساب إيرادات الخدمات غير موجود")
@@ -1938,7 +2200,7 @@ def fix_contract_revenue_accounts():
     for contract in contracts:
         # تحديد الحساب الصحيح حسب نوع العقد
         if contract.contract_type == 'annual':
-            correct_account = Account.query.filter_by(code='410001').first()
+            correct_account = get_account_by_code('410001')
             account_name = "إيرادات العقود السنوية"
         elif contract.contract_type == 'monthly':
             correct_account = monthly_revenue
@@ -1998,7 +2260,7 @@ def create_customer_invoice_journal_entry(invoice):
     from flask_login import current_user
 
     # الحصول على حسابات العملاء
-    customers = Account.query.filter_by(code='120001').first()
+    customers = get_account_by_code('120001')
     if not customers:
         customers = Account(
             code='120001',
@@ -2013,7 +2275,7 @@ def create_customer_invoice_journal_entry(invoice):
         db.session.commit()
 
     # حساب الإيرادات الإضافية
-    revenue_account = Account.query.filter_by(code='410004').first()
+    revenue_account = get_account_by_code('410004')
     if not revenue_account:
         revenue_account = Account(
             code='410004',
@@ -2033,17 +2295,7 @@ def create_customer_invoice_journal_entry(invoice):
         return None
 
     # إنشاء رقم قيد فريد
-    last_entry = JournalEntry.query.order_by(JournalEntry.entry_number.desc()).first()
-    if last_entry and last_entry.entry_number and last_entry.entry_number.startswith('JE-'):
-        try:
-            last_num = int(last_entry.entry_number.split('-')[1])
-            new_num = last_num + 1
-        except:
-            new_num = 1
-    else:
-        new_num = 1
-
-    entry_number = f"JE-{invoice.invoice_date.year}-{str(new_num).zfill(5)}"
+    entry_number = get_next_entry_number()
 
     # وصف الفاتورة
     company_name = invoice.contract.company.name if invoice.contract and invoice.contract.company else "عميل"
@@ -2104,7 +2356,7 @@ def create_customer_payment_journal_entry(invoice, paid_amount, payment_method):
 
     # حساب البنك أو الصندوق
     if payment_method == 'bank_transfer':
-        bank_account = Account.query.filter_by(code='110002').first()
+        bank_account = get_account_by_code('110002')
         if not bank_account:
             bank_account = Account(
                 code='110002',
@@ -2117,7 +2369,7 @@ def create_customer_payment_journal_entry(invoice, paid_amount, payment_method):
             )
             db.session.add(bank_account)
     else:
-        bank_account = Account.query.filter_by(code='110001').first()
+        bank_account = get_account_by_code('110001')
         if not bank_account:
             bank_account = Account(
                 code='110001',
@@ -2131,7 +2383,7 @@ def create_customer_payment_journal_entry(invoice, paid_amount, payment_method):
             db.session.add(bank_account)
 
     # حساب العملاء
-    customers = Account.query.filter_by(code='120001').first()
+    customers = get_account_by_code('120001')
     if not customers:
         customers = Account(
             code='120001',
@@ -2148,17 +2400,7 @@ def create_customer_payment_journal_entry(invoice, paid_amount, payment_method):
 
     # إنشاء رقم قيد فريد
     today = datetime.now().date()
-    last_entry = JournalEntry.query.order_by(JournalEntry.entry_number.desc()).first()
-    if last_entry and last_entry.entry_number and last_entry.entry_number.startswith('JE-'):
-        try:
-            last_num = int(last_entry.entry_number.split('-')[1])
-            new_num = last_num + 1
-        except:
-            new_num = 1
-    else:
-        new_num = 1
-
-    entry_number = f"JE-{today.year}-{str(new_num).zfill(5)}"
+    entry_number = get_next_entry_number()
 
     # إنشاء القيد المحاسبي
     journal_entry = JournalEntry(
@@ -2210,7 +2452,7 @@ def create_company_payment_journal_entry(payment):
     from flask_login import current_user
 
     # حساب المصروفات
-    expense_account = Account.query.filter_by(code='520001').first()
+    expense_account = get_account_by_code('520001')
     if not expense_account:
         expense_account = Account(
             code='520001',
@@ -2225,7 +2467,7 @@ def create_company_payment_journal_entry(payment):
 
     # حساب البنك أو الصندوق
     if payment.payment_method == 'cash':
-        bank_account = Account.query.filter_by(code='110001').first()
+        bank_account = get_account_by_code('110001')
         if not bank_account:
             bank_account = Account(
                 code='110001',
@@ -2238,7 +2480,7 @@ def create_company_payment_journal_entry(payment):
             )
             db.session.add(bank_account)
     else:
-        bank_account = Account.query.filter_by(code='110002').first()
+        bank_account = get_account_by_code('110002')
         if not bank_account:
             bank_account = Account(
                 code='110002',
@@ -2254,17 +2496,7 @@ def create_company_payment_journal_entry(payment):
     db.session.commit()
 
     # إنشاء رقم قيد فريد
-    last_entry = JournalEntry.query.order_by(JournalEntry.entry_number.desc()).first()
-    if last_entry and last_entry.entry_number and last_entry.entry_number.startswith('JE-'):
-        try:
-            last_num = int(last_entry.entry_number.split('-')[1])
-            new_num = last_num + 1
-        except:
-            new_num = 1
-    else:
-        new_num = 1
-
-    entry_number = f"JE-{payment.payment_date.year}-{str(new_num).zfill(5)}"
+    entry_number = get_next_entry_number()
 
     # إنشاء القيد المحاسبي
     journal_entry = JournalEntry(
@@ -2305,6 +2537,172 @@ def create_company_payment_journal_entry(payment):
     return journal_entry
 
 
+# ==================== دليل الحسابات (فهرس في الذاكرة) ====================
+
+# يُتحقق من تغيّر الدليل في العمليات الأخرى عبر بصمة خفيفة (العدد وآخر updated_at)
+CHART_CACHE_CHECK_SECONDS = 30
+
+_chart_cache = {'index': None, 'version': None, 'checked_at': 0.0}
+_chart_cache_lock = threading.Lock()
+
+
+class ChartOfAccountsIndex:
+    """فهرس الحسابات حسب المعرف والرقم مع شجرة الأب ← الأبناء"""
+
+    def __init__(self, rows):
+        self.by_id = {row.id: row for row in rows}
+        self.by_code = {row.code: row for row in rows}
+        self.children = {}
+        for row in sorted(rows, key=lambda r: r.code or ''):
+            self.children.setdefault(row.parent_id, []).append(row.id)
+
+
+class AccountNode:
+    """حساب في شجرة العرض مع رصيده ورصيد فروعه"""
+
+    def __init__(self, row, level, balance):
+        self.id = row.id
+        self.code = row.code
+        self.name = row.name
+        self.name_ar = row.name_ar
+        self.account_type = row.account_type
+        self.nature = row.nature
+        self.parent_id = row.parent_id
+        self.is_active = row.is_active
+        self.opening_balance = row.opening_balance
+        self.level = level
+        self.balance = balance
+        self.subtree_balance = balance
+        self.children = []
+
+    def get_balance(self, as_of_date=None):
+        return self.balance
+
+
+def _chart_version():
+    from models import Account
+    from sqlalchemy import func
+
+    return db.session.query(func.count(Account.id), func.max(Account.updated_at)).one()
+
+
+def get_chart_index():
+    """فهرس دليل الحسابات من الذاكرة المؤقتة (يُعاد تحميله عند تغيّر الدليل)"""
+    from models import Account
+
+    now = time.monotonic()
+    with _chart_cache_lock:
+        index = _chart_cache['index']
+        if index is not None and now - _chart_cache['checked_at'] < CHART_CACHE_CHECK_SECONDS:
+            return index
+
+        version = _chart_version()
+        if index is None or version != _chart_cache['version']:
+            index = ChartOfAccountsIndex(db.session.query(
+                Account.id, Account.code, Account.name, Account.name_ar, Account.account_type,
+                Account.nature, Account.parent_id, Account.is_active, Account.opening_balance
+            ).all())
+
+        _chart_cache.update(index=index, version=version, checked_at=now)
+        return index
+
+
+def invalidate_chart_of_accounts():
+    """إلغاء فهرس الحسابات بعد إضافة/تعديل/حذف/تفعيل حساب"""
+    with _chart_cache_lock:
+        _chart_cache.update(index=None, version=None, checked_at=0.0)
+
+
+def _session_changed_accounts(session):
+    from models import Account
+
+    return session.info.get('accounts_changed') or any(isinstance(obj, Account) for obj in session.new)
+
+
+def get_account_by_code(code, active_only=False):
+    """
+    الحصول على حساب برقمه عبر الفهرس (بدون استعلام بالرقم)
+
+    الحساب يُعاد من identity map للجلسة؛ وعند عدم وجوده في الفهرس أو وجود
+    تعديلات على الحسابات في الجلسة الحالية يُستعلم من قاعدة البيانات مباشرة.
+    """
+    from models import Account
+
+    if not code:
+        return None
+
+    session = db.session()
+    changed = _session_changed_accounts(session)
+    if not changed:
+        row = get_chart_index().by_code.get(code)
+        if row is not None:
+            if active_only and not row.is_active:
+                return None
+            account = session.get(Account, row.id)
+            if account is not None and account.code == code:
+                return account
+        elif code in session.info.get('missing_account_codes', ()):
+            return None
+
+    query = Account.query.filter_by(code=code)
+    if active_only:
+        query = query.filter_by(is_active=True)
+    account = query.first()
+    if account is None and not changed:
+        # الرقم غير موجود: لا يُعاد الاستعلام عنه حتى نهاية المعاملة
+        session.info.setdefault('missing_account_codes', set()).add(code)
+    return account
+
+
+def build_account_tree(balances=None, active_only=True):
+    """
+    شجرة دليل الحسابات من الفهرس مع الرصيد ومجموع الفروع لكل حساب
+
+    Args:
+        balances: {account_id: رصيد} (مثلاً من get_accounts_balances)
+        active_only: الحسابات النشطة فقط (الفرع النشط تحت أب غير نشط لا يظهر)
+    """
+    index = get_chart_index()
+    balances = balances or {}
+
+    def build(parent_id, level):
+        nodes = []
+        for account_id in index.children.get(parent_id, ()):
+            row = index.by_id[account_id]
+            if active_only and not row.is_active:
+                continue
+            node = AccountNode(row, level, balances.get(account_id, 0))
+            node.children = build(account_id, level + 1)
+            node.subtree_balance += sum(child.subtree_balance for child in node.children)
+            nodes.append(node)
+        return nodes
+
+    return build(None, 0)
+
+
+@event.listens_for(db.orm.Session, 'after_flush')
+def _chart_after_flush(session, flush_context):
+    from models import Account
+
+    if any(isinstance(obj, Account)
+           for obj in list(session.new) + list(session.dirty) + list(session.deleted)):
+        session.info['accounts_changed'] = True
+
+
+@event.listens_for(db.orm.Session, 'after_commit')
+def _chart_after_commit(session):
+    session.info.pop('missing_account_codes', None)
+    if session.info.pop('accounts_changed', False):
+        invalidate_chart_of_accounts()
+
+
+@event.listens_for(db.orm.Session, 'after_soft_rollback')
+def _chart_after_rollback(session, previous_transaction):
+    if not session.in_transaction():
+        session.info.pop('missing_account_codes', None)
+        session.info.pop('accounts_changed', None)
+
+
 # ==================== دوال مساعدة للتحقق من الحسابات ====================
 def ensure_accounts_exist():
     """التأكد من وجود جميع الحسابات المحاسبية الأساسية"""
@@ -2361,7 +2759,7 @@ def ensure_accounts_exist():
 
     created_count = 0
     for code, name, name_ar, account_type, nature in accounts:
-        existing = Account.query.filter_by(code=code).first()
+        existing = get_account_by_code(code)
         if not existing:
             account = Account(
                 code=code,
@@ -2383,37 +2781,57 @@ def ensure_accounts_exist():
 
     return created_count
 
-def get_next_entry_number():
-    """الحصول على رقم القيد التالي بشكل فريد وآمن"""
-    from models import JournalEntry
-    from datetime import datetime
+# ==================== ترقيم المستندات ====================
+
+# تنسيق الرقم لكل بادئة
+DOCUMENT_NUMBER_FORMATS = {
+    'JE': '{prefix}-{year}-{number:05d}',
+    'REV': '{prefix}-{year}-{number:05d}',
+    'INV': '{prefix}-{year}-{number:05d}',
+    'SI': '{prefix}-{date:%Y%m%d}-{number:03d}',
+}
+
+
+def _document_number_seed(prefix, year):
+    """آخر رقم مستخدم فعلياً قبل إنشاء العداد (يُستدعى مرة واحدة لكل بادئة وسنة)"""
+    from models import JournalEntry, SupplierInvoice, Invoice
     from sqlalchemy import func
 
-    current_year = datetime.now().year
+    columns = {
+        'JE': JournalEntry.entry_number,
+        'REV': JournalEntry.entry_number,
+        'SI': SupplierInvoice.invoice_number,
+        'INV': Invoice.invoice_number,
+    }
+    column = columns.get(prefix)
+    if column is None:
+        return 0
+    last = db.session.query(func.max(column)).filter(column.like(f'{prefix}-{year}%')).scalar()
+    try:
+        return int(last.rsplit('-', 1)[1]) if last else 0
+    except (IndexError, ValueError):
+        return 0
+
 
-    # ✅ 1. البحث عن أكبر رقم تسلسلي موجود فعليًا
-    result = db.session.query(
-        func.max(JournalEntry.entry_number)
-    ).filter(
-        JournalEntry.entry_number.like(f'JE-{current_year}-%')
-    ).scalar()
-
-    if result:
-        try:
-            # استخراج الجزء الرقمي من JE-2026-00001
-            last_num = int(result.split('-')[2])
-            new_num = last_num + 1
-        except (IndexError, ValueError):
-            new_num = 1
-    else:
-        new_num = 1
+def next_document_numbers(prefix, count=1, doc_date=None):
+    """حجز عدة أرقام مستندات متتالية دفعة واحدة"""
+    from models import DocumentSequence
+
+    doc_date = doc_date or datetime.now().date()
+    year = doc_date.year
+    first = DocumentSequence.allocate(prefix, year, count, seed=lambda: _document_number_seed(prefix, year))
+    fmt = DOCUMENT_NUMBER_FORMATS.get(prefix, '{prefix}-{year}-{number:05d}')
+    return [fmt.format(prefix=prefix, year=year, date=doc_date, number=first + i) for i in range(count)]
 
-    # ✅ 2. حلقة أمان للتأكد من أن الرقم الجديد غير موجود مسبقًا
-    while True:
-        candidate_number = f"JE-{current_year}-{str(new_num).zfill(5)}"
-        if not JournalEntry.query.filter_by(entry_number=candidate_number).first():
-            return candidate_number
-        new_num += 1  # جرب الرقم التالي إذا كان موجودًا
+
+def next_document_number(prefix, doc_date=None):
+    """الحصول على رقم المستند التالي (JE / REV / SI / INV)"""
+    return next_document_numbers(prefix, 1, doc_date)[0]
+
+
+def get_next_entry_number():
+    """الحصول على رقم القيد التالي بشكل فريد وآمن"""
+    return next_document_number('JE')
 
 def create_management_salary_transfer():
     """
@@ -2547,55 +2965,200 @@ def check_existing_transfer(payroll_type, company_id=None, region=None, start_da
 
 # ==================== دوال ترحيل الرواتب المفصولة ====================
 
-def transfer_admin_payroll(company_id, period_name, start_date, end_date, created_by=1):
+def get_period_transfer_employees(payroll_type, company_id=None, region=None):
     """
-    ترحيل رواتب الإدارة فقط (شركة واحدة)
+    الموظفون النشطون المشمولون بترحيل فترة حسب نوع الراتب والفلتر
 
     Args:
-        company_id: معرف الشركة
-        period_name: اسم الفترة (مثال: رواتب إبريل 2026)
-        start_date: تاريخ البداية
-        end_date: تاريخ النهاية
-        created_by: معرف المستخدم المنشئ
+        payroll_type: 'admin' (admin, supervisor) أو 'labor' (worker)
+        company_id: معرف الشركة (اختياري)
+        region: المنطقة (اختياري - عند عدم تحديد الشركة)
 
     Returns:
-        dict: نتيجة العملية
+        list: قائمة الموظفين
     """
-    from models import db, AttendancePeriodTransfer, AttendancePeriodTransferDetail, Employee
+    from models import Employee
 
-    # التحقق من وجود ترحيل مسبق لنفس الفترة والنوع
-    existing = check_existing_transfer(
-        payroll_type='admin',
-        company_id=company_id,
-        start_date=start_date,
-        end_date=end_date
-    )
+    query = Employee.query.filter(Employee.is_active == True)
 
-    if existing:
-        return {
-            'success': False,
-            'message': f'❌ يوجد ترحيل مسبق: {existing.period_name} - {existing.get_payroll_type_name()}',
-            'existing_transfer': existing
-        }
+    if payroll_type == 'admin':
+        query = query.filter(Employee.employee_type.in_(['admin', 'supervisor']))
+    else:
+        query = query.filter(Employee.employee_type == 'worker')
 
-    # جلب موظفي الإدارة فقط (admin, supervisor)
-    admin_employees = Employee.query.filter(
-        Employee.is_active == True,
-        Employee.company_id == company_id,
-        Employee.employee_type.in_(['admin', 'supervisor'])
-    ).all()
+    if company_id:
+        query = query.filter(Employee.company_id == company_id)
+    elif region:
+        query = query.filter(Employee.region == region)
 
-    if not admin_employees:
-        return {
-            'success': False,
-            'message': '⚠️ لا يوجد موظفين إدارة في هذه الشركة',
-            'employees_found': 0
+    return query.all()
+
+
+def _admin_transfer_amounts(employee, summary, overtime_hours):
+    """مبالغ الحضور والإضافي وخصم الغياب لموظف إدارة"""
+    daily_rate = employee.salary / 30 if employee.salary else 0
+    hourly_rate = daily_rate / 8
+
+    return {
+        'base_salary': employee.salary or 0,
+        'attendance_amount': daily_rate * summary['attendance_days'],
+        'overtime_amount': overtime_hours * (hourly_rate * 1.5),
+        'absence_deduction': daily_rate * summary['absent_days'],
+    }
+
+
+def _labor_transfer_amounts(employee, summary, overtime_hours):
+    """مبالغ الحضور والإضافي وخصم الغياب لعامل حسب نظام العمل"""
+    work_type = getattr(employee, 'work_type', 'daily')
+    daily_wage = getattr(employee, 'daily_wage', 50)
+    hourly_rate = getattr(employee, 'hourly_rate', daily_wage / 8)
+
+    if work_type == 'daily':
+        attendance_amount = daily_wage * summary['attendance_days']
+    elif work_type == 'hourly':
+        attendance_amount = hourly_rate * (summary['attendance_days'] * 8)
+    else:  # piece
+        attendance_amount = getattr(employee, 'piece_rate', 0) * getattr(employee, 'pieces_count', 0)
+
+    # الإضافي (1.5 × الأجر العادي للساعة)
+    return {
+        'work_type': work_type,
+        'base_salary': attendance_amount,
+        'attendance_amount': attendance_amount,
+        'overtime_amount': overtime_hours * (daily_wage / 8 * 1.5),
+        'absence_deduction': daily_wage * summary['absent_days'],
+    }
+
+
+def build_period_transfer_details(transfer, employees):
+    """
+    إنشاء تفاصيل ترحيل فترة لمجموعة موظفين دفعة واحدة
+
+    ملخصات الحضور والمعاملات غير المسواة والإضافي تُجلب باستعلامات مجمّعة
+    للفترة كاملة، والتفاصيل تُدرج دفعة واحدة، وإجماليات الترحيل تُحسب
+    في نفس المرور. لا يتم الحفظ (commit) هنا.
+
+    Args:
+        transfer: ترحيل الفترة (AttendancePeriodTransfer) بعد flush
+        employees: قائمة الموظفين
+
+    Returns:
+        list: ملخص لكل موظف (الاسم، أيام الحضور، المبلغ النهائي)
+    """
+    from models import AttendancePeriodTransferDetail
+
+    employees = list(employees)
+    start_date, end_date = transfer.start_date, transfer.end_date
+    is_admin = transfer.payroll_type == 'admin'
+    compute_amounts = _admin_transfer_amounts if is_admin else _labor_transfer_amounts
+    notes = f'ترحيل آلي لرواتب {"الإدارة" if is_admin else "العمال"} - {transfer.period_name}'
+
+    summaries = get_employees_attendance_summaries(employees, start_date, end_date)
+    transactions_by_employee = get_employees_unsettled_totals([emp.id for emp in employees])
+    overtime_by_employee = get_employees_overtime_hours(employees, start_date, end_date)
+
+    rows = []
+    details = []
+    total_attendance_days = total_salaries = total_deductions = total_net = 0
+    for employee in employees:
+        summary = summaries[employee.id]
+        transactions = transactions_by_employee[employee.id]
+        overtime_hours = overtime_by_employee[employee.id]
+        amounts = compute_amounts(employee, summary, overtime_hours)
+
+        daily_allowance = get_employee_daily_allowance(employee, summary['attendance_days'])
+        advance_amount = transactions.get('advance', 0)
+        deduction_amount = transactions.get('deduction', 0)
+        penalty_amount = transactions.get('penalty', 0)
+
+        total_additions = amounts['attendance_amount'] + amounts['overtime_amount'] + daily_allowance
+        deductions = amounts['absence_deduction'] + advance_amount + deduction_amount + penalty_amount
+        final_amount = total_additions - deductions
+
+        rows.append({
+            'transfer_id': transfer.id,
+            'employee_id': employee.id,
+            'attendance_days': summary['attendance_days'],
+            'absent_days': summary['absent_days'],
+            'sick_days': summary['sick_days'],
+            'late_minutes_total': summary['late_minutes_total'],
+            'overtime_hours': overtime_hours,
+            'daily_allowance': daily_allowance,
+            'base_salary': amounts['base_salary'],
+            'attendance_amount': amounts['attendance_amount'],
+            'overtime_amount': amounts['overtime_amount'],
+            'daily_allowance_amount': daily_allowance,
+            'advance_amount': advance_amount,
+            'deduction_amount': deduction_amount,
+            'penalty_amount': penalty_amount,
+            'absence_deduction': amounts['absence_deduction'],
+            'total_additions': total_additions,
+            'total_deductions': deductions,
+            'final_amount': final_amount,
+            'is_processed': False,
+            'notes': notes,
+        })
+
+        detail = {
+            'employee_name': employee.name,
+            'attendance_days': summary['attendance_days'],
+            'final_amount': final_amount
         }
+        if not is_admin:
+            detail['work_type'] = amounts['work_type']
+        details.append(detail)
+
+        total_attendance_days += summary['attendance_days']
+        total_salaries += amounts['base_salary']
+        total_deductions += deductions
+        total_net += final_amount
+
+    if rows:
+        db.session.execute(db.insert(AttendancePeriodTransferDetail), rows)
+    db.session.expire(transfer, ['transfers_details'])
+
+    # تحديث إحصائيات الترحيل
+    transfer.total_employees = len(rows)
+    transfer.total_attendance_days = total_attendance_days
+    transfer.total_salaries = total_salaries
+    transfer.total_deductions = total_deductions
+    transfer.total_net = total_net
+
+    return details
+
+
+def rebuild_period_transfer(transfer):
+    """
+    إعادة حساب تفاصيل ترحيل فترة لم يُرحَّل بعد (حذف التفاصيل وإعادة إنشائها)
+
+    Returns:
+        int or None: عدد الموظفين، أو None إذا لم يوجد موظفون في الفلتر
+    """
+    from models import AttendancePeriodTransferDetail
+
+    employees = get_period_transfer_employees(transfer.payroll_type, transfer.company_id, transfer.region)
+    if not employees:
+        return None
+
+    AttendancePeriodTransferDetail.query.filter_by(
+        transfer_id=transfer.id
+    ).delete(synchronize_session=False)
+
+    return len(build_period_transfer_details(transfer, employees))
+
+
+def _create_payroll_transfer(payroll_type, company_id, period_name, start_date, end_date, created_by):
+    """إنشاء ترحيل فترة لنوع راتب وشركة مع تفاصيله (مشترك بين الإدارة والعمال)"""
+    from models import AttendancePeriodTransfer
+
+    employees = get_period_transfer_employees(payroll_type, company_id)
+    if not employees:
+        return None, []
 
     # إنشاء ترحيل جديد
     transfer = AttendancePeriodTransfer(
         period_name=period_name,
-        payroll_type='admin',
+        payroll_type=payroll_type,
         start_date=start_date,
         end_date=end_date,
         transfer_date=datetime.now().date(),
@@ -2606,78 +3169,51 @@ def transfer_admin_payroll(company_id, period_name, start_date, end_date, create
     db.session.add(transfer)
     db.session.flush()
 
-    # إضافة تفاصيل الترحيل لكل موظف
-    details_added = []
-    for employee in admin_employees:
-        # حساب إحصائيات الحضور للموظف
-        summary = get_employee_attendance_summary(employee, start_date, end_date)
-
-        # الحصول على المعاملات المالية غير المسواة
-        transactions = employee.get_unsettled_transactions_total()
-
-        # حساب قيم الخصومات
-        advance_amount = transactions.get('advance', 0)
-        deduction_amount = transactions.get('deduction', 0)
-        penalty_amount = transactions.get('penalty', 0)
+    details_added = build_period_transfer_details(transfer, employees)
+    db.session.commit()
 
-        # حساب خصم الغياب (مع مراعاة أيام الغياب فقط)
-        daily_rate = employee.salary / 30 if employee.salary else 0
-        absence_deduction = daily_rate * summary['absent_days']
+    return transfer, details_added
 
-        # حساب مبلغ الحضور
-        attendance_amount = daily_rate * summary['attendance_days']
 
-        # حساب البدل اليومي (للساكنين)
-        daily_allowance = get_employee_daily_allowance(employee, summary['attendance_days'])
+def transfer_admin_payroll(company_id, period_name, start_date, end_date, created_by=1):
+    """
+    ترحيل رواتب الإدارة فقط (شركة واحدة)
 
-        # حساب ساعات الإضافي والمبلغ
-        overtime_hours = get_employee_overtime_hours(employee, start_date, end_date)
-        hourly_rate = daily_rate / 8
-        overtime_amount = overtime_hours * (hourly_rate * 1.5)
+    Args:
+        company_id: معرف الشركة
+        period_name: اسم الفترة (مثال: رواتب إبريل 2026)
+        start_date: تاريخ البداية
+        end_date: تاريخ النهاية
+        created_by: معرف المستخدم المنشئ
 
-        # حساب الإجماليات
-        total_additions = attendance_amount + daily_allowance + overtime_amount
-        total_deductions = absence_deduction + advance_amount + deduction_amount + penalty_amount
-        final_amount = total_additions - total_deductions
+    Returns:
+        dict: نتيجة العملية
+    """
+    # التحقق من وجود ترحيل مسبق لنفس الفترة والنوع
+    existing = check_existing_transfer(
+        payroll_type='admin',
+        company_id=company_id,
+        start_date=start_date,
+        end_date=end_date
+    )
 
-        detail = AttendancePeriodTransferDetail(
-            transfer_id=transfer.id,
-            employee_id=employee.id,
-            attendance_days=summary['attendance_days'],
-            absent_days=summary['absent_days'],
-            sick_days=summary['sick_days'],
-            late_minutes_total=summary['late_minutes_total'],
-            overtime_hours=overtime_hours,
-            daily_allowance=daily_allowance,
-            base_salary=employee.salary or 0,
-            attendance_amount=attendance_amount,
-            overtime_amount=overtime_amount,
-            daily_allowance_amount=daily_allowance,
-            advance_amount=advance_amount,
-            deduction_amount=deduction_amount,
-            penalty_amount=penalty_amount,
-            absence_deduction=absence_deduction,
-            total_additions=total_additions,
-            total_deductions=total_deductions,
-            final_amount=final_amount,
-            is_processed=False,
-            notes=f'ترحيل آلي لرواتب الإدارة - {period_name}'
-        )
-        db.session.add(detail)
-        details_added.append({
-            'employee_name': employee.name,
-            'attendance_days': summary['attendance_days'],
-            'final_amount': final_amount
-        })
+    if existing:
+        return {
+            'success': False,
+            'message': f'❌ يوجد ترحيل مسبق: {existing.period_name} - {existing.get_payroll_type_name()}',
+            'existing_transfer': existing
+        }
 
-    # تحديث إحصائيات الترحيل
-    transfer.total_employees = len(details_added)
-    transfer.total_attendance_days = sum(d.attendance_days for d in transfer.transfers_details)
-    transfer.total_salaries = sum(d.base_salary for d in transfer.transfers_details)
-    transfer.total_deductions = sum(d.total_deductions for d in transfer.transfers_details)
-    transfer.total_net = sum(d.final_amount for d in transfer.transfers_details)
+    transfer, details_added = _create_payroll_transfer(
+        'admin', company_id, period_name, start_date, end_date, created_by
+    )
 
-    db.session.commit()
+    if transfer is None:
+        return {
+            'success': False,
+            'message': '⚠️ لا يوجد موظفين إدارة في هذه الشركة',
+            'employees_found': 0
+        }
 
     return {
         'success': True,
@@ -2704,8 +3240,6 @@ def transfer_labor_payroll(company_id, period_name, start_date, end_date, create
     Returns:
         dict: نتيجة العملية
     """
-    from models import db, AttendancePeriodTransfer, AttendancePeriodTransferDetail, Employee
-
     # التحقق من وجود ترحيل مسبق لنفس الفترة والنوع
     existing = check_existing_transfer(
         payroll_type='labor',
@@ -2721,120 +3255,17 @@ def transfer_labor_payroll(company_id, period_name, start_date, end_date, create
             'existing_transfer': existing
         }
 
-    # جلب موظفي العمال فقط
-    labor_employees = Employee.query.filter(
-        Employee.is_active == True,
-        Employee.company_id == company_id,
-        Employee.employee_type == 'worker'
-    ).all()
+    transfer, details_added = _create_payroll_transfer(
+        'labor', company_id, period_name, start_date, end_date, created_by
+    )
 
-    if not labor_employees:
+    if transfer is None:
         return {
             'success': False,
             'message': '⚠️ لا يوجد عمال في هذه الشركة',
             'employees_found': 0
         }
 
-    # إنشاء ترحيل جديد
-    transfer = AttendancePeriodTransfer(
-        period_name=period_name,
-        payroll_type='labor',
-        start_date=start_date,
-        end_date=end_date,
-        transfer_date=datetime.now().date(),
-        company_id=company_id,
-        is_transferred=False,
-        created_at=datetime.utcnow()
-    )
-    db.session.add(transfer)
-    db.session.flush()
-
-    # إضافة تفاصيل الترحيل لكل عامل
-    details_added = []
-    for employee in labor_employees:
-        # حساب إحصائيات الحضور
-        summary = get_employee_attendance_summary(employee, start_date, end_date)
-
-        # الحصول على المعاملات المالية
-        transactions = employee.get_unsettled_transactions_total()
-
-        # حساب الراتب حسب نظام العمل
-        work_type = getattr(employee, 'work_type', 'daily')
-        daily_wage = getattr(employee, 'daily_wage', 50)
-        hourly_rate = getattr(employee, 'hourly_rate', daily_wage / 8)
-
-        if work_type == 'daily':
-            attendance_amount = daily_wage * summary['attendance_days']
-            base_salary = attendance_amount
-        elif work_type == 'hourly':
-            attendance_amount = hourly_rate * (summary['attendance_days'] * 8)
-            base_salary = attendance_amount
-        else:  # piece
-            piece_rate = getattr(employee, 'piece_rate', 0)
-            pieces_count = getattr(employee, 'pieces_count', 0)
-            attendance_amount = piece_rate * pieces_count
-            base_salary = attendance_amount
-
-        # حساب الإضافي (1.5 × الأجر العادي للساعة)
-        overtime_hours = get_employee_overtime_hours(employee, start_date, end_date)
-        hourly_rate = daily_wage / 8
-        overtime_amount = overtime_hours * (hourly_rate * 1.5)
-
-        # خصم الغياب
-        absence_deduction = daily_wage * summary['absent_days']
-
-        # الإضافات والخصومات
-        daily_allowance = get_employee_daily_allowance(employee, summary['attendance_days'])
-
-        advance_amount = transactions.get('advance', 0)
-        deduction_amount = transactions.get('deduction', 0)
-        penalty_amount = transactions.get('penalty', 0)
-
-        # الإجماليات
-        total_additions = attendance_amount + overtime_amount + daily_allowance
-        total_deductions = absence_deduction + advance_amount + deduction_amount + penalty_amount
-        final_amount = total_additions - total_deductions
-
-        detail = AttendancePeriodTransferDetail(
-            transfer_id=transfer.id,
-            employee_id=employee.id,
-            attendance_days=summary['attendance_days'],
-            absent_days=summary['absent_days'],
-            sick_days=summary['sick_days'],
-            late_minutes_total=summary['late_minutes_total'],
-            overtime_hours=overtime_hours,
-            daily_allowance=daily_allowance,
-            base_salary=base_salary,
-            attendance_amount=attendance_amount,
-            overtime_amount=overtime_amount,
-            daily_allowance_amount=daily_allowance,
-            advance_amount=advance_amount,
-            deduction_amount=deduction_amount,
-            penalty_amount=penalty_amount,
-            absence_deduction=absence_deduction,
-            total_additions=total_additions,
-            total_deductions=total_deductions,
-            final_amount=final_amount,
-            is_processed=False,
-            notes=f'ترحيل آلي لرواتب العمال - {period_name}'
-        )
-        db.session.add(detail)
-        details_added.append({
-            'employee_name': employee.name,
-            'work_type': work_type,
-            'attendance_days': summary['attendance_days'],
-            'final_amount': final_amount
-        })
-
-    # تحديث إحصائيات الترحيل
-    transfer.total_employees = len(details_added)
-    transfer.total_attendance_days = sum(d.attendance_days for d in transfer.transfers_details)
-    transfer.total_salaries = sum(d.base_salary for d in transfer.transfers_details)
-    transfer.total_deductions = sum(d.total_deductions for d in transfer.transfers_details)
-    transfer.total_net = sum(d.final_amount for d in transfer.transfers_details)
-
-    db.session.commit()
-
     return {
         'success': True,
         'message': f'✅ تم ترحيل رواتب العمال بنجاح ({len(details_added)} عامل)',
@@ -3264,15 +3695,15 @@ def create_labor_salary_journal_entry(salary_calculation):
     summary = salary_calculation['summary']
 
     # البحث عن الحسابات
-    basic_salary_expense = Account.query.filter_by(code='511001').first()
-    resident_allowance_expense = Account.query.filter_by(code='511002').first()
-    insurance_expense = Account.query.filter_by(code='511003').first()
-    clothing_expense = Account.query.filter_by(code='511004').first()
-    health_expense = Account.query.filter_by(code='511005').first()
+    basic_salary_expense = get_account_by_code('511001')
+    resident_allowance_expense = get_account_by_code('511002')
+    insurance_expense = get_account_by_code('511003')
+    clothing_expense = get_account_by_code('511004')
+    health_expense = get_account_by_code('511005')
 
-    salaries_payable = Account.query.filter_by(code='211001').first()
-    allowances_payable = Account.query.filter_by(code='211002').first()
-    insurance_payable = Account.query.filter_by(code='211003').first()
+    salaries_payable = get_account_by_code('211001')
+    allowances_payable = get_account_by_code('211002')
+    insurance_payable = get_account_by_code('211003')
 
     # التأكد من وجود الحسابات
     if not all([basic_salary_expense, resident_allowance_expense, insurance_expense,
@@ -3280,14 +3711,14 @@ def create_labor_salary_journal_entry(salary_calculation):
         # إنشاء الحسابات إذا لم تكن موجودة
         create_labor_accounts()
         # إعادة المحاولة
-        basic_salary_expense = Account.query.filter_by(code='511001').first()
-        resident_allowance_expense = Account.query.filter_by(code='511002').first()
-        insurance_expense = Account.query.filter_by(code='511003').first()
-        clothing_expense = Account.query.filter_by(code='511004').first()
-        health_expense = Account.query.filter_by(code='511005').first()
-        salaries_payable = Account.query.filter_by(code='211001').first()
-        allowances_payable = Account.query.filter_by(code='211002').first()
-        insurance_payable = Account.query.filter_by(code='211003').first()
+        basic_salary_expense = get_account_by_code('511001')
+        resident_allowance_expense = get_account_by_code('511002')
+        insurance_expense = get_account_by_code('511003')
+        clothing_expense = get_account_by_code('511004')
+        health_expense = get_account_by_code('511005')
+        salaries_payable = get_account_by_code('211001')
+        allowances_payable = get_account_by_code('211002')
+        insurance_payable = get_account_by_code('211003')
 
     month_year = salary_calculation['month_year']
     entry_number = get_next_entry_number()
@@ -3381,17 +3812,17 @@ def create_contractor_annual_journal_entry(year, company_id):
         db.session.commit()
 
     # البحث عن الحسابات
-    tax_expense = Account.query.filter_by(code='521001').first()
-    zakat_expense = Account.query.filter_by(code='521002').first()
-    tax_payable = Account.query.filter_by(code='221001').first()
-    zakat_payable = Account.query.filter_by(code='221002').first()
+    tax_expense = get_account_by_code('521001')
+    zakat_expense = get_account_by_code('521002')
+    tax_payable = get_account_by_code('221001')
+    zakat_payable = get_account_by_code('221002')
 
     if not all([tax_expense, zakat_expense, tax_payable, zakat_payable]):
         create_labor_accounts()
-        tax_expense = Account.query.filter_by(code='521001').first()
-        zakat_expense = Account.query.filter_by(code='521002').first()
-        tax_payable = Account.query.filter_by(code='221001').first()
-        zakat_payable = Account.query.filter_by(code='221002').first()
+        tax_expense = get_account_by_code('521001')
+        zakat_expense = get_account_by_code('521002')
+        tax_payable = get_account_by_code('221001')
+        zakat_payable = get_account_by_code('221002')
 
     entry_number = get_next_entry_number()
 
@@ -3485,9 +3916,9 @@ def create_contractor_liability_journal_entry(year, company_id):
         return {'success': False, 'message': f'لا توجد تكاليف مسجلة لسنة {year}'}
 
     # البحث عن الحسابات
-    tax_payable = Account.query.filter_by(code='221001').first()
-    zakat_payable = Account.query.filter_by(code='221002').first()
-    bank_account = Account.query.filter_by(code='110002').first()  # البنك
+    tax_payable = get_account_by_code('221001')
+    zakat_payable = get_account_by_code('221002')
+    bank_account = get_account_by_code('110002')  # البنك
 
     if not all([tax_payable, zakat_payable, bank_account]):
         return {'success': False, 'message': 'الحسابات المحاسبية غير مهيأة بشكل صحيح'}
@@ -3608,6 +4039,69 @@ def calculate_worker_salary_breakdown(employee, attendance_days):
     }
 
 
+def calculate_employees_salary_breakdowns(employees, attendance_days, paid_leave_days=None):
+    """
+    توزيع الراتب لقائمة موظفين - قائمة dict بنفس ترتيب الموظفين
+
+    إعدادات النظام تُقرأ مرة واحدة للدفعة؛ Employee.calculate_salary_breakdown
+    يستدعيها لموظف واحد فالمعادلات في مكان واحد.
+
+    Args:
+        employees: الموظفون (salary, total_salary, is_resident)
+        attendance_days, paid_leave_days: قوائم بنفس طول employees
+    """
+    MONTHLY_DAYS = 30
+
+    if paid_leave_days is None:
+        paid_leave_days = [0] * len(employees)
+
+    DAILY_RESIDENT = safe_float(get_system_setting('daily_resident_allowance', 500))
+    MONTHLY_CLOTHING = safe_float(get_system_setting('monthly_clothing', 2033.33))
+    MONTHLY_HEALTH = safe_float(get_system_setting('monthly_health', 1250.00))
+    MONTHLY_INSURANCE = safe_float(get_system_setting('monthly_insurance', 10800.00))
+
+    breakdowns = []
+    for employee, attendance, leave in zip(employees, attendance_days, paid_leave_days):
+        basic_salary = safe_float(getattr(employee, 'salary', 60000), 60000)
+        total_salary = safe_float(getattr(employee, 'total_salary', basic_salary), basic_salary)
+
+        # النسبة من أيام الحضور والإجازات المدفوعة
+        attendance = max(0, attendance)
+        leave = max(0, leave)
+        total_paid_days = min(MONTHLY_DAYS, attendance + leave)
+        ratio = min(1.0, total_paid_days / MONTHLY_DAYS) if total_paid_days > 0 else 0.0
+
+        # الراتب اليومي وبدل السكن
+        daily_rate = basic_salary / MONTHLY_DAYS
+        basic_payout = daily_rate * total_paid_days
+        resident_payout = DAILY_RESIDENT * total_paid_days if getattr(employee, 'is_resident', False) else 0.0
+
+        # تكاليف الشركة وربح المتعهد
+        clothing_payout = MONTHLY_CLOTHING * ratio
+        health_payout = MONTHLY_HEALTH * ratio
+        insurance_payout = MONTHLY_INSURANCE * ratio
+        contractor_profit = ((total_salary - basic_salary) * ratio) - (clothing_payout + health_payout + insurance_payout)
+
+        net_salary = basic_payout + resident_payout
+        breakdowns.append({
+            'attendance_days': attendance,
+            'total_paid_days': total_paid_days,
+            'ratio': round(ratio, 4),
+            'basic_salary': basic_salary,
+            'total_salary': total_salary,
+            'daily_rate': round(daily_rate, 2),
+            'basic_payout': round(basic_payout, 2),
+            'resident_allowance': round(resident_payout, 2),
+            'clothing_allowance': round(clothing_payout, 2),
+            'health_card': round(health_payout, 2),
+            'insurance': round(insurance_payout, 2),
+            'contractor_profit': round(contractor_profit, 2),
+            'cash_payout': round(net_salary, 2),
+            'net_salary': round(net_salary, 2)
+        })
+    return breakdowns
+
+
 def update_salary_with_breakdown(salary, breakdown):
     """تحديث كائن Salary بقيم التوزيع"""
     salary.basic_salary_amount = breakdown['basic_salary']
@@ -3623,15 +4117,54 @@ def update_salary_with_breakdown(salary, breakdown):
 
 # ==================== إعدادات النظام ====================
 
+# الإعدادات النشطة تُحمّل مرة واحدة لكل عملية، ويُتحقق من تغيّرها في العمليات
+# الأخرى (عمّال gunicorn) عبر بصمة خفيفة: عدد الصفوف وآخر updated_at
+SETTINGS_CACHE_CHECK_SECONDS = 30
 
-def get_system_setting(key, default=0):
-    """الحصول على قيمة إعداد من النظام"""
+_settings_cache = {'values': None, 'version': None, 'checked_at': 0.0}
+_settings_cache_lock = threading.Lock()
+
+
+def _system_settings_version():
+    """بصمة جدول الإعدادات للتحقق من التغيير دون تحميله"""
+    from models import SystemSettings
+    from sqlalchemy import func
+
+    count, last_update = db.session.query(
+        func.count(SystemSettings.id), func.max(SystemSettings.updated_at)
+    ).one()
+    return count, last_update
+
+
+def get_system_settings():
+    """جميع الإعدادات النشطة {setting_key: value} من الذاكرة المؤقتة"""
     from models import SystemSettings
 
-    setting = SystemSettings.query.filter_by(setting_key=key, is_active=True).first()
-    if setting:
-        return setting.value
-    return default
+    now = time.monotonic()
+    with _settings_cache_lock:
+        values = _settings_cache['values']
+        if values is not None and now - _settings_cache['checked_at'] < SETTINGS_CACHE_CHECK_SECONDS:
+            return values
+
+        version = _system_settings_version()
+        if values is None or version != _settings_cache['version']:
+            values = dict(db.session.query(SystemSettings.setting_key, SystemSettings.value).filter(
+                SystemSettings.is_active == True
+            ).all())
+
+        _settings_cache.update(values=values, version=version, checked_at=now)
+        return values
+
+
+def invalidate_system_settings_cache():
+    """إلغاء الإعدادات المحفوظة بعد أي تعديل عليها"""
+    with _settings_cache_lock:
+        _settings_cache.update(values=None, version=None, checked_at=0.0)
+
+
+def get_system_setting(key, default=0):
+    """الحصول على قيمة إعداد من النظام"""
+    return get_system_settings().get(key, default)
 
 
 def get_system_setting_object(key):
@@ -3649,13 +4182,13 @@ def init_default_settings():
 
     # الحصول على الحسابات المحاسبية
     accounts = {
-        'salary': Account.query.filter_by(code='511001').first(),
-        'resident': Account.query.filter_by(code='511002').first(),
-        'insurance': Account.query.filter_by(code='511003').first(),
-        'clothing': Account.query.filter_by(code='511004').first(),
-        'health': Account.query.filter_by(code='511005').first(),
-        'cafeteria': Account.query.filter_by(code='511009').first(),
-        'restaurant': Account.query.filter_by(code='511010').first(),
+        'salary': get_account_by_code('511001'),
+        'resident': get_account_by_code('511002'),
+        'insurance': get_account_by_code('511003'),
+        'clothing': get_account_by_code('511004'),
+        'health': get_account_by_code('511005'),
+        'cafeteria': get_account_by_code('511009'),
+        'restaurant': get_account_by_code('511010'),
     }
 
     default_settings = [
@@ -3708,6 +4241,7 @@ def init_default_settings():
             print(f"   ✅ تم إضافة: {data[1]} = {data[3]:,.2f}")
 
     db.session.commit()
+    invalidate_system_settings_cache()
     print(f"✅ تم تهيئة {created_count} إعداد افتراضي للنظام")
     return created_count
 
@@ -3716,7 +4250,7 @@ def get_or_create_account_by_code(code, name, name_ar, account_type, nature):
     """الحصول على حساب أو إنشاؤه إذا لم يكن موجوداً"""
     from models import Account, db
 
-    account = Account.query.filter_by(code=code).first()
+    account = get_account_by_code(code)
     if not account:
         account = Account(
             code=code,
@@ -3757,7 +4291,7 @@ def create_labor_accounts():
 
     created = 0
     for code, name, name_ar, account_type, nature in accounts:
-        if not Account.query.filter_by(code=code).first():
+        if not get_account_by_code(code):
             account = Account(
                 code=code, name=name, name_ar=name_ar,
                 account_type=account_type, nature=nature,
@@ -3768,4 +4302,839 @@ def create_labor_accounts():
 
     db.session.commit()
     print(f"✅ تم إنشاء {created} حساب للعمال")
-    return created
\ No newline at end of file
+    return created
+
+# ==================== القوائم المالية (استعلام واحد لكل الحسابات) ====================
+
+def get_accounts_balances(as_of_date=None, start_date=None, end_date=None, active_only=True, account_ids=None):
+    """
+    حساب مدين/دائن/رصيد جميع الحسابات في استعلام واحد مجمّع
+
+    Args:
+        as_of_date: الرصيد حتى تاريخ معين (شامل الرصيد الافتتاحي)
+        start_date, end_date: حركة الحسابات خلال فترة (بدون الرصيد الافتتاحي إذا حُدد start_date)
+        active_only: الحسابات النشطة فقط
+        account_ids: قصر الحساب على هذه الحسابات فقط
+
+    Returns:
+        قائمة مرتبة حسب رقم الحساب: {'account', 'debit', 'credit', 'balance', ...}
+    """
+    from models import Account, JournalEntry, JournalEntryDetail, TrialBalance, db
+    from sqlalchemy import func
+
+    upper = min([d for d in (as_of_date, end_date) if d], default=None)
+
+    # الأرصدة التراكمية تبدأ من آخر لقطة ميزان مراجعة (إقفال فترة) ثم تُضاف الحركة بعدها فقط
+    snapshot_date = None
+    if not start_date:
+        snapshot_date = db.session.query(func.max(TrialBalance.as_of_date))
+        if upper:
+            snapshot_date = snapshot_date.filter(TrialBalance.as_of_date <= upper)
+        snapshot_date = snapshot_date.scalar()
+
+    movements = db.session.query(
+        JournalEntryDetail.account_id.label('account_id'),
+        func.coalesce(func.sum(JournalEntryDetail.debit), 0).label('debit'),
+        func.coalesce(func.sum(JournalEntryDetail.credit), 0).label('credit'),
+    )
+    if account_ids is not None:
+        movements = movements.filter(JournalEntryDetail.account_id.in_(list(account_ids)))
+    if start_date or upper or snapshot_date:
+        movements = movements.join(JournalEntry, JournalEntry.id == JournalEntryDetail.entry_id)
+        if start_date:
+            movements = movements.filter(JournalEntry.date >= start_date)
+        if snapshot_date:
+            movements = movements.filter(JournalEntry.date > snapshot_date)
+        if upper:
+            movements = movements.filter(JournalEntry.date <= upper)
+    movements = movements.group_by(JournalEntryDetail.account_id).subquery()
+
+    columns = [Account, movements.c.debit, movements.c.credit]
+    if snapshot_date:
+        snapshot = db.session.query(TrialBalance).filter(TrialBalance.as_of_date == snapshot_date).subquery()
+        columns += [snapshot.c.account_id, snapshot.c.opening_balance, snapshot.c.debit, snapshot.c.credit]
+    query = db.session.query(*columns).outerjoin(movements, movements.c.account_id == Account.id)
+    if snapshot_date:
+        query = query.outerjoin(snapshot, snapshot.c.account_id == Account.id)
+    if active_only:
+        query = query.filter(Account.is_active == True)
+    if account_ids is not None:
+        query = query.filter(Account.id.in_(list(account_ids)))
+
+    include_opening = not start_date
+    rows = []
+    for account, debit, credit, *snap in query.order_by(Account.code).all():
+        debit = float(debit or 0)
+        credit = float(credit or 0)
+        opening = float(account.opening_balance or 0) if include_opening else 0.0
+        if snap and snap[0] is not None:
+            opening = float(snap[1] or 0)
+            debit += float(snap[2] or 0)
+            credit += float(snap[3] or 0)
+        if account.nature == 'debit':
+            balance = opening + debit - credit
+        else:
+            balance = opening + credit - debit
+        rows.append({
+            'account': account,
+            'id': account.id,
+            'code': account.code,
+            'name': account.name_ar or account.name,
+            'account_type': account.account_type,
+            'nature': account.nature,
+            'opening_balance': opening,
+            'debit': debit,
+            'credit': credit,
+            'balance': balance,
+        })
+    return rows
+
+
+def snapshot_trial_balance(as_of_date):
+    """
+    حفظ لقطة ميزان المراجعة لجميع الحسابات حتى تاريخ (عند إقفال فترة)
+
+    تقارير الأرصدة حتى هذا التاريخ أو بعده تبدأ من اللقطة بدلاً من جميع التفاصيل.
+    الحفظ (commit) على المستدعي.
+    """
+    from models import TrialBalance, db
+
+    rows = get_accounts_balances(as_of_date=as_of_date, active_only=False)
+    db.session.execute(db.delete(TrialBalance).where(TrialBalance.as_of_date == as_of_date))
+    now = datetime.utcnow()
+    if rows:
+        db.session.execute(db.insert(TrialBalance), [{
+            'as_of_date': as_of_date,
+            'account_id': row['id'],
+            'opening_balance': row['opening_balance'],
+            'debit': row['debit'],
+            'credit': row['credit'],
+            'closing_balance': row['balance'],
+            'created_at': now,
+        } for row in rows])
+    return len(rows)
+
+
+def build_trial_balance(rows):
+    """ميزان المراجعة من نتيجة get_accounts_balances"""
+    lines = []
+    total_debit = 0
+    total_credit = 0
+    for row in rows:
+        balance = row['balance']
+        if row['nature'] == 'debit':
+            debit, credit = (balance, 0) if balance >= 0 else (0, abs(balance))
+        else:
+            debit, credit = (0, balance) if balance >= 0 else (abs(balance), 0)
+        lines.append(dict(row, debit=debit, credit=credit))
+        total_debit += debit
+        total_credit += credit
+    return {
+        'lines': lines,
+        'total_debit': total_debit,
+        'total_credit': total_credit,
+        'is_balanced': abs(total_debit - total_credit) < 0.01,
+    }
+
+
+def build_income_statement(rows):
+    """قائمة الدخل من نتيجة get_accounts_balances"""
+    revenue = [row for row in rows if row['account_type'] == 'revenue']
+    expense = [row for row in rows if row['account_type'] == 'expense']
+    total_revenue = sum(row['balance'] for row in revenue)
+    total_expense = sum(row['balance'] for row in expense)
+    return {
+        'revenue': revenue,
+        'expense': expense,
+        'total_revenue': total_revenue,
+        'total_expense': total_expense,
+        'net_income': total_revenue - total_expense,
+    }
+
+
+def build_balance_sheet(rows):
+    """الميزانية العمومية من نتيجة get_accounts_balances"""
+    by_type = {'asset': [], 'liability': [], 'equity': [], 'revenue': [], 'expense': []}
+    for row in rows:
+        if row['account_type'] in by_type:
+            by_type[row['account_type']].append(row)
+    totals = {key: sum(row['balance'] for row in items) for key, items in by_type.items()}
+    return {
+        'assets': by_type['asset'],
+        'liabilities': by_type['liability'],
+        'equity': by_type['equity'],
+        'total_assets': totals['asset'],
+        'total_liabilities': totals['liability'],
+        'total_equity': totals['equity'],
+        'total_revenue': totals['revenue'],
+        'total_expense': totals['expense'],
+        'net_income': totals['revenue'] - totals['expense'],
+    }
+
+
+
+def parse_keyset_cursor(cursor):
+    """
+    مؤشر الصفحة 'YYYY-MM-DD:id' → (التاريخ، المعرف)
+
+    Raises:
+        ValueError: مؤشر غير صالح
+    """
+    try:
+        cursor_date, cursor_id = cursor.rsplit(':', 1)
+        return datetime.strptime(cursor_date, '%Y-%m-%d').date(), int(cursor_id)
+    except (AttributeError, ValueError):
+        raise ValueError('مؤشر الصفحة غير صحيح') from None
+
+
+def check_page_limit(limit):
+    """
+    التحقق من حجم صفحة الترقيم بالمؤشر
+
+    Raises:
+        ValueError: حجم صفحة أقل من 1
+    """
+    if limit < 1:
+        raise ValueError('حجم الصفحة يجب أن يكون 1 أو أكثر')
+
+
+def get_account_statement(account_id, date_from=None, date_to=None, limit=None, cursor=None):
+    """
+    كشف حساب مع رصيد جارٍ محسوب في قاعدة البيانات (دالة نافذة) وتقسيم بالمؤشر
+
+    Args:
+        account_id: معرف الحساب
+        date_from, date_to: حدود الفترة (اختيارية)
+        limit: عدد الحركات في الصفحة (None = كل الحركات)، 1 أو أكثر
+        cursor: مؤشر الصفحة السابقة 'YYYY-MM-DD:detail_id' - الصفحة تبدأ بعده
+
+    Returns:
+        dict: transactions, opening_balance (المُرحّل من الصفحات السابقة),
+              total_debit, total_credit, final_balance للفترة كاملة، next_cursor
+    """
+    from models import JournalEntry, JournalEntryDetail, db
+    from sqlalchemy import case, func
+
+    if limit is not None:
+        check_page_limit(limit)
+
+    amount = func.coalesce(JournalEntryDetail.debit, 0) - func.coalesce(JournalEntryDetail.credit, 0)
+    in_range = [JournalEntryDetail.account_id == account_id]
+    if date_from:
+        in_range.append(JournalEntry.date >= date_from)
+    if date_to:
+        in_range.append(JournalEntry.date <= date_to)
+
+    after_cursor = None
+    if cursor:
+        cursor_date, cursor_id = parse_keyset_cursor(cursor)
+        after_cursor = db.or_(
+            JournalEntry.date > cursor_date,
+            db.and_(JournalEntry.date == cursor_date, JournalEntryDetail.id > cursor_id)
+        )
+
+    # إجماليات الفترة والرصيد المُرحّل حتى المؤشر في استعلام واحد
+    carried = case((after_cursor, 0), else_=amount) if after_cursor is not None else db.literal(0)
+    total_debit, total_credit, opening_balance = db.session.query(
+        func.coalesce(func.sum(JournalEntryDetail.debit), 0),
+        func.coalesce(func.sum(JournalEntryDetail.credit), 0),
+        func.coalesce(func.sum(carried), 0),
+    ).join(JournalEntry, JournalEntry.id == JournalEntryDetail.entry_id).filter(*in_range).one()
+
+    # الرصيد الجاري داخل الصفحة + الرصيد المُرحّل من قبلها
+    order = (JournalEntry.date, JournalEntryDetail.id)
+    page = db.session.query(
+        JournalEntryDetail.id,
+        JournalEntry.date,
+        JournalEntry.entry_number,
+        func.coalesce(func.nullif(JournalEntryDetail.description, ''), JournalEntry.description).label('description'),
+        JournalEntryDetail.debit,
+        JournalEntryDetail.credit,
+        func.sum(amount).over(order_by=order, rows=(None, 0)).label('running'),
+    ).join(JournalEntry, JournalEntry.id == JournalEntryDetail.entry_id).filter(*in_range)
+    if after_cursor is not None:
+        page = page.filter(after_cursor)
+    page = page.order_by(*order)
+    if limit is not None:
+        page = page.limit(limit + 1)
+    rows = page.all()
+
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = f"{rows[-1].date.strftime('%Y-%m-%d')}:{rows[-1].id}"
+
+    transactions = [{
+        'id': row.id,
+        'date': row.date.strftime('%Y-%m-%d') if row.date else '',
+        'entry_number': row.entry_number or '',
+        'description': row.description or '',
+        'debit': float(row.debit or 0),
+        'credit': float(row.credit or 0),
+        'balance': float(opening_balance or 0) + float(row.running or 0),
+    } for row in rows]
+
+    return {
+        'transactions': transactions,
+        'opening_balance': float(opening_balance or 0),
+        'total_debit': float(total_debit or 0),
+        'total_credit': float(total_credit or 0),
+        'final_balance': float(total_debit or 0) - float(total_credit or 0),
+        'next_cursor': next_cursor,
+    }
+
+def list_journal_entries(date_from=None, date_to=None, account_id=None, reference_type=None,
+                         search=None, limit=200, cursor=None):
+    """
+    قائمة القيود اليومية (الأحدث أولاً) مع التفاصيل والحسابات محمّلة مسبقاً
+
+    Args:
+        date_from, date_to: فترة القيود
+        account_id: القيود التي تحتوي سطراً على هذا الحساب
+        reference_type: نوع المرجع
+        search: نص في رقم القيد أو وصفه
+        limit: حجم الصفحة
+        cursor: مؤشر الصفحة السابقة 'YYYY-MM-DD:entry_id' - الصفحة تبدأ بعده
+
+    Returns:
+        dict: entries (مع _totals و has_reverse)، count، total_debit، total_credit للنتائج كاملة، next_cursor
+    """
+    from models import JournalEntry, JournalEntryDetail, db
+    from sqlalchemy import func
+    from sqlalchemy.orm import selectinload
+
+    check_page_limit(limit)
+
+    query = JournalEntry.query
+    if date_from:
+        query = query.filter(JournalEntry.date >= date_from)
+    if date_to:
+        query = query.filter(JournalEntry.date <= date_to)
+    if reference_type:
+        query = query.filter(JournalEntry.reference_type == reference_type)
+    if account_id:
+        query = query.filter(JournalEntry.id.in_(
+            db.select(JournalEntryDetail.entry_id).where(JournalEntryDetail.account_id == account_id)
+        ))
+    if search:
+        pattern = f'%{search}%'
+        query = query.filter(db.or_(JournalEntry.entry_number.ilike(pattern), JournalEntry.description.ilike(pattern)))
+
+    # الإجماليات للنتائج كاملة (وليس للصفحة فقط)
+    count = query.count()
+    total_debit, total_credit = db.session.query(
+        func.coalesce(func.sum(JournalEntryDetail.debit), 0),
+        func.coalesce(func.sum(JournalEntryDetail.credit), 0),
+    ).filter(JournalEntryDetail.entry_id.in_(query.with_entities(JournalEntry.id))).one()
+
+    if cursor:
+        cursor_date, cursor_id = parse_keyset_cursor(cursor)
+        query = query.filter(db.or_(
+            JournalEntry.date < cursor_date,
+            db.and_(JournalEntry.date == cursor_date, JournalEntry.id < cursor_id)
+        ))
+
+    line_sum = lambda column: db.select(func.coalesce(func.sum(column), 0)).where(
+        JournalEntryDetail.entry_id == JournalEntry.id
+    ).correlate(JournalEntry).scalar_subquery()
+
+    rows = query.with_entities(
+        JournalEntry, line_sum(JournalEntryDetail.debit), line_sum(JournalEntryDetail.credit)
+    ).options(
+        selectinload(JournalEntry.details).selectinload(JournalEntryDetail.account)
+    ).order_by(JournalEntry.date.desc(), JournalEntry.id.desc()).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = f"{rows[-1][0].date.strftime('%Y-%m-%d')}:{rows[-1][0].id}"
+
+    entries = [entry for entry, _, _ in rows]
+    reversed_ids = {
+        ref_id for (ref_id,) in db.session.query(JournalEntry.reference_id).filter(
+            JournalEntry.reference_type == 'reverse',
+            JournalEntry.reference_id.in_([entry.id for entry in entries])
+        ).all()
+    } if entries else set()
+    for entry, debit, credit in rows:
+        entry._totals = (float(debit or 0), float(credit or 0))
+        entry.has_reverse = entry.id in reversed_ids
+
+    return {
+        'entries': entries,
+        'count': count,
+        'total_debit': float(total_debit or 0),
+        'total_credit': float(total_credit or 0),
+        'next_cursor': next_cursor,
+    }
+
+
+def list_work_plans(plan_type=None, status=None, limit=50, cursor=None, include_tasks=False):
+    """
+    قائمة خطط العمل (الأحدث أولاً) بترقيم المؤشر
+
+    أسماء الشركة/المنطقة/الموقع/المكلف/المنشئ تُحمّل بالربط في نفس الاستعلام،
+    وعدد المهام والمكتملة منها من استعلام فرعي مجمّع (بدون تحميل المهام).
+    المهام نفسها تُحمّل دفعة واحدة فقط عند include_tasks.
+
+    Args:
+        plan_type: daily, monthly, yearly
+        status: حالة الخطة
+        limit: حجم الصفحة
+        cursor: مؤشر الصفحة السابقة 'YYYY-MM-DD:plan_id' - الصفحة تبدأ بعده
+        include_tasks: تحميل المهام (العرض الكامل)
+
+    Returns:
+        dict: plans (مع _task_counts)، next_cursor
+    """
+    from models import WorkPlan, WorkPlanTask, db
+    from sqlalchemy import case, func
+    from sqlalchemy.orm import joinedload, selectinload
+
+    check_page_limit(limit)
+
+    task_counts = db.select(
+        WorkPlanTask.plan_id,
+        func.count(WorkPlanTask.id).label('tasks_count'),
+        func.sum(case((WorkPlanTask.is_completed == True, 1), else_=0)).label('completed_tasks'),
+    ).group_by(WorkPlanTask.plan_id).subquery()
+
+    query = db.session.query(
+        WorkPlan,
+        func.coalesce(task_counts.c.tasks_count, 0),
+        func.coalesce(task_counts.c.completed_tasks, 0),
+    ).outerjoin(task_counts, task_counts.c.plan_id == WorkPlan.id).options(
+        joinedload(WorkPlan.company), joinedload(WorkPlan.region), joinedload(WorkPlan.location),
+        joinedload(WorkPlan.assignee), joinedload(WorkPlan.creator),
+    )
+    if include_tasks:
+        query = query.options(selectinload(WorkPlan.tasks).options(
+            joinedload(WorkPlanTask.completer), joinedload(WorkPlanTask.assignee)
+        ))
+
+    if plan_type:
+        query = query.filter(WorkPlan.plan_type == plan_type)
+    if status:
+        query = query.filter(WorkPlan.status == status)
+    if cursor:
+        cursor_date, cursor_id = parse_keyset_cursor(cursor)
+        query = query.filter(db.or_(
+            WorkPlan.plan_date < cursor_date,
+            db.and_(WorkPlan.plan_date == cursor_date, WorkPlan.id < cursor_id)
+        ))
+
+    rows = query.order_by(WorkPlan.plan_date.desc(), WorkPlan.id.desc()).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = f"{rows[-1][0].plan_date.strftime('%Y-%m-%d')}:{rows[-1][0].id}"
+
+    for plan, tasks_count, completed_tasks in rows:
+        plan._task_counts = (int(tasks_count), int(completed_tasks))
+
+    return {
+        'plans': [plan for plan, _, _ in rows],
+        'next_cursor': next_cursor,
+    }
+
+
+# ==================== قائمة التدفقات النقدية ====================
+
+CASH_FLOW_INFLOWS = ('revenue',)
+CASH_FLOW_OUTFLOWS = ('salaries', 'supplier_payments')
+
+
+def _cash_flow_source(kind, start_date, end_date):
+    """
+    مصدر أحد بنود التدفق النقدي - (استعلام مفلتر بالفترة، التاريخ، المعرف، المبلغ، التصنيف، الوصف)
+    """
+    from models import (Account, JournalEntry, JournalEntryDetail, Salary, Employee,
+                        SupplierInvoice, SupplierInvoicePayment, Supplier, db)
+    from sqlalchemy import func
+
+    if kind == 'revenue':
+        # الإيرادات (الجانب الدائن لحسابات الإيرادات)
+        query = db.session.query(JournalEntryDetail).join(
+            JournalEntry, JournalEntry.id == JournalEntryDetail.entry_id
+        ).join(Account, Account.id == JournalEntryDetail.account_id).filter(
+            JournalEntry.date >= start_date,
+            JournalEntry.date <= end_date,
+            JournalEntryDetail.credit > 0,
+            Account.account_type == 'revenue',
+        )
+        return (query, JournalEntry.date, JournalEntryDetail.id, JournalEntryDetail.credit,
+                func.coalesce(Account.name_ar, Account.name), JournalEntryDetail.description)
+
+    if kind == 'salaries':
+        # الرواتب المصروفة
+        query = db.session.query(Salary).join(Employee, Employee.id == Salary.employee_id).filter(
+            Salary.paid_date >= start_date,
+            Salary.paid_date <= end_date,
+            Salary.is_paid == True,
+        )
+        return (query, Salary.paid_date, Salary.id, Salary.total_salary,
+                Salary.month_year, Employee.name)
+
+    if kind == 'supplier_payments':
+        # مدفوعات فواتير الموردين
+        query = db.session.query(SupplierInvoicePayment).join(
+            SupplierInvoice, SupplierInvoice.id == SupplierInvoicePayment.invoice_id
+        ).join(Supplier, Supplier.id == SupplierInvoice.supplier_id).filter(
+            SupplierInvoicePayment.payment_date >= start_date,
+            SupplierInvoicePayment.payment_date <= end_date,
+        )
+        return (query, SupplierInvoicePayment.payment_date, SupplierInvoicePayment.id,
+                SupplierInvoicePayment.amount, func.coalesce(Supplier.name_ar, Supplier.name),
+                SupplierInvoice.invoice_number)
+
+    raise ValueError(f"نوع تدفق غير معروف: {kind}")
+
+
+def get_cash_flow_summary(start_date, end_date):
+    """
+    ملخص التدفقات النقدية للفترة من قاعدة البيانات مباشرة
+
+    Returns:
+        dict: الإجماليات، والتوزيع حسب البند/التصنيف، وحسب الشهر
+    """
+    from sqlalchemy import func, extract
+
+    totals = {}
+    by_category = {}
+    months = {}
+    for kind in CASH_FLOW_INFLOWS + CASH_FLOW_OUTFLOWS:
+        query, date_col, _, amount_col, category_col, _ = _cash_flow_source(kind, start_date, end_date)
+        year, month = extract('year', date_col), extract('month', date_col)
+        rows = query.with_entities(
+            category_col, year, month, func.count(), func.coalesce(func.sum(amount_col), 0)
+        ).group_by(category_col, year, month).all()
+
+        categories = {}
+        for category, row_year, row_month, count, amount in rows:
+            amount = float(amount or 0)
+            bucket = categories.setdefault(category or '', {'category': category or '', 'count': 0, 'amount': 0.0})
+            bucket['count'] += count
+            bucket['amount'] += amount
+
+            key = (int(row_year), int(row_month))
+            month_bucket = months.setdefault(key, {'month': f'{key[0]}-{key[1]:02d}', 'inflows': 0.0, 'outflows': 0.0})
+            month_bucket['inflows' if kind in CASH_FLOW_INFLOWS else 'outflows'] += amount
+
+        by_category[kind] = sorted(categories.values(), key=lambda c: -c['amount'])
+        totals[kind] = sum(c['amount'] for c in by_category[kind])
+
+    total_inflows = sum(totals[kind] for kind in CASH_FLOW_INFLOWS)
+    total_outflows = sum(totals[kind] for kind in CASH_FLOW_OUTFLOWS)
+    by_month = [months[key] for key in sorted(months)]
+    for month in by_month:
+        month['net'] = month['inflows'] - month['outflows']
+
+    return {
+        'totals': totals,
+        'total_inflows': total_inflows,
+        'total_outflows': total_outflows,
+        'net_cash_flow': total_inflows - total_outflows,
+        'by_category': by_category,
+        'by_month': by_month,
+    }
+
+
+def get_cash_flow_details(kind, start_date, end_date, limit=50, cursor=None):
+    """
+    صفحة من سطور أحد بنود التدفق النقدي (تصفح بالمؤشر على التاريخ والمعرف)
+
+    Args:
+        kind: revenue / salaries / supplier_payments
+        cursor: مؤشر الصفحة السابقة 'YYYY-MM-DD:id' - الصفحة تبدأ بعده
+
+    Returns:
+        dict: items, next_cursor
+    """
+    from models import db
+
+    check_page_limit(limit)
+    query, date_col, id_col, amount_col, category_col, description_col = _cash_flow_source(kind, start_date, end_date)
+    if cursor:
+        cursor_date, cursor_id = parse_keyset_cursor(cursor)
+        query = query.filter(db.or_(
+            date_col > cursor_date,
+            db.and_(date_col == cursor_date, id_col > cursor_id)
+        ))
+
+    rows = query.with_entities(
+        id_col.label('id'), date_col.label('date'), amount_col.label('amount'),
+        category_col.label('category'), description_col.label('description')
+    ).order_by(date_col, id_col).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = f"{rows[-1].date.strftime('%Y-%m-%d')}:{rows[-1].id}"
+
+    return {
+        'items': [{
+            'id': row.id,
+            'date': row.date.strftime('%Y-%m-%d') if row.date else '',
+            'amount': float(row.amount or 0),
+            'category': row.category or '',
+            'description': row.description or '',
+        } for row in rows],
+        'next_cursor': next_cursor,
+    }
+
+# ==================== أرصدة الإجازات ====================
+
+def _missing_leave_balances_query(year, now, targets=None):
+    """
+    (موظف نشط × نوع إجازة نشط) بدون رصيد للسنة - anti-join جاهز لـ INSERT ... SELECT
+
+    الرصيد الابتدائي days_per_year، أو targets {leave_type_id: أيام} إن مُرّرت
+    """
+    from models import Employee, LeaveType, LeaveBalance
+
+    days = db.case(targets, value=LeaveType.id, else_=LeaveType.days_per_year) if targets else LeaveType.days_per_year
+    return db.select(
+        Employee.id, LeaveType.id, db.literal(year), days,
+        db.literal(0), days, db.literal(now)
+    ).select_from(Employee).join(LeaveType, db.true()).outerjoin(
+        LeaveBalance, db.and_(
+            LeaveBalance.employee_id == Employee.id,
+            LeaveBalance.leave_type_id == LeaveType.id,
+            LeaveBalance.year == year,
+        )
+    ).where(
+        Employee.is_active == True,
+        LeaveType.is_active == True,
+        LeaveBalance.id.is_(None),
+    )
+
+
+def initialize_leave_balances(year, dry_run=False, commit=True, targets=None):
+    """
+    إنشاء أرصدة الإجازات الناقصة لجميع الموظفين النشطين لسنة معينة
+
+    الأرصدة الموجودة لا تُمس، والناقصة تُدرج بعبارة INSERT ... SELECT واحدة
+    برصيد كامل (days_per_year) أو بالمستحق targets {leave_type_id: أيام}.
+
+    Returns:
+        int: عدد الأرصدة المنشأة (أو التي ستُنشأ عند dry_run)
+    """
+    from models import LeaveBalance
+    from sqlalchemy import func
+
+    missing = _missing_leave_balances_query(year, datetime.utcnow(), targets)
+    if dry_run:
+        return db.session.execute(db.select(func.count()).select_from(missing.subquery())).scalar()
+
+    result = db.session.execute(db.insert(LeaveBalance).from_select(
+        ['employee_id', 'leave_type_id', 'year', 'total_days', 'used_days', 'remaining_days', 'updated_at'],
+        missing
+    ))
+    if commit:
+        db.session.commit()
+    return result.rowcount
+
+
+def accrue_leave_balances(year, mode='yearly', as_of=None, dry_run=False, commit=True):
+    """
+    استحقاق أرصدة الإجازات لجميع الموظفين النشطين في بضع عبارات SQL
+
+    - yearly: الرصيد الكامل days_per_year من بداية السنة
+    - monthly: days_per_year × (الأشهر المنقضية حتى as_of) / 12
+
+    الأرصدة الناقصة تُنشأ أولاً بالمستحق مباشرة، ثم يُحدَّث total_days و remaining_days
+    (total_days - used_days) للأرصدة الموجودة المختلفة عن المستحق فقط - فيتطابق
+    تقرير dry_run مع التنفيذ.
+
+    Args:
+        year: سنة الرصيد
+        mode: 'yearly' أو 'monthly'
+        as_of: تاريخ الاستحقاق (افتراضياً اليوم) - للنظام الشهري
+        dry_run: تقرير بالتغييرات دون تنفيذها
+        commit: حفظ التغييرات
+
+    Returns:
+        dict: تقرير الاستحقاق (الأرصدة المنشأة/المحدثة وملخص لكل نوع إجازة)
+    """
+    from models import Employee, LeaveType, LeaveBalance
+    from sqlalchemy import func
+
+    if mode not in ('yearly', 'monthly'):
+        raise ValueError(f'نظام استحقاق غير معروف: {mode}')
+
+    as_of = as_of or datetime.now().date()
+    if mode == 'yearly':
+        months = 12
+    elif as_of.year == year:
+        months = as_of.month
+    else:
+        months = 12 if as_of.year > year else 0
+
+    leave_types = LeaveType.query.filter_by(is_active=True).all()
+    targets = {lt.id: round((lt.days_per_year or 0) * months / 12, 2) for lt in leave_types}
+
+    created = initialize_leave_balances(year, dry_run=dry_run, commit=False, targets=targets)
+
+    by_leave_type = []
+    updated = 0
+    if targets:
+        target = db.case(targets, value=LeaveBalance.leave_type_id)
+        changed = (
+            LeaveBalance.year == year,
+            LeaveBalance.leave_type_id.in_(list(targets)),
+            LeaveBalance.employee_id.in_(db.select(Employee.id).where(Employee.is_active == True)),
+            LeaveBalance.total_days.is_distinct_from(target),
+        )
+
+        # التقرير يُحسب قبل التحديث (وهو كل ما يُنفذ عند dry_run)
+        rows = db.session.query(
+            LeaveBalance.leave_type_id,
+            func.count(LeaveBalance.id),
+            func.coalesce(func.sum(target - func.coalesce(LeaveBalance.total_days, 0)), 0),
+        ).filter(*changed).group_by(LeaveBalance.leave_type_id).all()
+        changes = {leave_type_id: (count, delta) for leave_type_id, count, delta in rows}
+
+        for lt in leave_types:
+            count, delta = changes.get(lt.id, (0, 0))
+            by_leave_type.append({
+                'leave_type_id': lt.id,
+                'leave_type_name': lt.name_ar,
+                'target_days': targets[lt.id],
+                'balances': count,
+                'days_delta': round(float(delta), 2),
+            })
+        updated = sum(count for count, _ in changes.values())
+
+        if not dry_run and updated:
+            db.session.execute(
+                db.update(LeaveBalance).where(*changed).values(
+                    total_days=target,
+                    remaining_days=target - func.coalesce(LeaveBalance.used_days, 0),
+                ),
+                execution_options={'synchronize_session': False}
+            )
+
+    if commit and not dry_run:
+        db.session.commit()
+
+    return {
+        'year': year,
+        'mode': mode,
+        'as_of': as_of.isoformat(),
+        'months': months,
+        'dry_run': dry_run,
+        'created_balances': created,
+        'updated_balances': updated,
+        'by_leave_type': by_leave_type,
+    }
+
+
+# ==================== ذاكرة مؤقتة لإحصائيات لوحة التحكم ====================
+
+class StatsCache:
+    """
+    ذاكرة مؤقتة قصيرة العمر للإحصائيات
+
+    خلال ttl تُعاد القيمة المحفوظة مباشرة، وبعدها (حتى stale_ttl) تُعاد القيمة
+    القديمة بينما تُحدّث في الخلفية؛ بعد ذلك تُحسب القيمة مباشرة.
+
+    نسخة مطابقة في new_app/backend/stats_cache.py (تطبيق مستقل لا يستورد utils)
+    - أي تعديل هنا يُنقل إليها.
+    """
+
+    def __init__(self, ttl=30, stale_ttl=300):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._entries = {}
+        self._refreshing = set()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, compute):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            age = now - entry[0] if entry else None
+            if entry and age < self.ttl:
+                return entry[1]
+            if entry and age < self.stale_ttl:
+                if key not in self._refreshing:
+                    self._refreshing.add(key)
+                    self._refresh_in_background(key, compute, self._generation)
+                return entry[1]
+            generation = self._generation
+
+        value = compute()
+        self._store(key, value, generation)
+        return value
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+
+    def _store(self, key, value, generation):
+        with self._lock:
+            self._refreshing.discard(key)
+            # لا تُحفظ نتيجة بدأ حسابها قبل آخر إلغاء
+            if generation == self._generation:
+                self._entries[key] = (time.monotonic(), value)
+
+    def _refresh_in_background(self, key, compute, generation):
+        app = current_app._get_current_object()
+
+        def run():
+            with app.app_context():
+                try:
+                    value = compute()
+                except Exception:
+                    current_app.logger.exception('تعذر تحديث الإحصائيات: %s', key)
+                    with self._lock:
+                        self._refreshing.discard(key)
+                    return
+            self._store(key, value, generation)
+
+        threading.Thread(target=run, daemon=True).start()
+
+
+dashboard_stats_cache = StatsCache()
+
+# الجداول التي يلغي أي تعديل عليها إحصائيات لوحة التحكم
+DASHBOARD_TABLES = {'attendances', 'salaries', 'financial_transactions', 'work_plans', 'work_plan_tasks'}
+
+
+def _mark_dashboard_writes(session, tables):
+    if DASHBOARD_TABLES.intersection(tables):
+        session.info['dashboard_dirty'] = True
+
+
+@event.listens_for(db.orm.Session, 'after_flush')
+def _dashboard_after_flush(session, flush_context):
+    _mark_dashboard_writes(session, {
+        obj.__table__.name
+        for obj in list(session.new) + list(session.dirty) + list(session.deleted)
+        if hasattr(obj, '__table__')
+    })
+
+
+@event.listens_for(db.orm.Session, 'do_orm_execute')
+def _dashboard_bulk_execute(orm_execute_state):
+    # الكتابة المجمعة (insert/update/delete عبر session.execute) لا تمر بـ flush
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        table = getattr(orm_execute_state.statement, 'table', None)
+        if table is not None:
+            _mark_dashboard_writes(orm_execute_state.session, {getattr(table, 'name', None)})
+
+
+@event.listens_for(db.orm.Session, 'after_commit')
+def _dashboard_after_commit(session):
+    if session.info.pop('dashboard_dirty', False):
+        dashboard_stats_cache.invalidate()
+
+
+@event.listens_for(db.orm.Session, 'after_soft_rollback')
+def _dashboard_after_rollback(session, previous_transaction):
+    # الكتابات الملغاة لا تغيّر الإحصائيات - لا يُلغى الكاش عند commit لاحق
+    if not session.in_transaction():
+        session.info.pop('dashboard_dirty', None)